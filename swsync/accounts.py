@@ -15,15 +15,27 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 import datetime
+import functools
+import json
 import logging
 import os
+import socket
+import sys
 import time
 
 import dateutil.relativedelta
+import eventlet
 import keystoneclient.v2_0.client
 import swiftclient
 
 import swsync.containers
+import swsync.leases
+import swsync.metrics
+import swsync.plan
+import swsync.retry
+import swsync.state
+import swsync.utils
+import swsync.workers
 from utils import get_config
 
 
@@ -32,6 +44,38 @@ class Accounts(object):
     def __init__(self):
         self.keystone_cnx = None
         self.container_cls = swsync.containers.Containers()
+        self.stats = dict.fromkeys(('accounts', 'accounts_failed',
+                                    'containers', 'containers_failed',
+                                    'containers_skipped'), 0)
+        # Called with stats after each account.
+        self.report = None
+        self.concurrency = int(get_config('concurrency',
+                                          'sync_account_concurrency',
+                                          default=1))
+        self.container_concurrency = int(get_config(
+            'concurrency', 'sync_container_concurrency', default=1))
+        state_db = get_config('sync', 'state_db', default='')
+        self.state = state_db and swsync.state.SyncState(state_db) or None
+        self.container_cls.state = self.state
+        failed_log = get_config('sync', 'failed_log', default='')
+        self.failed_log = failed_log and swsync.retry.FailedLog(
+            failed_log) or None
+        self.container_cls.failed_log = self.failed_log
+        # Transient errors of the accounts listings are retried within
+        # the run as the objects operations.
+        self.policies = swsync.retry.load_policies()
+        self.use_last_modified = get_config(
+            'sync', 'use_last_modified', default='false').lower() in (
+                'true', 'yes', 'on', '1')
+        # Accounts are claimed in the lease table shared by the nodes.
+        lease_db = get_config('sync', 'lease_db', default='')
+        self.lease_ttl = int(get_config('sync', 'lease_ttl', default=300))
+        self.leases = None
+        if lease_db:
+            owner = get_config('sync', 'lease_owner', default='%s:%d' % (
+                socket.gethostname(), os.getpid()))
+            self.leases = swsync.leases.SQLiteLeases(lease_db, owner,
+                                                     self.lease_ttl)
 
     def get_swift_auth(self, auth_url, tenant, user, password):
         """Get swift connexion from args."""
@@ -61,32 +105,78 @@ class Accounts(object):
                 ret[key] = value
         return ret
 
+    def _count(self, key):
+        self.stats[key] += 1
+        swsync.utils.get_metrics().incr(key)
+
     def sync_account(self, orig_storage_url, orig_token,
                      dest_storage_url, dest_token):
         """Sync a single account with url/tok to dest_url/dest_tok."""
+        with swsync.utils.get_metrics().timer('account_sync'):
+            failed = self._sync_account(orig_storage_url, orig_token,
+                                        dest_storage_url,
+                                        dest_token) is False
+        self._count('accounts')
+        if failed:
+            self._count('accounts_failed')
+            if self.failed_log is not None:
+                self.failed_log.write({'account': os.path.basename(
+                    orig_storage_url.replace("AUTH_", ''))})
+        if self.report is not None:
+            self.report(self.stats)
+        return not failed
+
+    def _renew_lease(self, tenant_id):
+        while True:
+            eventlet.sleep(self.lease_ttl / 3.0)
+            if not self.leases.renew(tenant_id):
+                logging.info("ERROR: lost the lease of account %s",
+                             tenant_id)
+                return
+
+    def sync_leased_account(self, tenant_id, orig_storage_url, orig_token,
+                            dest_storage_url, dest_token):
+        """Sync an account if no other node has claimed it."""
+        if not self.leases.claim(tenant_id):
+            logging.debug("account %s claimed by another node", tenant_id)
+            return
+        heartbeat = eventlet.spawn(self._renew_lease, tenant_id)
+        synced = False
+        try:
+            synced = self.sync_account(orig_storage_url, orig_token,
+                                       dest_storage_url, dest_token)
+        finally:
+            heartbeat.kill()
+            # A failed account can be retried by another node right away,
+            # a synced one is left alone until the next pass.
+            self.leases.release(tenant_id, synced=synced)
+
+    def _sync_account(self, orig_storage_url, orig_token,
+                      dest_storage_url, dest_token):
         orig_storage_cnx = swiftclient.http_connection(orig_storage_url)
         dest_storage_cnx = swiftclient.http_connection(dest_storage_url)
         account_id = os.path.basename(orig_storage_url.replace("AUTH_", ''))
 
         try:
-            orig_account_headers, orig_containers = (
-                swiftclient.get_account(None, orig_token,
-                                        http_conn=orig_storage_cnx,
-                                        full_listing=True))
-
-            dest_account_headers, dest_containers = (
-                swiftclient.get_account(None, dest_token,
-                                        http_conn=dest_storage_cnx,
-                                        full_listing=True))
+            orig_account_headers, orig_containers = swsync.retry.call(
+                self.policies, swiftclient.get_account,
+                None, orig_token, http_conn=orig_storage_cnx,
+                full_listing=True)
+
+            dest_account_headers, dest_containers = swsync.retry.call(
+                self.policies, swiftclient.get_account,
+                None, dest_token, http_conn=dest_storage_cnx,
+                full_listing=True)
         except(swiftclient.client.ClientException), e:
                 logging.info("error getting account: %s, %s" % (
                     account_id, e.http_reason))
-                return
+                return False
 
-        self.container_cls.delete_container(dest_storage_cnx,
-                                            dest_token,
-                                            orig_containers,
-                                            dest_containers)
+        failed = self.container_cls.delete_container(
+            dest_storage_cnx, dest_token, orig_containers, dest_containers,
+            dest_storage_url=dest_storage_url, account_id=account_id)
+        for container in failed:
+            self._count('containers_failed')
 
         do_headers = False
         if len(dest_account_headers) != len(orig_account_headers):
@@ -109,7 +199,8 @@ class Accounts(object):
             new_headers = dict(dest_metadata_headers.items() +
                                orig_metadata_headers.items())
             try:
-                swiftclient.post_account(
+                swsync.retry.call(
+                    self.policies, swiftclient.post_account,
                     "", dest_token, new_headers,
                     http_conn=dest_storage_cnx,
                 )
@@ -119,29 +210,97 @@ class Accounts(object):
                     account_id, e.http_reason))
                 # We don't pass on because since the server was busy
                 # let's pass it on for the next pass
-                return
+                return False
 
+        dest_counts = dict((x['name'], x.get('count'))
+                           for x in dest_containers)
+        # Containers listings are produced concurrently, their objects
+        # go through the work queue shared with the other accounts. A
+        # producer goes on with the next container once the objects of
+        # one are submitted, the rest of its sync is left to finishing.
+        pool = eventlet.GreenPool(size=self.container_concurrency)
+        finishing = eventlet.GreenPool()
         for container in orig_containers:
-            logging.info("Syncronizing container %s: %s",
-                         container['name'], container)
-            dt1 = datetime.datetime.fromtimestamp(time.time())
-            self.container_cls.sync(orig_storage_cnx,
-                                    orig_storage_url,
-                                    orig_token,
-                                    dest_storage_cnx,
-                                    dest_storage_url, dest_token,
-                                    container['name'])
-
-            dt2 = datetime.datetime.fromtimestamp(time.time())
-            rd = dateutil.relativedelta.relativedelta(dt2, dt1)
-            #TODO(chmou): use logging
-            logging.info("%s done: %d hours, %d minutes and %d seconds",
-                         container['name'],
-                         rd.hours,
-                         rd.minutes, rd.seconds)
-
-    def process(self):
-        """Process all keystone accounts to sync."""
+            if self.container_concurrency > 1:
+                # Each producer needs its own listing connections.
+                orig_storage_cnx = swiftclient.http_connection(
+                    orig_storage_url)
+                dest_storage_cnx = swiftclient.http_connection(
+                    dest_storage_url)
+            pool.spawn_n(self.sync_container, account_id,
+                         orig_storage_cnx, orig_storage_url, orig_token,
+                         dest_storage_cnx, dest_storage_url, dest_token,
+                         container, dest_counts.get(container['name']),
+                         finishing)
+        pool.waitall()
+        finishing.waitall()
+
+    def sync_container(self, account_id, orig_storage_cnx,
+                       orig_storage_url, orig_token, dest_storage_cnx,
+                       dest_storage_url, dest_token, container,
+                       dest_count, finishing=None):
+        """Sync a container of the account listing if it has changed.
+
+        With finishing, a GreenPool, return once the objects operations
+        are submitted and wait for them in a green thread of finishing.
+        """
+        last_modified = None
+        if self.state is not None and self.use_last_modified:
+            last_modified = self.container_cls.get_last_modified(
+                orig_storage_cnx, orig_token, container['name'])
+
+        if (self.state is not None and
+                dest_count == container['count'] and
+                self.state.unchanged(account_id, container, last_modified)):
+            logging.info("Skipping unchanged container %s",
+                         container['name'])
+            self._count('containers_skipped')
+            return
+
+        logging.info("Syncronizing container %s: %s",
+                     container['name'], container)
+        dt1 = datetime.datetime.fromtimestamp(time.time())
+        wait = self.container_cls.sync(orig_storage_cnx,
+                                       orig_storage_url,
+                                       orig_token,
+                                       dest_storage_cnx,
+                                       dest_storage_url, dest_token,
+                                       container['name'],
+                                       account_id=account_id, wait=False)
+        if finishing is None:
+            self._container_synced(account_id, container, last_modified,
+                                   dt1, wait)
+        else:
+            finishing.spawn_n(self._container_synced, account_id, container,
+                              last_modified, dt1, wait)
+
+    def _container_synced(self, account_id, container, last_modified, dt1,
+                          wait):
+        checksum = wait()
+        self._count('containers')
+        if not checksum:
+            self._count('containers_failed')
+        elif self.state is not None:
+            self.state.set(account_id, container['name'],
+                           container['count'], container['bytes'],
+                           checksum, last_modified)
+
+        dt2 = datetime.datetime.fromtimestamp(time.time())
+        swsync.utils.get_metrics().timing(
+            'container_sync', (dt2 - dt1).total_seconds())
+        rd = dateutil.relativedelta.relativedelta(dt2, dt1)
+        #TODO(chmou): use logging
+        logging.info("%s done: %d hours, %d minutes and %d seconds",
+                     container['name'],
+                     rd.hours,
+                     rd.minutes, rd.seconds)
+
+    def get_admin_auth(self):
+        """Get the admin tokens and the accounts storage urls prefixes.
+
+        Return (orig_url, orig_token, dest_url, dest_token) where the
+        urls are to be completed with the tenant id.
+        """
         orig_auth_url = get_config('auth', 'keystone_origin')
         orig_admin_tenant, orig_admin_user, orig_admin_password = (
             get_config('auth', 'keystone_origin_admin_credentials').split(':'))
@@ -157,19 +316,391 @@ class Accounts(object):
 
         bare_oa_st_url = oa_st_url[:oa_st_url.find('AUTH_')] + "AUTH_"
         bare_dst_st_url = dst_st_url[:dst_st_url.find('AUTH_')] + "AUTH_"
+        return (bare_oa_st_url, orig_admin_token,
+                bare_dst_st_url, dest_admin_token)
+
+    def process(self, shard=None):
+        """Process all keystone accounts to sync.
+
+        shard is an optional (index, count) tuple to only process the
+        tenants of that shard.
+        """
+        (bare_oa_st_url, orig_admin_token,
+         bare_dst_st_url, dest_admin_token) = self.get_admin_auth()
 
         self.keystone_cnx = self.get_ks_auth_orig()
 
+        # Accounts are synced concurrently, the objects transfers of
+        # all of them share the global budget (see utils.get_budget).
+        pool = eventlet.GreenPool(size=self.concurrency)
+        if self.leases is not None:
+            self.leases.begin_pass()
+        try:
+            self._process(pool, shard, bare_oa_st_url, orig_admin_token,
+                          bare_dst_st_url, dest_admin_token)
+        finally:
+            if self.leases is not None:
+                self.leases.end_pass()
+
+    def _process(self, pool, shard, bare_oa_st_url, orig_admin_token,
+                 bare_dst_st_url, dest_admin_token):
         for tenant in self.keystone_cnx.tenants.list():
+            if (shard is not None and
+                    swsync.workers.shard_of(tenant.id, shard[1]) != shard[0]):
+                continue
             user_orig_st_url = bare_oa_st_url + tenant.id
             user_dst_st_url = bare_dst_st_url + tenant.id
 
-            self.sync_account(user_orig_st_url,
-                              orig_admin_token,
-                              user_dst_st_url,
-                              dest_admin_token)
+            if self.leases is not None:
+                pool.spawn_n(self.sync_leased_account, tenant.id,
+                             user_orig_st_url, orig_admin_token,
+                             user_dst_st_url, dest_admin_token)
+                continue
+            pool.spawn_n(self.sync_account,
+                         user_orig_st_url,
+                         orig_admin_token,
+                         user_dst_st_url,
+                         dest_admin_token)
+        pool.waitall()
+
+    def plan_account(self, writer, account_id, orig_storage_url, orig_token,
+                     dest_storage_url, dest_token, verify=False):
+        """Write to writer the actions a sync of an account would do.
+
+        With verify, write the divergences found by Containers.verify
+        instead.
+        """
+        orig_storage_cnx = swiftclient.http_connection(orig_storage_url)
+        dest_storage_cnx = swiftclient.http_connection(dest_storage_url)
+        try:
+            _, orig_containers = swiftclient.get_account(
+                None, orig_token, http_conn=orig_storage_cnx,
+                full_listing=True)
+            _, dest_containers = swiftclient.get_account(
+                None, dest_token, http_conn=dest_storage_cnx,
+                full_listing=True)
+        except(swiftclient.client.ClientException), e:
+            logging.info("error getting account: %s, %s" % (
+                account_id, e.http_reason))
+            writer.error(account_id, None, e)
+            writer.account_done(account_id)
+            return
+
+        orig_names = set(x['name'] for x in orig_containers)
+        plans = [(x['name'], self.container_cls.plan_delete(
+                  dest_storage_cnx, dest_token, x['name']))
+                 for x in dest_containers if x['name'] not in orig_names]
+        if verify:
+            plans += [(x['name'], self.container_cls.verify(
+                       orig_storage_cnx, orig_storage_url, orig_token,
+                       dest_storage_cnx, dest_storage_url, dest_token,
+                       x['name'])) for x in orig_containers]
+        else:
+            plans += [(x['name'], self.container_cls.plan(
+                       orig_storage_cnx, orig_token, dest_storage_cnx,
+                       dest_token, x['name'])) for x in orig_containers]
+        for container_name, actions in plans:
+            try:
+                for action, obj in actions:
+                    if action == 'error':
+                        writer.error(account_id, container_name,
+                                     'HEAD failed: %s' % obj['name'])
+                        continue
+                    writer.add(account_id, container_name, action, obj)
+            except(swiftclient.client.ClientException), e:
+                logging.info("ERROR: listing container: %s, %s" % (
+                    container_name, e.http_reason))
+                writer.error(account_id, container_name, e)
+        writer.account_done(account_id)
+
+    def plan(self, fp, verify=False):
+        """Write to fp the plan of a sync of all the accounts.
+
+        Nothing is written to the clusters. Return the estimated
+        seconds to apply it, from the throughput of the previous runs
+        recorded in the state_db, or None. With verify the plan is the
+        divergences between the clusters (see Containers.verify).
+        """
+        writer = swsync.plan.PlanWriter(fp)
+        (bare_oa_st_url, orig_admin_token,
+         bare_dst_st_url, dest_admin_token) = self.get_admin_auth()
+        self.keystone_cnx = self.get_ks_auth_orig()
+        pool = eventlet.GreenPool(size=self.concurrency)
+        for tenant in self.keystone_cnx.tenants.list():
+            pool.spawn_n(self.plan_account, writer, tenant.id,
+                         bare_oa_st_url + tenant.id, orig_admin_token,
+                         bare_dst_st_url + tenant.id, dest_admin_token,
+                         verify)
+        pool.waitall()
+        return writer.close(self.state and self.state.throughput())
+
+    def _apply_done(self, account_id, batch):
+        if batch.wait():
+            self.container_cls.record_failed_jobs(account_id, batch)
+            return False
+        return True
+
+    def apply(self, fp, shard=None):
+        """Apply the actions of a plan read from fp.
+
+        The actions are streamed to the workers as they are read,
+        without listing the accounts nor the containers. shard is an
+        optional (index, count) tuple to only apply the actions of the
+        accounts of that shard. The actions failing are written to the
+        failed operations file. Return False if some of them failed.
+        """
+        (bare_oa_st_url, orig_admin_token,
+         bare_dst_st_url, dest_admin_token) = self.get_admin_auth()
+        accounts = {}
+        batches = {}
+        # Deletes waiting to be sent by bulk of each container.
+        deletes = {}
+        failed = False
+
+        def _submit_deletes(key):
+            account_id, container_name = key
+            _, _, dest_storage_url, dest_storage_cnx = accounts[account_id]
+            self.container_cls.submit_deletes(
+                batches[key], dest_storage_cnx, dest_storage_url,
+                dest_admin_token, container_name, deletes.pop(key))
+
+        for line in fp:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            # Skip the summaries and the listings errors.
+            if 'action' not in entry:
+                continue
+            account_id = entry['account']
+            if (shard is not None and
+                    swsync.workers.shard_of(account_id,
+                                            shard[1]) != shard[0]):
+                continue
+            if account_id not in accounts:
+                orig_storage_url = bare_oa_st_url + account_id
+                dest_storage_url = bare_dst_st_url + account_id
+                accounts[account_id] = (
+                    orig_storage_url,
+                    swiftclient.http_connection(orig_storage_url),
+                    dest_storage_url,
+                    swiftclient.http_connection(dest_storage_url))
+            (orig_storage_url, orig_storage_cnx,
+             dest_storage_url, dest_storage_cnx) = accounts[account_id]
+            container_name = entry['container']
+            key = (account_id, container_name)
+
+            if entry['action'] == 'create_container':
+                if not self.container_cls.create_container(
+                        orig_storage_cnx, orig_admin_token,
+                        dest_storage_cnx, dest_admin_token, container_name):
+                    self.container_cls.record_failure(account_id,
+                                                      container_name)
+                    failed = True
+            elif entry['action'] == 'delete_container':
+                # The container can only go once its objects are gone.
+                if key in deletes:
+                    _submit_deletes(key)
+                batch = batches.pop(key, None)
+                if batch is not None and not self._apply_done(account_id,
+                                                              batch):
+                    failed = True
+                elif not self.container_cls.delete_empty_container(
+                        dest_storage_cnx, dest_admin_token, container_name):
+                    failed = True
+            else:
+                batch = batches.get(key)
+                if batch is None:
+                    batch = batches[key] = (
+                        self.container_cls.work_queue.batch())
+                if entry['action'] == 'delete':
+                    names = deletes.setdefault(key, [])
+                    names.append(entry['name'])
+                    if len(names) >= self.container_cls.bulk_delete_size(
+                            dest_storage_url):
+                        _submit_deletes(key)
+                    continue
+                self.container_cls.submit_entry(
+                    batch, orig_storage_url, orig_admin_token,
+                    dest_storage_cnx, dest_storage_url, dest_admin_token,
+                    entry)
+        for key in deletes.keys():
+            _submit_deletes(key)
+        for (account_id, _), batch in batches.iteritems():
+            if not self._apply_done(account_id, batch):
+                failed = True
+        return not failed
+
+    def record_run(self, run_id, worker=0):
+        """Record the throughput of this process for the estimates.
+
+        The objects checksums verified are summed up in the logs and in
+        the integrity report.
+        """
+        metrics = swsync.utils.get_metrics()
+        verified, unverified, mismatches = [
+            metrics.value('objects_%s' % x)
+            for x in ('verified', 'unverified', 'mismatch')]
+        logging.info("INTEGRITY: %d objects verified, %d unverified, "
+                     "%d mismatches", verified, unverified, mismatches)
+        report = swsync.utils.get_integrity_report()
+        if report is not None:
+            report.summary(run_id, worker, verified, unverified,
+                           mismatches)
+        if self.state is None:
+            return
+        objects = sum(metrics.value(x) for x in (
+            'objects_copied', 'objects_posted', 'objects_deleted'))
+        self.state.record_run(run_id, worker, objects,
+                              metrics.value('bytes_copied'))
+
+    def retry_failed(self, entries):
+        """Sync again the accounts, containers and objects of entries.
+
+        entries are read from a failed operations file, the ones
+        failing again are written to the failed operations file.
+        """
+        (bare_oa_st_url, orig_admin_token,
+         bare_dst_st_url, dest_admin_token) = self.get_admin_auth()
+        by_account = {}
+        for entry in entries:
+            by_account.setdefault(entry['account'], []).append(entry)
+        pool = eventlet.GreenPool(size=self.concurrency)
+        for account_id, account_entries in by_account.iteritems():
+            pool.spawn_n(self._retry_account, account_id, account_entries,
+                         bare_oa_st_url + account_id, orig_admin_token,
+                         bare_dst_st_url + account_id, dest_admin_token)
+        pool.waitall()
+
+    def _retry_account(self, account_id, entries, orig_storage_url,
+                       orig_token, dest_storage_url, dest_token):
+        if [x for x in entries if 'container' not in x]:
+            # The account itself failed, sync it all again.
+            self.sync_account(orig_storage_url, orig_token,
+                              dest_storage_url, dest_token)
+            return
+        orig_storage_cnx = swiftclient.http_connection(orig_storage_url)
+        dest_storage_cnx = swiftclient.http_connection(dest_storage_url)
+        deletes = [{'name': x['container']} for x in entries
+                   if x.get('action') == 'delete_container']
+        if deletes:
+            self.container_cls.delete_container(
+                dest_storage_cnx, dest_token, [], deletes,
+                dest_storage_url=dest_storage_url, account_id=account_id)
+        containers = set(x['container'] for x in entries
+                         if 'action' not in x)
+        for container_name in sorted(containers):
+            logging.info("retrying container %s", container_name)
+            self.container_cls.sync(orig_storage_cnx, orig_storage_url,
+                                    orig_token, dest_storage_cnx,
+                                    dest_storage_url, dest_token,
+                                    container_name, account_id=account_id)
+        objects = [x for x in entries
+                   if x.get('action') not in (None, 'delete_container') and
+                   x['container'] not in containers]
+        if objects:
+            self.container_cls.retry(orig_storage_url, orig_token,
+                                     dest_storage_cnx, dest_storage_url,
+                                     dest_token, account_id, objects)
+
+
+def start_metrics(index=0):
+    """Start the metrics exporters configured in [metrics].
+
+    The HTTP endpoint of the process index listens on http_port + index.
+    """
+    metrics = swsync.utils.get_metrics()
+    port = int(get_config('metrics', 'http_port', default=0))
+    if port:
+        swsync.metrics.serve(metrics,
+                             get_config('metrics', 'http_host',
+                                        default='127.0.0.1'),
+                             port + index)
+    if metrics.statsd is not None:
+        eventlet.spawn_n(swsync.metrics.report_gauges, metrics)
+
+
+def _process_shard(index, count, report, run_id=None):
+    start_metrics(index)
+    acc = Accounts()
+    acc.report = report
+    acc.process(shard=(index, count))
+    acc.record_run(run_id, index)
+
+
+def _plan(path, verify=False):
+    acc = Accounts()
+    fp = path == '-' and sys.stdout or open(path, 'w')
+    try:
+        seconds = acc.plan(fp, verify=verify)
+    finally:
+        if fp is not sys.stdout:
+            fp.close()
+    prefix = verify and "VERIFY" or "PLAN"
+    if seconds is None:
+        logging.info("%s: no previous run to estimate its duration", prefix)
+    else:
+        logging.info("%s: estimated duration: %s", prefix,
+                     datetime.timedelta(seconds=int(seconds)))
+    return 0
+
+
+def _apply_shard(index, count, report, path=None, shard=None,
+                 run_id=None):
+    # Shard i of n split again in count workers: the accounts of the
+    # worker shard i + n * index of n * count are all in shard i of n.
+    start_metrics(index)
+    acc = Accounts()
+    acc.report = report
+    with open(path) as fp:
+        applied = acc.apply(fp, shard=(shard[0] + shard[1] * index,
+                                       shard[1] * count))
+    acc.record_run(run_id, index)
+    return applied and 0 or 1
+
+
+def _apply(path, workers=1, shard=None, run_id=None):
+    if workers > 1 or shard is not None:
+        return swsync.workers.run(workers, functools.partial(
+            _apply_shard, path=path, shard=shard or (0, 1),
+            run_id=run_id))
+    start_metrics()
+    acc = Accounts()
+    with open(path) as fp:
+        applied = acc.apply(fp)
+    acc.record_run(run_id)
+    return applied and 0 or 1
+
 
+def main(workers=1, retry_failed=False, plan=None, apply=None, shard=None,
+         verify=None):
+    """Sync all the accounts, sharded on workers processes if > 1.
 
-def main():
+    With retry_failed only sync the operations of the failed operations
+    file instead. With plan, only write the sync plan to that file ('-'
+    for stdout). With verify, only write the divergences between the
+    clusters to that file, as a plan. With apply, only apply the
+    actions of that plan file, of the accounts of shard ((index,
+    count)) if set. Return the exit status.
+    """
+    if plan is not None:
+        return _plan(plan)
+    if verify is not None:
+        return _plan(verify, verify=True)
+    if apply is not None:
+        return _apply(apply, workers, shard, time.time())
+    if retry_failed:
+        acc = Accounts()
+        if acc.failed_log is None:
+            logging.info("ERROR: failed_log is not set in [sync]")
+            return 1
+        acc.retry_failed(swsync.retry.take_failed(acc.failed_log.path))
+        return 0
+    run_id = time.time()
+    if workers > 1:
+        return swsync.workers.run(workers, functools.partial(
+            _process_shard, run_id=run_id))
+    start_metrics()
     acc = Accounts()
     acc.process()
+    acc.record_run(run_id)
+    return 0
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+class BufferPool(object):
+    """Reusable bytearrays of size bytes for the objects transfers.
+
+    A buffer is allocated when none is free, at most count of them are
+    kept once given back.
+    """
+    def __init__(self, size, count):
+        self.size = size
+        self.count = count
+        self._free = []
+
+    def get(self):
+        if self._free:
+            return self._free.pop()
+        return bytearray(self.size)
+
+    def put(self, buf):
+        if len(self._free) < self.count:
+            self._free.append(buf)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import collections
+import logging
+import socket
+import time
+
+import eventlet
+import eventlet.event
+
+# Statuses of a cluster asking us to slow down.
+OVERLOAD_STATUSES = (498, 503)
+
+
+def is_overload(error):
+    """Check if an exception means the cluster is overloaded."""
+    if isinstance(error, (eventlet.Timeout, socket.timeout)):
+        return True
+    return getattr(error, 'http_status', None) in OVERLOAD_STATUSES
+
+
+class AIMDController(object):
+    """Adapt the amount of jobs running at once to the cluster health.
+
+    The limit is raised by increase after each round of limit jobs
+    done with an error rate under max_error_rate and, if latency_target
+    is set, an average latency under it. It is multiplied by decrease
+    on an overload (503, 498 or timeout), once for all the jobs started
+    before the previous decrease.
+    """
+    def __init__(self, initial, minimum, maximum, latency_target=0,
+                 increase=1, decrease=0.5, max_error_rate=0.05):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.latency_target = latency_target
+        self.increase = increase
+        self.decrease = decrease
+        self.max_error_rate = max_error_rate
+        self.running = 0
+        self._waiters = collections.deque()
+        self._decreased_at = 0
+        self._reset_round()
+
+    def _reset_round(self):
+        self._done = 0
+        self._errors = 0
+        self._latency = 0.0
+
+    def acquire(self):
+        """Wait for a free slot, return the time the job started."""
+        while self.running >= int(self.limit):
+            waiter = eventlet.event.Event()
+            self._waiters.append(waiter)
+            waiter.wait()
+        self.running += 1
+        return time.time()
+
+    def release(self, started, failed=False, error=None):
+        """Record the outcome of a job started at started."""
+        self.running -= 1
+        now = time.time()
+        if is_overload(error):
+            if started >= self._decreased_at:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self._decreased_at = now
+                self._reset_round()
+                logging.info("CONCURRENCY: backing off to %d: %s",
+                             self.limit, error)
+        else:
+            self._done += 1
+            self._errors += failed and 1 or 0
+            self._latency += now - started
+            if self._done >= int(self.limit):
+                self._adjust()
+        self._wake()
+
+    def _adjust(self):
+        latency = self._latency / self._done
+        error_rate = float(self._errors) / self._done
+        healthy = (error_rate <= self.max_error_rate and
+                   (not self.latency_target or
+                    latency <= self.latency_target))
+        if healthy and self.limit < self.maximum:
+            self.limit = min(self.maximum, self.limit + self.increase)
+            logging.info("CONCURRENCY: raising to %d: latency %.3fs, "
+                         "errors %d/%d", self.limit, latency,
+                         self._errors, self._done)
+        elif not healthy:
+            logging.info("CONCURRENCY: holding at %d: latency %.3fs, "
+                         "errors %d/%d", self.limit, latency,
+                         self._errors, self._done)
+        self._reset_round()
+
+    def _wake(self):
+        free = int(self.limit) - self.running
+        while free > 0 and self._waiters:
+            self._waiters.popleft().send()
+            free -= 1
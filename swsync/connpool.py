@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import contextlib
+import logging
+import time
+import urlparse
+
+import eventlet.semaphore
+
+
+class ConnectionPool(object):
+    """Per host pool of persistent HTTP connections.
+
+    connect is called with an url to open a new connection to its
+    host, connections are given back with put() once the response has
+    been fully read so they can be reused by the next request to the
+    same host.
+    """
+    def __init__(self, connect, max_per_host=10, idle_timeout=20):
+        self.connect = connect
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.hosts = {}
+
+    def _host(self, url):
+        parsed = urlparse.urlparse(url)
+        key = (parsed.scheme, parsed.netloc)
+        if key not in self.hosts:
+            self.hosts[key] = (
+                eventlet.semaphore.Semaphore(self.max_per_host), [])
+        return self.hosts[key]
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception, e:
+            logging.debug("error closing connection: %s", e)
+
+    def close_idle(self):
+        """Close the connections unused for more than idle_timeout."""
+        expire = time.time() - self.idle_timeout
+        for _, idle in self.hosts.itervalues():
+            while idle and idle[0][0] < expire:
+                self._close(idle.pop(0)[1])
+
+    def get(self, url):
+        """Get a connection to the host of url.
+
+        Block while max_per_host connections to this host are in use.
+        The reused attribute of the connection is set when it has been
+        used before, the server may have closed it since.
+        """
+        semaphore, idle = self._host(url)
+        semaphore.acquire()
+        self.close_idle()
+        if idle:
+            conn = idle.pop()[1]
+            conn.reused = True
+            return conn
+        try:
+            conn = self.connect(url)
+        except Exception:
+            semaphore.release()
+            raise
+        conn.reused = False
+        return conn
+
+    def put(self, url, conn, broken=False):
+        """Give back a connection got with get().
+
+        A broken connection (error while talking to the server or
+        response not fully read) is closed instead of being reused.
+        """
+        semaphore, idle = self._host(url)
+        if broken:
+            self._close(conn)
+        else:
+            idle.append((time.time(), conn))
+        semaphore.release()
+
+    @contextlib.contextmanager
+    def item(self, url):
+        """Context manager around get() and put()."""
+        conn = self.get(url)
+        try:
+            yield conn
+        except BaseException:
+            self.put(url, conn, broken=True)
+            raise
+        self.put(url, conn)
+
+    def close(self):
+        """Close all the idle connections."""
+        for _, idle in self.hosts.itervalues():
+            while idle:
+                self._close(idle.pop()[1])
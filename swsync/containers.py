@@ -14,13 +14,114 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import collections
+import functools
+import hashlib
 import logging
+import random
+import urlparse
 
 import eventlet
 import swiftclient
 
+import swsync.concurrency
+import swsync.connpool
 import swsync.objects
+import swsync.retry
 import swsync.utils
+import swsync.workqueue
+
+
+def iter_listing(storage_cnx, token, container_name, objects, limit,
+                 limiter=None, policies=None):
+    """Iterate over a container listing fetching it page by page.
+
+    objects is the first page of the listing as returned with the
+    container headers, the next pages are fetched with a marker as
+    they are consumed so only a page is kept in memory at once. Their
+    transient errors are retried according to policies.
+    """
+    while objects:
+        for obj in objects:
+            yield obj
+        if len(objects) < limit:
+            return
+        if limiter is not None:
+            limiter.request()
+        _, objects = swsync.retry.call(
+            policies or {}, swiftclient.get_container,
+            None, token, container_name,
+            marker=objects[-1]['name'], limit=limit,
+            http_conn=storage_cnx)
+
+
+def checksum_listing(objects, checksum):
+    """Update checksum with the listing entries while iterating."""
+    for obj in objects:
+        checksum.update(('%s\0%s\0%s\n' % (
+            obj['name'], obj.get('hash', ''),
+            obj['last_modified'])).encode('utf-8'))
+        yield obj
+
+
+DIFF_MODES = ('last_modified', 'hash')
+
+
+def join_listings(orig_objects, dest_objects):
+    """Merge-join two container listings sorted by name.
+
+    Yield (orig, dest) pairs of the entries with the same name, None
+    on the side missing it.
+    """
+    orig_objects = iter(orig_objects)
+    dest_objects = iter(dest_objects)
+    orig = next(orig_objects, None)
+    dest = next(dest_objects, None)
+    while orig is not None or dest is not None:
+        if dest is None or (orig is not None and
+                            orig['name'] < dest['name']):
+            yield (orig, None)
+            orig = next(orig_objects, None)
+        elif orig is None or dest['name'] < orig['name']:
+            yield (None, dest)
+            dest = next(dest_objects, None)
+        else:
+            yield (orig, dest)
+            orig = next(orig_objects, None)
+            dest = next(dest_objects, None)
+
+
+def same_content(orig, dest):
+    """Check if two listing entries have the same hash and bytes."""
+    return (orig.get('hash') is not None and
+            orig.get('hash') == dest.get('hash') and
+            orig.get('bytes') == dest.get('bytes'))
+
+
+def diff_listings(orig_objects, dest_objects, mode='last_modified'):
+    """Diff two container listings sorted by name.
+
+    Yield ('copy', obj) for origin objects missing on destination or
+    different and ('delete', obj) for destination objects no longer on
+    origin. Objects are different when their last_modified differ or,
+    in hash mode, when their hash or bytes differ.
+
+    Objects with the same hash and bytes yield ('post', obj) when the
+    origin one has been modified after the destination one, only their
+    metadata may need to be synced. They are skipped when the
+    destination one is the newest, it has been copied since.
+    """
+    for orig, dest in join_listings(orig_objects, dest_objects):
+        if dest is None:
+            yield ('copy', orig)
+        elif orig is None:
+            yield ('delete', dest)
+        elif same_content(orig, dest):
+            if orig['last_modified'] > dest['last_modified']:
+                yield ('post', orig)
+        elif (mode == 'hash' or
+              orig['last_modified'] != dest['last_modified']):
+            yield ('copy', orig)
 
 
 class Containers(object):
@@ -29,41 +130,450 @@ class Containers(object):
         self.concurrency = int(swsync.utils.get_config(
                                "concurrency",
                                "sync_swift_client_concurrency"))
+        self.segment_concurrency = int(swsync.utils.get_config(
+            "concurrency", "sync_segment_concurrency",
+            default=self.concurrency))
+        self.diff_mode = swsync.utils.get_config(
+            "sync", "diff_mode", default="last_modified")
+        if self.diff_mode not in DIFF_MODES:
+            raise swsync.utils.ConfigurationError(
+                "Invalid diff_mode: %s" % self.diff_mode)
+        # Objects bigger than range_threshold are fetched with
+        # range_concurrency parallel Range requests of range_size.
+        self.range_threshold = int(swsync.utils.get_config(
+            "sync", "range_threshold", default=0))
+        self.range_size = int(swsync.utils.get_config(
+            "sync", "range_size", default=67108864))
+        self.range_concurrency = int(swsync.utils.get_config(
+            "concurrency", "sync_range_concurrency", default=4))
+        # Swift won't return more than 10000 entries per listing page.
+        self.listing_limit = min(int(swsync.utils.get_config(
+                                     "sync", "listing_limit",
+                                     default=10000)), 10000)
+        # Stamped by the last-modified middleware on container writes.
+        self.last_modified_header = 'x-container-meta-%s' % (
+            swsync.utils.get_config("sync", "last_modified_key",
+                                    default="Last-Modified").lower())
+        # Keep-alive connections shared by all the transfers, enough
+        # for the max of the adaptive concurrency.
+        adaptive_max = swsync.utils.get_adaptive_max()
+        max_per_host = max(int(swsync.utils.get_config(
+                               "concurrency",
+                               "sync_max_connections_per_host",
+                               default=self.concurrency)),
+                           adaptive_max or 0)
+        idle_timeout = int(swsync.utils.get_config(
+                           "sync", "connection_idle_timeout", default=20))
+        self.orig_conn_pool = swsync.connpool.ConnectionPool(
+            swsync.objects.http_connect, max_per_host, idle_timeout)
+        self.dest_conn_pool = swsync.connpool.ConnectionPool(
+            swsync.objects.http_connect, max_per_host, idle_timeout)
+        # A single queue and set of workers for the whole run.
+        queue_size = int(swsync.utils.get_config(
+            "sync", "work_queue_size", default=self.concurrency * 10))
+        workers = self.concurrency
+        controller = None
+        if adaptive_max is not None:
+            # Start at sync_swift_client_concurrency and adapt between
+            # the min and max to the destination health.
+            workers = adaptive_max
+            controller = swsync.concurrency.AIMDController(
+                self.concurrency,
+                int(swsync.utils.get_config(
+                    "concurrency", "sync_min_swift_client_concurrency",
+                    default=1)),
+                workers,
+                latency_target=float(swsync.utils.get_config(
+                    "concurrency", "sync_latency_target", default=0)))
+        # Transient errors of the listings and of the objects operations
+        # are retried within the run.
+        self.policies = swsync.retry.load_policies()
+        self.work_queue = swsync.workqueue.WorkQueue(
+            workers, queue_size, controller, self.policies)
+        metrics = swsync.utils.get_metrics()
+        metrics.gauge('queue_depth', self.work_queue.queue.qsize)
+        metrics.gauge('active_jobs', lambda: self.work_queue.active)
+        # Set by Accounts to checkpoint the containers syncs every
+        # checkpoint_interval objects operations.
+        self.state = None
+        # Set by Accounts to write the operations still failing after
+        # their retries, see swsync.retry.FailedLog.
+        self.failed_log = None
+        self.checkpoint_interval = int(swsync.utils.get_config(
+            "sync", "checkpoint_interval", default=1000))
+        # Rate limits of the clusters shared with swsync.objects.
+        self.orig_limiter = swsync.utils.get_limiter('origin')
+        self.dest_limiter = swsync.utils.get_limiter('destination')
         self.sync_object = swsync.objects.sync_object
         self.delete_object = swsync.objects.delete_object
+        self.bulk_delete = swsync.objects.bulk_delete
+        # Objects deleted per bulk-delete request, when the destination
+        # supports it. Detected on the first deletes.
+        self.max_bulk_delete = int(swsync.utils.get_config(
+            "sync", "bulk_delete_size", default=10000))
+        self._bulk_delete_size = None
+        self.archive_objects = swsync.objects.archive_objects
+        # Objects up to archive_threshold bytes are copied archive_size
+        # at a time by uploading them as a tar archive, when the
+        # destination extracts them. Detected on the first of them.
+        self.archive_threshold = int(swsync.utils.get_config(
+            "sync", "archive_threshold", default=0))
+        self.archive_size = int(swsync.utils.get_config(
+            "sync", "archive_size", default=100))
+        self._archive_supported = None
+        # Containers gone from origin drained at the same time.
+        self.delete_concurrency = int(swsync.utils.get_config(
+            "concurrency", "sync_delete_container_concurrency",
+            default=self.concurrency))
+        self.sync_object_metadata = swsync.objects.sync_object_metadata
+        self.verify_object_metadata = swsync.objects.verify_object_metadata
+        # Part of the objects whose metadata are compared by verify.
+        self.verify_sample_rate = float(swsync.utils.get_config(
+            "verify", "sample_rate", default=0.01))
+
+    def bulk_delete_size(self, dest_storage_url):
+        """Get the objects to delete per request, 1 without bulk-delete."""
+        if self._bulk_delete_size is None:
+            size = 0
+            if self.max_bulk_delete > 1:
+                size = min(self.max_bulk_delete,
+                           swsync.objects.bulk_delete_limit(dest_storage_url))
+            if size > 1:
+                logging.info("deleting objects by bulks of %d", size)
+            self._bulk_delete_size = max(size, 1)
+        return self._bulk_delete_size
+
+    def _bulk_delete(self, dest_storage_url, dest_token, container_name,
+                     object_names):
+        try:
+            failed = self.bulk_delete(dest_storage_url, dest_token,
+                                      container_name, object_names,
+                                      conn_pool=self.dest_conn_pool)
+        except((swiftclient.client.ClientException, eventlet.Timeout,
+                ValueError) + swsync.retry.NETWORK_ERRORS), e:
+            logging.info("ERROR: bulk delete: %s, %s, deleting objects "
+                         "one by one" % (container_name, e))
+            failed = self._delete_each(dest_storage_url, dest_token,
+                                       container_name, object_names)
+        if failed:
+            # Leave only the objects which failed in the job arguments
+            # for record_failed_jobs.
+            object_names[:] = failed
+            return False
+
+    def _delete_each(self, dest_storage_url, dest_token, container_name,
+                     object_names):
+        """Delete objects one by one, return the ones which failed."""
+        dest_storage_cnx = (urlparse.urlparse(dest_storage_url), None)
+        failed = []
+        for name in object_names:
+            try:
+                self.delete_object(dest_storage_cnx, dest_token,
+                                   container_name, name,
+                                   conn_pool=self.dest_conn_pool)
+            except((swiftclient.client.ClientException, eventlet.Timeout) +
+                   swsync.retry.NETWORK_ERRORS), e:
+                logging.info("ERROR: deleting object: %s, %s" % (name, e))
+                failed.append(name)
+        return failed
+
+    def archive_supported(self, dest_storage_url):
+        """Tell if the small objects are copied by archive uploads."""
+        if self._archive_supported is None:
+            self._archive_supported = bool(
+                self.archive_threshold and self.archive_size > 1 and
+                dest_storage_url is not None and
+                swsync.objects.bulk_upload_supported(dest_storage_url))
+            if self._archive_supported:
+                logging.info("copying objects up to %d bytes by archives of "
+                             "%d", self.archive_threshold, self.archive_size)
+        return self._archive_supported
+
+    def _archive(self, orig_storage_url, orig_token, dest_storage_url,
+                 dest_token, container_name, object_names):
+        try:
+            left = self.archive_objects(orig_storage_url, orig_token,
+                                        dest_storage_url, dest_token,
+                                        container_name, object_names,
+                                        orig_conn_pool=self.orig_conn_pool,
+                                        dest_conn_pool=self.dest_conn_pool)
+        except((swiftclient.client.ClientException, eventlet.Timeout,
+                ValueError) + swsync.retry.NETWORK_ERRORS), e:
+            logging.info("ERROR: uploading archive: %s, %s" % (
+                container_name, e))
+            left = list(object_names)
+        # Copy one by one the objects which couldn't be archived.
+        failed = []
+        for object_name_etag in left:
+            try:
+                if self.sync_object(orig_storage_url, orig_token,
+                                    dest_storage_url, dest_token,
+                                    container_name, object_name_etag,
+                                    orig_conn_pool=self.orig_conn_pool,
+                                    dest_conn_pool=self.dest_conn_pool,
+                                    segment_concurrency=(
+                                        self.segment_concurrency)) is False:
+                    failed.append(object_name_etag)
+            except((swiftclient.client.ClientException, eventlet.Timeout) +
+                   swsync.retry.NETWORK_ERRORS), e:
+                logging.info("ERROR: sync object: %s, %s" % (
+                    object_name_etag[1], e))
+                failed.append(object_name_etag)
+        if failed:
+            # Leave only the objects which failed in the job arguments
+            # for record_failed_jobs.
+            object_names[:] = failed
+            return False
+
+    def submit_deletes(self, batch, dest_storage_cnx, dest_storage_url,
+                       dest_token, container_name, object_names):
+        """Submit to batch the deletes of objects of a container.
+
+        They are sent by bulk-delete requests when the destination
+        supports it, one by one otherwise or without dest_storage_url.
+        """
+        if dest_storage_url is not None and len(object_names) > 1:
+            size = self.bulk_delete_size(dest_storage_url)
+        else:
+            size = 1
+        if size > 1:
+            for start in xrange(0, len(object_names), size):
+                batch.submit(self._bulk_delete, dest_storage_url,
+                             dest_token, container_name,
+                             object_names[start:start + size])
+            return
+        for name in object_names:
+            batch.submit(self.delete_object,
+                         dest_storage_cnx,
+                         dest_token,
+                         container_name,
+                         name,
+                         conn_pool=self.dest_conn_pool)
 
     def delete_container(self, dest_storage_cnx, dest_token,
                          orig_containers,
-                         dest_containers):
+                         dest_containers, dest_storage_url=None,
+                         account_id=None):
+        """Delete from destination the containers gone from origin.
+
+        With dest_storage_url, delete_container_concurrency containers
+        are drained at the same time, each with its own listing
+        connection: their listings are walked page by page, their
+        objects deletes go to the shared work queue and each container
+        is deleted once its objects are. Return the names of the ones
+        which couldn't be deleted, with account_id and a failed_log they
+        are written to the failed operations file.
+        """
         set1 = set((x['name']) for x in orig_containers)
         set2 = set((x['name']) for x in dest_containers)
-        delete_diff = set2 - set1
+        delete_diff = sorted(set2 - set1)
 
-        pool = eventlet.GreenPool(size=self.concurrency)
-        pile = eventlet.GreenPile(pool)
-        for container in delete_diff:
-            try:
-                dest_container_stats, dest_objects = swiftclient.get_container(
-                    None, dest_token, container, http_conn=dest_storage_cnx,
-                )
-            except(swiftclient.client.ClientException), e:
-                logging.info("error getting container: %s, %s" % (
-                    container, e.http_reason))
-                continue
+        concurrency = dest_storage_url and self.delete_concurrency or 1
+        pool = eventlet.GreenPool(size=concurrency)
+        drain = functools.partial(self._drain_container, dest_storage_cnx,
+                                  dest_storage_url, dest_token, account_id,
+                                  concurrency > 1)
+        failed = []
+        for container, drained in zip(delete_diff,
+                                      pool.imap(drain, delete_diff)):
+            if not drained:
+                self.record_failure(account_id, container,
+                                    'delete_container')
+                failed.append(container)
+        return failed
+
+    def _drain_container(self, dest_storage_cnx, dest_storage_url,
+                         dest_token, account_id, own_cnx, container):
+        if own_cnx:
+            dest_storage_cnx = swiftclient.http_connection(dest_storage_url)
+        self.dest_limiter.request()
+        try:
+            _, dest_objects = swsync.retry.call(
+                self.policies, swiftclient.get_container,
+                None, dest_token, container, limit=self.listing_limit,
+                http_conn=dest_storage_cnx)
+        except(swiftclient.client.ClientException), e:
+            logging.info("error getting container: %s, %s" % (
+                container, e.http_reason))
+            return False
 
-            for obj in dest_objects:
+        batch = self.work_queue.batch()
+        bulk_size = None
+        names = []
+        try:
+            for obj in iter_listing(dest_storage_cnx, dest_token, container,
+                                    dest_objects, self.listing_limit,
+                                    limiter=self.dest_limiter,
+                                    policies=self.policies):
                 logging.info("deleting obj: %s ts:%s", obj['name'],
                              obj['last_modified'])
-                pile.spawn(self.delete_object,
-                           dest_storage_cnx,
-                           dest_token,
-                           container,
-                           obj['name'])
-            pool.waitall()
-            logging.info("deleting container: %s", container)
-            pile.spawn(swiftclient.delete_container,
-                       '', dest_token, container, http_conn=dest_storage_cnx)
-        pool.waitall()
+                if bulk_size is None:
+                    bulk_size = (dest_storage_url and
+                                 self.bulk_delete_size(dest_storage_url) or 1)
+                names.append(obj['name'])
+                if len(names) >= bulk_size:
+                    self.submit_deletes(batch, dest_storage_cnx,
+                                        dest_storage_url, dest_token,
+                                        container, names)
+                    names = []
+            if names:
+                self.submit_deletes(batch, dest_storage_cnx,
+                                    dest_storage_url, dest_token,
+                                    container, names)
+        except(swiftclient.client.ClientException), e:
+            logging.info("ERROR: listing container: %s, %s" % (
+                container, e.http_reason))
+            batch.errors.append(container)
+        if batch.wait():
+            # Objects are left, the container can't be deleted yet.
+            self.record_failed_jobs(account_id, batch)
+            return False
+        return self.delete_empty_container(dest_storage_cnx, dest_token,
+                                           container)
+
+    def get_last_modified(self, storage_cnx, token, container_name):
+        """Get the stamp set by the last-modified middleware.
+
+        Return None when the container doesn't have it (middleware not
+        installed or container not written since) or on error.
+        """
+        self.orig_limiter.request()
+        try:
+            headers = swiftclient.head_container(
+                "", token, container_name, http_conn=storage_cnx)
+        except(swiftclient.client.ClientException), e:
+            logging.info("ERROR: getting container: %s, %s" % (
+                container_name, e.http_reason))
+            return None
+        return headers.get(self.last_modified_header)
+
+    def checkpoint(self, account_id, container_name, batch, names):
+        """Record the marker of the objects all done in batch.
+
+        names is a deque of (job sequence number, object name) in
+        listing order, the names done are consumed and so are the ones
+        the marker can't reach after a failed job.
+        """
+        failed = batch.first_failed()
+        while failed is not None and names and names[-1][0] >= failed:
+            names.pop()
+        done = batch.low_water_mark()
+        marker = None
+        while names and names[0][0] < done:
+            marker = names.popleft()[1]
+        if marker is not None:
+            self.state.set_marker(account_id, container_name, marker)
+
+    def _plan_listings(self, orig_storage_cnx, orig_token, dest_storage_cnx,
+                       dest_token, container_name):
+        """Get the listings iterators of a container on both sides.
+
+        Return (dest_missing, orig_objects, dest_objects), dest_missing
+        is True when the container is not on destination.
+        """
+        self.orig_limiter.request()
+        _, orig_objects = swiftclient.get_container(
+            None, orig_token, container_name, limit=self.listing_limit,
+            http_conn=orig_storage_cnx)
+        self.dest_limiter.request()
+        try:
+            _, dest_objects = swiftclient.get_container(
+                None, dest_token, container_name, limit=self.listing_limit,
+                http_conn=dest_storage_cnx)
+        except(swiftclient.client.ClientException), e:
+            if e.http_status != 404:
+                raise
+            return (True, iter_listing(orig_storage_cnx, orig_token,
+                                       container_name, orig_objects,
+                                       self.listing_limit,
+                                       limiter=self.orig_limiter), [])
+        return (False,
+                iter_listing(orig_storage_cnx, orig_token, container_name,
+                             orig_objects, self.listing_limit,
+                             limiter=self.orig_limiter),
+                iter_listing(dest_storage_cnx, dest_token, container_name,
+                             dest_objects, self.listing_limit,
+                             limiter=self.dest_limiter))
+
+    def plan(self, orig_storage_cnx, orig_token, dest_storage_cnx,
+             dest_token, container_name):
+        """Diff a container without syncing anything.
+
+        Yield (action, obj) like diff_listings, preceded by
+        ('create_container', None) when the container is missing on
+        destination. Raise ClientException when a listing fails.
+        """
+        dest_missing, orig_objects, dest_objects = self._plan_listings(
+            orig_storage_cnx, orig_token, dest_storage_cnx, dest_token,
+            container_name)
+        if dest_missing:
+            yield ('create_container', None)
+        for action in diff_listings(orig_objects, dest_objects,
+                                    self.diff_mode):
+            yield action
+
+    def verify(self, orig_storage_cnx, orig_storage_url, orig_token,
+               dest_storage_cnx, dest_storage_url, dest_token,
+               container_name):
+        """Compare a container on both sides without syncing anything.
+
+        Yield (action, obj) like plan for the divergences: objects
+        missing on destination or with another hash or bytes are to
+        copy, the ones only on destination to delete. verify_sample_rate
+        of the other objects are HEADed on both sides by the workers,
+        the ones with different metadata are to post. ('error', obj) is
+        yielded for the objects which couldn't be HEADed. Raise
+        ClientException when a listing fails.
+        """
+        dest_missing, orig_objects, dest_objects = self._plan_listings(
+            orig_storage_cnx, orig_token, dest_storage_cnx, dest_token,
+            container_name)
+        if dest_missing:
+            yield ('create_container', None)
+        diverging = collections.deque()
+
+        def _verify_object(obj):
+            action = self.verify_object_metadata(
+                orig_storage_url, orig_token, dest_storage_url, dest_token,
+                container_name, obj['name'],
+                orig_conn_pool=self.orig_conn_pool,
+                dest_conn_pool=self.dest_conn_pool)
+            if action is False:
+                diverging.append(('error', obj))
+            elif action is not None:
+                diverging.append((action, obj))
+
+        batch = self.work_queue.batch()
+        for orig, dest in join_listings(orig_objects, dest_objects):
+            if dest is None:
+                yield ('copy', orig)
+            elif orig is None:
+                yield ('delete', dest)
+            elif not same_content(orig, dest):
+                yield ('copy', orig)
+            elif random.random() < self.verify_sample_rate:
+                batch.submit(_verify_object, orig)
+            while diverging:
+                yield diverging.popleft()
+        # The objects still failing after their retries.
+        errors = batch.wait()
+        while diverging:
+            yield diverging.popleft()
+        for args in errors:
+            yield ('error', args[0])
+
+    def plan_delete(self, dest_storage_cnx, dest_token, container_name):
+        """Yield the actions deleting a container gone from origin."""
+        self.dest_limiter.request()
+        _, objects = swiftclient.get_container(
+            None, dest_token, container_name, limit=self.listing_limit,
+            http_conn=dest_storage_cnx)
+        for obj in iter_listing(dest_storage_cnx, dest_token,
+                                container_name, objects,
+                                self.listing_limit,
+                                limiter=self.dest_limiter):
+            yield ('delete', obj)
+        yield ('delete_container', None)
 
     def container_headers_clean(self, container_headers, to_null=False):
         ret = {}
@@ -74,22 +584,187 @@ class Containers(object):
                 ret[key] = value
         return ret
 
+    def record_failure(self, account_id, container_name, action=None,
+                       name=None):
+        """Write an operation failed to the failed operations file."""
+        if self.failed_log is None or account_id is None:
+            return
+        entry = {'account': account_id, 'container': container_name}
+        if action is not None:
+            entry.update(action=action, name=name)
+        self.failed_log.write(entry)
+
+    def record_failed_jobs(self, account_id, batch):
+        """Write the objects operations failed in batch."""
+        actions = {self.sync_object: 'copy',
+                   self.sync_object_metadata: 'post',
+                   self.delete_object: 'delete',
+                   self._archive: 'copy',
+                   self._bulk_delete: 'delete'}
+        for func, args, _ in batch.failed_jobs:
+            # The operations all end with container and object name,
+            # (last_modified, name) for sync_object and a list of them
+            # for _bulk_delete and _archive.
+            container_name, name = args[-2:]
+            if isinstance(name, list):
+                for object_name in name:
+                    if isinstance(object_name, tuple):
+                        object_name = object_name[1]
+                    self.record_failure(account_id, container_name,
+                                        actions.get(func), object_name)
+                continue
+            if isinstance(name, tuple):
+                name = name[1]
+            self.record_failure(account_id, container_name,
+                                actions.get(func), name)
+
     def sync(self, orig_storage_cnx, orig_storage_url,
              orig_token, dest_storage_cnx, dest_storage_url, dest_token,
-             container_name):
+             container_name, account_id=None, wait=True):
+        """Sync a container from origin to destination.
+
+        Return the checksum of the origin listing when everything has
+        been synced or None when something failed. With wait False it
+        returns once the objects operations are all submitted, with a
+        function waiting for them and returning the checksum, so the
+        caller can list the next container meanwhile.
+
+        With account_id and a state the progress is checkpointed, a sync
+        that didn't complete is resumed from its last checkpoint. The
+        checksum then only covers the listing after the checkpoint.
 
+        With account_id and a failed_log the objects operations that
+        failed, or the container if it couldn't be walked, are written
+        to the failed operations file.
+        """
+        finish = self._sync(orig_storage_cnx, orig_storage_url,
+                            orig_token, dest_storage_cnx,
+                            dest_storage_url, dest_token, container_name,
+                            account_id)
+        if wait:
+            return self._finish_sync(account_id, container_name, finish)
+        return functools.partial(self._finish_sync, account_id,
+                                 container_name, finish)
+
+    def _finish_sync(self, account_id, container_name, finish):
+        checksum = None
+        if finish is not None:
+            checksum = finish()
+        if checksum is None:
+            self.record_failure(account_id, container_name)
+        return checksum or None
+
+    def submit_entry(self, batch, orig_storage_url, orig_token,
+                     dest_storage_cnx, dest_storage_url, dest_token, entry):
+        """Submit to batch the object operation of a plan entry.
+
+        entry has the container, action (copy, post or delete) and name
+        of the object, and optionally its bytes and last_modified.
+        """
+        container_name, name = entry['container'], entry['name']
+        if entry['action'] == 'copy':
+            batch.submit(self.sync_object,
+                         orig_storage_url, orig_token,
+                         dest_storage_url, dest_token, container_name,
+                         (entry.get('last_modified'), name),
+                         orig_conn_pool=self.orig_conn_pool,
+                         dest_conn_pool=self.dest_conn_pool,
+                         segment_concurrency=self.segment_concurrency,
+                         object_bytes=entry.get('bytes'),
+                         range_threshold=self.range_threshold,
+                         range_size=self.range_size,
+                         range_concurrency=self.range_concurrency)
+        elif entry['action'] == 'post':
+            batch.submit(self.sync_object_metadata,
+                         orig_storage_url, orig_token,
+                         dest_storage_url, dest_token, container_name,
+                         name,
+                         orig_conn_pool=self.orig_conn_pool,
+                         dest_conn_pool=self.dest_conn_pool)
+        else:
+            batch.submit(self.delete_object,
+                         dest_storage_cnx, dest_token, container_name,
+                         name, conn_pool=self.dest_conn_pool)
+
+    def create_container(self, orig_storage_cnx, orig_token,
+                         dest_storage_cnx, dest_token, container_name):
+        """Create a container on destination with the origin metadata."""
+        self.orig_limiter.request()
+        self.dest_limiter.request()
+        try:
+            headers = swiftclient.head_container(
+                "", orig_token, container_name, http_conn=orig_storage_cnx)
+            swiftclient.put_container(
+                "", dest_token, container_name,
+                headers=self.container_headers_clean(headers),
+                http_conn=dest_storage_cnx)
+        except(swiftclient.client.ClientException), e:
+            logging.info("ERROR: creating container: %s, %s" % (
+                container_name, e.http_reason))
+            return False
+        return True
+
+    def delete_empty_container(self, dest_storage_cnx, dest_token,
+                               container_name):
+        """Delete a container from destination once its objects are."""
+        logging.info("deleting container: %s", container_name)
+        self.dest_limiter.request()
+        try:
+            swiftclient.delete_container(
+                "", dest_token, container_name, http_conn=dest_storage_cnx)
+        except(swiftclient.client.ClientException), e:
+            logging.info("ERROR: deleting container: %s, %s" % (
+                container_name, e.http_reason))
+            return False
+        return True
+
+    def retry(self, orig_storage_url, orig_token, dest_storage_cnx,
+              dest_storage_url, dest_token, account_id, entries):
+        """Retry objects operations of a failed operations file.
+
+        entries are the failed operations of an account, the ones
+        failing again are written to the failed operations file.
+        Return False if some of them failed.
+        """
+        batch = self.work_queue.batch()
+        for entry in entries:
+            logging.info("retrying: %s %s/%s", entry['action'],
+                         entry['container'], entry['name'])
+            self.submit_entry(batch, orig_storage_url, orig_token,
+                              dest_storage_cnx, dest_storage_url,
+                              dest_token, entry)
+        if not batch.wait():
+            return True
+        self.record_failed_jobs(account_id, batch)
+        return False
+
+    def _sync(self, orig_storage_cnx, orig_storage_url,
+              orig_token, dest_storage_cnx, dest_storage_url, dest_token,
+              container_name, account_id):
+        marker = None
+        if self.state is not None and account_id is not None:
+            marker = self.state.get_marker(account_id, container_name)
+            if marker is not None:
+                logging.info("resuming container %s after %s",
+                             container_name, marker)
+
+        self.orig_limiter.request()
         try:
-            orig_container_headers, orig_objects = swiftclient.get_container(
-                None, orig_token, container_name, http_conn=orig_storage_cnx,
+            orig_container_headers, orig_objects = swsync.retry.call(
+                self.policies, swiftclient.get_container,
+                None, orig_token, container_name, limit=self.listing_limit,
+                marker=marker, http_conn=orig_storage_cnx,
             )
         except(swiftclient.client.ClientException), e:
             logging.info("ERROR: getting container: %s, %s" % (
                 container_name, e.http_reason))
             return
 
+        self.dest_limiter.request()
         try:
             # Check that the container exists on dest
-            swiftclient.head_container(
+            swsync.retry.call(
+                self.policies, swiftclient.head_container,
                 "", dest_token, container_name, http_conn=dest_storage_cnx
             )
         except(swiftclient.client.ClientException), e:
@@ -99,18 +774,22 @@ class Containers(object):
                 del container_headers[h]
             p = dest_storage_cnx[0]
             url = "%s://%s%s" % (p.scheme, p.netloc, p.path)
+            self.dest_limiter.request()
             try:
-                swiftclient.put_container(url,
-                                          dest_token, container_name,
-                                          headers=container_headers)
+                swsync.retry.call(self.policies, swiftclient.put_container,
+                                  url, dest_token, container_name,
+                                  headers=container_headers)
             except(swiftclient.client.ClientException), e:
                 logging.info("ERROR: creating container: %s, %s" % (
                     container_name, e.http_reason))
                 return
 
+        self.dest_limiter.request()
         try:
-            dest_container_headers, dest_objects = swiftclient.get_container(
-                None, dest_token, container_name, http_conn=dest_storage_cnx,
+            dest_container_headers, dest_objects = swsync.retry.call(
+                self.policies, swiftclient.get_container,
+                None, dest_token, container_name, limit=self.listing_limit,
+                marker=marker, http_conn=dest_storage_cnx,
             )
         except(swiftclient.client.ClientException), e:
             logging.info("ERROR: creating container: %s, %s" % (
@@ -134,8 +813,10 @@ class Containers(object):
                 dest_container_headers, to_null=True)
             new_headers = dict(dest_metadata_headers.items() +
                                orig_metadata_headers.items())
+            self.dest_limiter.request()
             try:
-                swiftclient.post_container(
+                swsync.retry.call(
+                    self.policies, swiftclient.post_container,
                     "", dest_token, container_name, new_headers,
                     http_conn=dest_storage_cnx,
                 )
@@ -147,33 +828,140 @@ class Containers(object):
                 # let's pass it on for the next pass
                 return
 
-        set1 = set((x['last_modified'], x['name']) for x in orig_objects)
-        set2 = set((x['last_modified'], x['name']) for x in dest_objects)
-        diff = set1 - set2
-        set1 = set(x['name'] for x in orig_objects)
-        set2 = set(x['name'] for x in dest_objects)
-        delete_diff = set2 - set1
+        checksum = hashlib.md5()
+        orig_objects = checksum_listing(
+            iter_listing(orig_storage_cnx, orig_token, container_name,
+                         orig_objects, self.listing_limit,
+                         limiter=self.orig_limiter, policies=self.policies),
+            checksum)
+        dest_objects = iter_listing(dest_storage_cnx, dest_token,
+                                    container_name, dest_objects,
+                                    self.listing_limit,
+                                    limiter=self.dest_limiter,
+                                    policies=self.policies)
 
-        if not diff and not delete_diff:
-            return
+        # submit blocks when the work queue is full, the listings are
+        # then consumed at the pace of the transfers.
+        batch = self.work_queue.batch()
+        checkpoint = self.state is not None and account_id is not None
+        names = collections.deque()
+        checkpointed = 0
+        listing_failed = False
+        # Deletes are gathered to be sent by bulk, they are submitted
+        # before any other operation so their checkpoint sequence
+        # number is the one of their bulk.
+        deletes = []
+        bulk_size = None
+        # So are the copies of small objects packed in archives.
+        archive = []
+        try:
+            for action, obj in diff_listings(orig_objects, dest_objects,
+                                             self.diff_mode):
+                small = (action == 'copy' and self.archive_threshold and
+                         obj.get('bytes') is not None and
+                         obj['bytes'] <= self.archive_threshold and
+                         self.archive_supported(dest_storage_url))
+                if deletes and action != 'delete':
+                    self.submit_deletes(batch, dest_storage_cnx,
+                                        dest_storage_url, dest_token,
+                                        container_name, deletes)
+                    deletes = []
+                if archive and not small:
+                    batch.submit(self._archive, orig_storage_url,
+                                 orig_token, dest_storage_url, dest_token,
+                                 container_name, archive)
+                    archive = []
+                if checkpoint:
+                    # Past a failed job the marker can't move anymore.
+                    if batch.first_failed() is None:
+                        names.append((batch.submitted, obj['name']))
+                    if (batch.submitted - checkpointed >=
+                            self.checkpoint_interval):
+                        checkpointed = batch.submitted
+                        self.checkpoint(account_id, container_name, batch,
+                                        names)
+                if small:
+                    logging.info("archiving: %s ts:%s", obj['name'],
+                                 obj['last_modified'])
+                    archive.append((obj['last_modified'], obj['name']))
+                    if len(archive) >= self.archive_size:
+                        batch.submit(self._archive, orig_storage_url,
+                                     orig_token, dest_storage_url,
+                                     dest_token, container_name, archive)
+                        archive = []
+                elif action == 'copy':
+                    logging.info("sending: %s ts:%s", obj['name'],
+                                 obj['last_modified'])
+                    batch.submit(self.sync_object,
+                                 orig_storage_url,
+                                 orig_token,
+                                 dest_storage_url,
+                                 dest_token, container_name,
+                                 (obj['last_modified'], obj['name']),
+                                 orig_conn_pool=self.orig_conn_pool,
+                                 dest_conn_pool=self.dest_conn_pool,
+                                 segment_concurrency=(
+                                     self.segment_concurrency),
+                                 object_bytes=obj.get('bytes'),
+                                 range_threshold=self.range_threshold,
+                                 range_size=self.range_size,
+                                 range_concurrency=self.range_concurrency)
+                elif action == 'post':
+                    logging.info("checking metadata: %s ts:%s", obj['name'],
+                                 obj['last_modified'])
+                    batch.submit(self.sync_object_metadata,
+                                 orig_storage_url,
+                                 orig_token,
+                                 dest_storage_url,
+                                 dest_token, container_name,
+                                 obj['name'],
+                                 orig_conn_pool=self.orig_conn_pool,
+                                 dest_conn_pool=self.dest_conn_pool)
+                else:
+                    logging.info("deleting: %s ts:%s", obj['name'],
+                                 obj['last_modified'])
+                    if bulk_size is None:
+                        bulk_size = self.bulk_delete_size(dest_storage_url)
+                    deletes.append(obj['name'])
+                    if len(deletes) >= bulk_size:
+                        self.submit_deletes(batch, dest_storage_cnx,
+                                            dest_storage_url, dest_token,
+                                            container_name, deletes)
+                        deletes = []
+            if deletes:
+                self.submit_deletes(batch, dest_storage_cnx,
+                                    dest_storage_url, dest_token,
+                                    container_name, deletes)
+            if archive:
+                batch.submit(self._archive, orig_storage_url, orig_token,
+                             dest_storage_url, dest_token, container_name,
+                             archive)
+        except(swiftclient.client.ClientException), e:
+            # Stop there, diffing against a truncated listing would
+            # copy or delete objects for nothing.
+            logging.info("ERROR: listing container: %s, %s" % (
+                container_name, e.http_reason))
+            batch.errors.append(container_name)
+            listing_failed = True
+        return functools.partial(self._wait_batch, account_id,
+                                 container_name, batch, names, checkpoint,
+                                 listing_failed, checksum)
+
+    def _wait_batch(self, account_id, container_name, batch, names,
+                    checkpoint, listing_failed, checksum):
+        """Wait for the objects operations submitted by _sync.
 
-        pool = eventlet.GreenPool(size=self.concurrency)
-        pile = eventlet.GreenPile(pool)
-
-        for obj in diff:
-            logging.info("sending: %s ts:%s", obj[1], obj[0])
-            pile.spawn(self.sync_object,
-                       orig_storage_url,
-                       orig_token,
-                       dest_storage_url,
-                       dest_token, container_name,
-                       obj)
-
-        for obj in delete_diff:
-            logging.info("deleting: %s ts:%s", obj[1], obj[0])
-            pile.spawn(self.delete_object,
-                       dest_storage_cnx,
-                       dest_token,
-                       container_name,
-                       obj)
-        pool.waitall()
+        Return what sync returns, False when some of them failed.
+        """
+        errors = batch.wait()
+        if checkpoint:
+            if errors:
+                self.checkpoint(account_id, container_name, batch, names)
+            else:
+                self.state.clear_marker(account_id, container_name)
+        if listing_failed:
+            return None
+        if errors:
+            self.record_failed_jobs(account_id, batch)
+            return False
+        return checksum.hexdigest()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import json
+import time
+
+
+class IntegrityReport(object):
+    """File of the checksums of the objects copied.
+
+    One JSON line per object: account, container, name, bytes, md5 of
+    the body streamed, origin_etag, dest_etag and status (verified,
+    mismatch or unverified when no etag was there to compare with).
+    Each process ends its run with a line summing them up.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fp = None
+
+    def write(self, entry):
+        # Opened lazily like the failed operations file (see
+        # swsync.retry.FailedLog) for the forked processes.
+        if self._fp is None:
+            self._fp = open(self.path, 'a')
+        self._fp.write(json.dumps(entry) + '\n')
+        self._fp.flush()
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def object(self, account, container, name, size, md5, origin_etag,
+               dest_etag, status):
+        self.write({'account': account, 'container': container,
+                    'name': name, 'bytes': size, 'md5': md5,
+                    'origin_etag': origin_etag, 'dest_etag': dest_etag,
+                    'status': status, 'time': time.time()})
+
+    def summary(self, run_id, worker, verified, unverified, mismatches):
+        self.write({'run_id': run_id, 'worker': worker,
+                    'verified': verified, 'unverified': unverified,
+                    'mismatches': mismatches})
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import sqlite3
+import time
+
+
+class SQLiteLeases(object):
+    """Lease table shared by the swsync nodes to split the accounts.
+
+    A node syncs an account only after having claimed it, the lease
+    expires after ttl seconds unless renewed so the accounts of a
+    crashed node are picked up by the others. The nodes running at the
+    same time join the same pass, an account synced during a pass is
+    not claimed again before the next one.
+
+    SQLite locks the database file while claiming so it works for
+    processes of the same host or sharing a file system with working
+    locks.
+    """
+    def __init__(self, path, owner, ttl):
+        self.path = path
+        self.owner = owner
+        self.ttl = ttl
+        self.pass_id = None
+        self._db = None
+
+    @property
+    def db(self):
+        # Connect lazily so a forked process doesn't share the
+        # connection of its parent.
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=30,
+                                       isolation_level=None)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    key TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires REAL NOT NULL,
+                    synced_pass INTEGER)""")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS passes (
+                    pass_id INTEGER PRIMARY KEY,
+                    nodes INTEGER NOT NULL,
+                    expires REAL NOT NULL)""")
+            columns = [x[1] for x in
+                       self._db.execute("PRAGMA table_info(leases)")]
+            if 'synced_pass' not in columns:
+                self._db.execute("ALTER TABLE leases "
+                                 "ADD COLUMN synced_pass INTEGER")
+        return self._db
+
+    def begin_pass(self):
+        """Join the pass of the nodes running or start a new one.
+
+        A pass ends when its last node leaves it, or ttl seconds after
+        the last lease claimed or renewed in it if a node crashed.
+        """
+        now = time.time()
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT pass_id, nodes, expires FROM passes "
+                             "ORDER BY pass_id DESC LIMIT 1").fetchone()
+            if row is not None and row[1] > 0 and row[2] > now:
+                self.pass_id = row[0]
+                db.execute("UPDATE passes SET nodes = nodes + 1, "
+                           "expires = ? WHERE pass_id = ?",
+                           (now + self.ttl, self.pass_id))
+            else:
+                self.pass_id = (row and row[0] or 0) + 1
+                db.execute("INSERT INTO passes (pass_id, nodes, expires) "
+                           "VALUES (?, 1, ?)", (self.pass_id,
+                                                now + self.ttl))
+        finally:
+            db.execute("COMMIT")
+        return self.pass_id
+
+    def end_pass(self):
+        """Leave the pass joined with begin_pass."""
+        if self.pass_id is None:
+            return
+        self.db.execute("UPDATE passes SET nodes = nodes - 1 "
+                        "WHERE pass_id = ? AND nodes > 0", (self.pass_id,))
+        self.pass_id = None
+
+    def _renew_pass(self, now):
+        if self.pass_id is not None:
+            self.db.execute("UPDATE passes SET expires = ? "
+                            "WHERE pass_id = ? AND expires < ?",
+                            (now + self.ttl, self.pass_id, now + self.ttl))
+
+    def claim(self, key):
+        """Claim key, return False if another node holds it.
+
+        Keys synced during the current pass can't be claimed either.
+        """
+        now = time.time()
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT owner, expires, synced_pass "
+                             "FROM leases WHERE key = ?", (key,)).fetchone()
+            synced_pass = row is not None and row[2] or None
+            if row is not None and row[1] > now:
+                return False
+            if synced_pass is not None and synced_pass == self.pass_id:
+                return False
+            db.execute("INSERT OR REPLACE INTO leases "
+                       "(key, owner, expires, synced_pass) "
+                       "VALUES (?, ?, ?, ?)",
+                       (key, self.owner, now + self.ttl, synced_pass))
+            self._renew_pass(now)
+            return True
+        finally:
+            db.execute("COMMIT")
+
+    def renew(self, key):
+        """Extend a lease we hold, return False if we lost it."""
+        now = time.time()
+        cursor = self.db.execute(
+            "UPDATE leases SET expires = ? WHERE key = ? AND owner = ?",
+            (now + self.ttl, key, self.owner))
+        self._renew_pass(now)
+        return cursor.rowcount == 1
+
+    def release(self, key, synced=False):
+        """Release a lease, recording the current pass if synced."""
+        if synced and self.pass_id is not None:
+            self.db.execute(
+                "UPDATE leases SET expires = ?, synced_pass = ? "
+                "WHERE key = ? AND owner = ?",
+                (time.time(), self.pass_id, key, self.owner))
+        else:
+            self.db.execute(
+                "UPDATE leases SET expires = ? WHERE key = ? AND owner = ?",
+                (time.time(), key, self.owner))
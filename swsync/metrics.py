@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import bisect
+import contextlib
+import logging
+import socket
+import time
+
+import eventlet
+import eventlet.wsgi
+
+# Upper bounds in seconds of the histograms buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+           60, 300, 900, 3600)
+
+
+class Metrics(object):
+    """Counters, histograms and gauges of a swsync process.
+
+    They are kept in memory to be rendered for Prometheus (see serve)
+    and, when statsd is a (host, port) address, sent as they happen to
+    a StatsD server.
+    """
+    def __init__(self, prefix='swsync', statsd=None):
+        self.prefix = prefix
+        self.statsd = statsd
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self._sock = None
+        if statsd is not None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _send(self, name, labels, value, kind):
+        if self._sock is None:
+            return
+        stat = '.'.join([self.prefix, name] +
+                        [str(v).replace('.', '_') for _, v in labels])
+        try:
+            self._sock.sendto('%s:%s|%s' % (stat, value, kind), self.statsd)
+        except socket.error:
+            # Metrics are not worth failing a sync.
+            pass
+
+    def incr(self, name, value=1, **labels):
+        """Add value to the counter name."""
+        key = (name, tuple(sorted(labels.iteritems())))
+        self.counters[key] = self.counters.get(key, 0) + value
+        self._send(name, key[1], value, 'c')
+
+    def value(self, name, **labels):
+        """Get the value of the counter name."""
+        return self.counters.get((name, tuple(sorted(labels.iteritems()))),
+                                 0)
+
+    def timing(self, name, seconds, **labels):
+        """Observe a duration in the histogram name."""
+        key = (name, tuple(sorted(labels.iteritems())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [[0] * len(BUCKETS), 0, 0.0]
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            histogram[0][index] += 1
+        histogram[1] += 1
+        histogram[2] += seconds
+        self._send(name, key[1], int(seconds * 1000), 'ms')
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Time the block in the histogram name."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timing(name, time.time() - start, **labels)
+
+    def gauge(self, name, func):
+        """Register a function returning the current value of name."""
+        self.gauges[name] = func
+
+    def send_gauges(self):
+        for name, func in self.gauges.iteritems():
+            self._send(name, (), func(), 'g')
+
+    def render(self):
+        """Render the metrics in the Prometheus text format."""
+        def _labels(labels, extra=()):
+            labels = tuple(labels) + tuple(extra)
+            if not labels:
+                return ''
+            return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('"', ''))
+                                     for k, v in labels)
+
+        lines = []
+        names = set()
+        for (name, labels), value in sorted(self.counters.iteritems()):
+            metric = '%s_%s_total' % (self.prefix, name)
+            if metric not in names:
+                names.add(metric)
+                lines.append('# TYPE %s counter' % metric)
+            lines.append('%s%s %s' % (metric, _labels(labels), value))
+        for (name, labels), histogram in sorted(
+                self.histograms.iteritems()):
+            metric = '%s_%s_seconds' % (self.prefix, name)
+            if metric not in names:
+                names.add(metric)
+                lines.append('# TYPE %s histogram' % metric)
+            buckets, count, total = histogram
+            cumulative = 0
+            for bound, value in zip(BUCKETS, buckets):
+                cumulative += value
+                lines.append('%s_bucket%s %d' % (
+                    metric, _labels(labels, (('le', bound),)), cumulative))
+            lines.append('%s_bucket%s %d' % (
+                metric, _labels(labels, (('le', '+Inf'),)), count))
+            lines.append('%s_sum%s %f' % (metric, _labels(labels), total))
+            lines.append('%s_count%s %d' % (metric, _labels(labels), count))
+        for name, func in sorted(self.gauges.iteritems()):
+            metric = '%s_%s' % (self.prefix, name)
+            lines.append('# TYPE %s gauge' % metric)
+            lines.append('%s %s' % (metric, func()))
+        return '\n'.join(lines) + '\n'
+
+
+class _NullLog(object):
+    def write(self, *args):
+        pass
+
+
+def serve(metrics, host, port):
+    """Serve metrics on http://host:port/metrics from a green thread."""
+    def app(environ, start_response):
+        if environ['PATH_INFO'] != '/metrics':
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return ['Not Found\n']
+        start_response('200 OK', [('Content-Type',
+                                   'text/plain; version=0.0.4')])
+        return [metrics.render()]
+
+    sock = eventlet.listen((host, port))
+    logging.info("serving metrics on http://%s:%d/metrics", host, port)
+    return eventlet.spawn(eventlet.wsgi.server, sock, app, log=_NullLog())
+
+
+def report_gauges(metrics, interval=10):
+    """Send the gauges to StatsD every interval seconds, forever."""
+    while True:
+        eventlet.sleep(interval)
+        metrics.send_gauges()
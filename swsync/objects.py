@@ -14,16 +14,32 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import collections
+import cStringIO
+import hashlib
+import httplib
+import json
 import logging
+import mimetypes
+import tarfile
+import time
 
 import eventlet
+import eventlet.green.httplib
+import eventlet.queue
 import swift.common.bufferedhttp
 import swift.common.http
-import swift.container.sync
 from swiftclient import client as swiftclient
 import urllib
 import urllib2
 
+import swsync.retry
+import swsync.utils
+
+
+class IntegrityError(swiftclient.ClientException):
+    """The body copied doesn't match the origin or destination etag."""
+
 
 def quote(value, safe='/'):
     """Patched version of urllib.quote.
@@ -35,44 +51,260 @@ def quote(value, safe='/'):
     return urllib.quote(value, safe)
 
 
+def http_connect(url):
+    """Open a new keep-alive connection to the host of url."""
+    parsed = urllib2.urlparse.urlparse(url)
+    if parsed.scheme == 'https':
+        return eventlet.green.httplib.HTTPSConnection(parsed.netloc)
+    return swift.common.bufferedhttp.BufferedHTTPConnection(parsed.netloc)
+
+
+def _pooled_request(conn_pool, url, method, path, headers):
+    """Send the headers of a request over a connection of conn_pool.
+
+    Start again on another connection when a reused one has been closed
+    by the server while idle.
+    """
+    while True:
+        conn = conn_pool.get(url)
+        try:
+            conn.putrequest(method, path)
+            for header, value in headers.iteritems():
+                conn.putheader(header, str(value))
+            conn.endheaders()
+            return conn
+        except swsync.retry.NETWORK_ERRORS:
+            conn_pool.put(url, conn, broken=True)
+            if not conn.reused:
+                raise
+        except BaseException:
+            conn_pool.put(url, conn, broken=True)
+            raise
+
+
+def _pooled_response(conn_pool, url, method, path, headers, body='',
+                     response_timeout=15, conn_timeout=5):
+    """Send a request over a connection of conn_pool and get its response.
+
+    Return (conn, resp), conn is to be given back to conn_pool once resp
+    has been read. A reused connection closed by the server while idle
+    may only fail when reading the status line, the request is then
+    sent again on another connection.
+    """
+    while True:
+        with eventlet.Timeout(conn_timeout):
+            conn = _pooled_request(conn_pool, url, method, path, headers)
+        try:
+            if body:
+                conn.send(body)
+            with eventlet.Timeout(response_timeout):
+                return (conn, conn.getresponse())
+        except swsync.retry.NETWORK_ERRORS, e:
+            conn_pool.put(url, conn, broken=True)
+            if not conn.reused:
+                raise
+            logging.debug("sending %s %s again: %s", method, path, e)
+        except BaseException:
+            conn_pool.put(url, conn, broken=True)
+            raise
+
+
+def _request(conn_pool, url, method, path, headers, body='',
+             response_timeout=15, conn_timeout=5):
+    """Send a request over a connection of conn_pool and read its response.
+
+    Return the response headers and body, ClientException is raised on
+    an error status.
+    """
+    if body or method in ('PUT', 'POST'):
+        headers = dict(headers, **{'content-length': len(body)})
+    conn, response = _pooled_response(conn_pool, url, method, path, headers,
+                                      body, response_timeout=response_timeout,
+                                      conn_timeout=conn_timeout)
+    resp = None
+    try:
+        with eventlet.Timeout(response_timeout):
+            resp_body = response.read()
+        resp = response
+    finally:
+        conn_pool.put(url, conn, broken=resp is None or resp.will_close)
+    if not swift.common.http.is_success(resp.status):
+        raise swiftclient.ClientException(
+            'status %s %s' % (resp.status, resp.reason),
+            http_status=resp.status, http_reason=resp.reason)
+    return (dict((k.lower(), v) for k, v in resp.getheaders()), resp_body)
+
+
+def _readinto(resp, buf):
+    """readinto for the Python 2 httplib responses.
+
+    Only for a response whose body length is known, the bytes already
+    buffered by its file object are copied first then the next ones
+    are received straight into buf.
+    """
+    size = min(len(buf), resp.length)
+    if not size:
+        resp.close()
+        return 0
+    fp = resp.fp
+    buffered = fp._rbuf.getvalue()
+    if buffered:
+        size = min(size, len(buffered))
+        buf[:size] = buffered[:size]
+        fp._rbuf = cStringIO.StringIO()
+        fp._rbuf.write(buffered[size:])
+    else:
+        size = fp._sock.recv_into(buf, size)
+        if not size:
+            raise httplib.IncompleteRead('')
+    resp.length -= size
+    if not resp.length:
+        resp.close()
+    return size
+
+
+class ObjectBody(object):
+    """Body of a GET response read by chunks of chunk_size.
+
+    Iterating yields new strings, readinto fills a buffer of the caller
+    instead when the response supports it (see put_object_stream). The
+    bytes read are taken from bucket if set. release(resp) is called
+    once the body has been fully read, release() if it is closed
+    before.
+    """
+    def __init__(self, resp, chunk_size, release, bucket=None):
+        self.resp = resp
+        self.chunk_size = chunk_size
+        self.bucket = bucket
+        self._release = release
+        self.done = False
+
+    @property
+    def can_readinto(self):
+        # httplib responses only have readinto from Python 3, see
+        # _readinto for the Python 2 ones.
+        if hasattr(self.resp, 'readinto'):
+            return True
+        return (not getattr(self.resp, 'chunked', True) and
+                isinstance(getattr(self.resp, 'length', None), int) and
+                not getattr(self.resp, '_readline_buffer', '') and
+                hasattr(getattr(self.resp, 'fp', None), '_rbuf'))
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.done:
+            raise StopIteration()
+        try:
+            chunk = self.resp.read(self.chunk_size)
+        except BaseException:
+            self.close()
+            raise
+        if not chunk:
+            self.done = True
+            self._release(self.resp)
+            raise StopIteration()
+        if self.bucket is not None:
+            self.bucket.consume(len(chunk))
+        return chunk
+
+    def readinto(self, buf):
+        """Read up to len(buf) bytes into buf, return how many."""
+        if self.done:
+            return 0
+        try:
+            if hasattr(self.resp, 'readinto'):
+                size = self.resp.readinto(buf)
+            else:
+                size = _readinto(self.resp, buf)
+        except BaseException:
+            self.close()
+            raise
+        if not size:
+            self.done = True
+            self._release(self.resp)
+            return 0
+        if self.bucket is not None:
+            self.bucket.consume(size)
+        return size
+
+    def close(self):
+        if not self.done:
+            self.done = True
+            self._release()
+
+    def __del__(self):
+        # Never keep the connection of a dropped body out of its pool.
+        self.close()
+
+
 def get_object(storage_url, token,
                container_name,
                object_name,
                response_timeout=15,
                conn_timeout=5,
-               resp_chunk_size=65536):
-    headers = {'x-auth-token': token}
+               resp_chunk_size=65536,
+               conn_pool=None,
+               query_string=None,
+               headers=None,
+               method='GET'):
+    headers = dict(headers or {}, **{'x-auth-token': token})
     x = urllib2.urlparse.urlparse(storage_url)
 
     path = x.path + '/' + container_name + '/' + object_name
     path = quote(path)
-    with eventlet.Timeout(conn_timeout):
-        conn = swift.common.bufferedhttp.http_connect_raw(
-            x.hostname,
-            x.port,
-            'GET',
-            path,
-            headers=headers,
-            ssl=False)
-
-    with eventlet.Timeout(response_timeout):
-        resp = conn.getresponse()
+    if query_string:
+        path += '?' + query_string
+    limiter = swsync.utils.get_limiter('origin')
+    limiter.request()
+    started = time.time()
+    if conn_pool is None:
+        with eventlet.Timeout(conn_timeout):
+            conn = swift.common.bufferedhttp.http_connect_raw(
+                x.hostname,
+                x.port,
+                method,
+                path,
+                headers=headers,
+                ssl=False)
+        with eventlet.Timeout(response_timeout):
+            resp = conn.getresponse()
+    else:
+        conn, resp = _pooled_response(conn_pool, storage_url, method, path,
+                                      headers,
+                                      response_timeout=response_timeout,
+                                      conn_timeout=conn_timeout)
+
+    def release(resp=None):
+        # The connection can be reused only if the response has been
+        # fully read and the server didn't ask to close it.
+        if conn_pool is not None:
+            conn_pool.put(storage_url, conn,
+                          broken=resp is None or resp.will_close)
+    swsync.utils.get_metrics().timing('request', time.time() - started,
+                                      cluster='origin', method=method)
 
     if not swift.common.http.is_success(resp.status):
         resp.read()
+        release(resp)
         # TODO(chmou): logging
         raise swiftclient.ClientException(
-            'status %s %s' % (resp.status, resp.reason))
+            'status %s %s' % (resp.status, resp.reason),
+            http_status=resp.status, http_reason=resp.reason)
 
     if resp_chunk_size:
-        def _object_body():
-            buf = resp.read(resp_chunk_size)
-            while buf:
-                yield buf
-                buf = resp.read(resp_chunk_size)
-        object_body = _object_body()
+        object_body = ObjectBody(
+            resp, resp_chunk_size, release,
+            bucket=limiter.bytes.enabled and limiter.bytes or None)
     else:
-        object_body = resp.read()
+        try:
+            object_body = resp.read()
+        except BaseException:
+            release()
+            raise
+        release(resp)
+        limiter.throttle(object_body)
 
     resp_headers = {}
     for header, value in resp.getheaders():
@@ -81,37 +313,802 @@ def get_object(storage_url, token,
     return (resp_headers, object_body)
 
 
+# Chunks of a range being fetched buffered until its body is read, the
+# rest of the range waits in the socket.
+RANGE_READ_AHEAD = 16
+
+
+def get_object_ranges(storage_url, token, container_name, object_name,
+                      range_size, range_concurrency, conn_pool=None,
+                      query_string=None, chunk_size=65536):
+    """Get an object with concurrent Range requests.
+
+    Return (headers, body) like get_object, body yields the ranges in
+    order by chunks of chunk_size. At most range_concurrency ranges are
+    fetched ahead, each of them streamed and only buffering
+    RANGE_READ_AHEAD chunks until the reader gets to it.
+    """
+    def _get_range(start, end, if_match=None):
+        headers = {'range': 'bytes=%d-%d' % (start, end)}
+        if if_match:
+            # Fail rather than mixing two versions of the object.
+            headers['if-match'] = if_match
+        return get_object(storage_url, token, container_name, object_name,
+                          resp_chunk_size=chunk_size, conn_pool=conn_pool,
+                          query_string=query_string, headers=headers)
+
+    resp_headers, first = _get_range(0, range_size - 1)
+    content_range = resp_headers.pop('content-range', None)
+    if (content_range is None or 'x-static-large-object' in resp_headers
+            or 'x-object-manifest' in resp_headers):
+        # Range ignored or a manifest (its segments are synced on
+        # their own), use a plain GET.
+        first.close()
+        return get_object(storage_url, token, container_name, object_name,
+                          conn_pool=conn_pool, query_string=query_string)
+    total = int(content_range.rsplit('/', 1)[1])
+    resp_headers['content-length'] = str(total)
+    etag = resp_headers.get('etag')
+
+    def _fetch(start, chunks):
+        # The chunks are followed by None, or by the error raised.
+        end = min(start + range_size, total) - 1
+        try:
+            _, body = _get_range(start, end, if_match=etag)
+            size = 0
+            try:
+                for chunk in body:
+                    size += len(chunk)
+                    chunks.put(chunk)
+            finally:
+                body.close()
+            if size != end - start + 1:
+                raise swiftclient.ClientException(
+                    'short range %d-%d: %d bytes' % (start, end, size))
+        except(Exception, eventlet.Timeout), e:
+            chunks.put(e)
+        else:
+            chunks.put(None)
+
+    pool = eventlet.GreenPool(size=range_concurrency)
+
+    def _object_body():
+        starts = iter(xrange(range_size, total, range_size))
+        pending = collections.deque()
+
+        def _spawn(start):
+            chunks = eventlet.queue.Queue(RANGE_READ_AHEAD)
+            pending.append((pool.spawn(_fetch, start, chunks), chunks))
+        try:
+            for start in starts:
+                _spawn(start)
+                if len(pending) == range_concurrency:
+                    break
+            for chunk in first:
+                yield chunk
+            while pending:
+                chunks = pending[0][1]
+                chunk = chunks.get()
+                while chunk is not None:
+                    if isinstance(chunk, BaseException):
+                        raise chunk
+                    yield chunk
+                    chunk = chunks.get()
+                pending.popleft()
+                start = next(starts, None)
+                if start is not None:
+                    _spawn(start)
+        finally:
+            first.close()
+            for gt, _ in pending:
+                gt.kill()
+
+    return (resp_headers, _object_body())
+
+
 def delete_object(dest_cnx,
                   dest_token,
                   container_name,
-                  object_name):
+                  object_name,
+                  conn_pool=None):
     parsed = dest_cnx[0]
     url = '%s://%s/%s' % (parsed.scheme, parsed.netloc, parsed.path)
-    swiftclient.delete_object(url=url,
-                              token=dest_token,
-                              container=container_name,
-                              http_conn=dest_cnx,
-                              name=object_name)
+    swsync.utils.get_limiter('destination').request()
+    metrics = swsync.utils.get_metrics()
+    with metrics.timer('request', cluster='destination', method='DELETE'):
+        if conn_pool is None:
+            swiftclient.delete_object(url=url,
+                                      token=dest_token,
+                                      container=container_name,
+                                      http_conn=dest_cnx,
+                                      name=object_name)
+        else:
+            _request(conn_pool, url, 'DELETE',
+                     quote('%s/%s/%s' % (parsed.path, container_name,
+                                         object_name)),
+                     {'x-auth-token': dest_token})
+    metrics.incr('objects_deleted')
+
+
+def cluster_info(storage_url, conn_timeout=5, response_timeout=15):
+    """Get the /info of the cluster of storage_url, {} on error."""
+    conn = http_connect(storage_url)
+    try:
+        with eventlet.Timeout(conn_timeout):
+            conn.request('GET', '/info')
+        with eventlet.Timeout(response_timeout):
+            resp = conn.getresponse()
+            body = resp.read()
+        if not swift.common.http.is_success(resp.status):
+            return {}
+        return json.loads(body)
+    except((eventlet.Timeout, ValueError) +
+           swsync.retry.NETWORK_ERRORS), e:
+        logging.info("error getting /info: %s", e)
+        return {}
+    finally:
+        conn.close()
+
+
+def bulk_delete_limit(storage_url, conn_timeout=5, response_timeout=15):
+    """Get the max objects deleted by a bulk request to a cluster.
+
+    Read from the /info of the cluster, 0 when the bulk middleware is
+    not there or it can't be told.
+    """
+    info = cluster_info(storage_url, conn_timeout, response_timeout)
+    return int(info.get('bulk_delete', {}).get('max_deletes_per_request',
+                                               0))
+
+
+def bulk_upload_supported(storage_url, conn_timeout=5, response_timeout=15):
+    """Tell if the cluster extracts the archives uploaded to it."""
+    info = cluster_info(storage_url, conn_timeout, response_timeout)
+    return 'bulk_upload' in info
+
+
+def _bulk_request(dest_storage_url, dest_token, method, path, headers, body,
+                  label, conn_pool=None, response_timeout=60,
+                  conn_timeout=5):
+    """Send body to the bulk middleware and return its JSON result.
+
+    ClientException is raised when the whole request failed, the
+    result then has no Errors for single objects.
+    """
+    headers = dict(headers, **{'x-auth-token': dest_token,
+                               'accept': 'application/json',
+                               'content-length': len(body)})
+    x = urllib2.urlparse.urlparse(dest_storage_url)
+    path = quote(x.path) + path
+    limiter = swsync.utils.get_limiter('destination')
+    limiter.request()
+    body = limiter.throttle(body)
+    with swsync.utils.get_metrics().timer('request', cluster='destination',
+                                          method=label):
+        # The middleware answers once all the objects are processed.
+        if conn_pool is None:
+            with eventlet.Timeout(conn_timeout):
+                conn = swift.common.bufferedhttp.http_connect_raw(
+                    x.hostname, x.port, method, path, headers=headers,
+                    ssl=False)
+            response = None
+        else:
+            conn, response = _pooled_response(
+                conn_pool, dest_storage_url, method, path, headers, body,
+                response_timeout=response_timeout, conn_timeout=conn_timeout)
+        resp = None
+        try:
+            with eventlet.Timeout(response_timeout):
+                if response is None:
+                    conn.send(body)
+                    response = conn.getresponse()
+                resp_body = response.read()
+            resp = response
+        finally:
+            if conn_pool is not None:
+                conn_pool.put(dest_storage_url, conn,
+                              broken=resp is None or resp.will_close)
+            elif resp is None:
+                conn.close()
+
+    if not swift.common.http.is_success(resp.status):
+        raise swiftclient.ClientException(
+            'status %s %s' % (resp.status, resp.reason),
+            http_status=resp.status, http_reason=resp.reason)
+    result = json.loads(resp_body)
+    status = int(result.get('Response Status', '200').split()[0])
+    if status >= 400 and not result.get('Errors'):
+        # The whole request failed, with a 503 for instance.
+        raise swiftclient.ClientException(
+            '%s %s' % (label.replace('_', ' ').lower(),
+                       result.get('Response Status')),
+            http_status=status, http_reason=result.get('Response Body'))
+    return result
+
+
+def bulk_delete(dest_storage_url, dest_token, container_name, object_names,
+                conn_pool=None, response_timeout=60, conn_timeout=5):
+    """Delete objects of a container with a single bulk-delete request.
+
+    Objects already gone count as deleted. Return the names of the ones
+    which couldn't be deleted.
+    """
+    paths = dict((quote('/%s/%s' % (container_name, name)), name)
+                 for name in object_names)
+    result = _bulk_request(dest_storage_url, dest_token, 'POST',
+                           '?bulk-delete',
+                           {'content-type': 'text/plain'},
+                           '\n'.join(paths), 'BULK_DELETE',
+                           conn_pool=conn_pool,
+                           response_timeout=response_timeout,
+                           conn_timeout=conn_timeout)
+    failed = [paths.get(path, path) for path, _ in result.get('Errors', [])]
+    swsync.utils.get_metrics().incr('objects_deleted',
+                                    len(object_names) - len(failed))
+    return failed
+
+
+def _object_path(storage_url, container_name, object_name):
+    return quote('%s/%s/%s' % (urllib2.urlparse.urlparse(storage_url).path,
+                               container_name, object_name))
+
+
+def head_object(dest_storage_url, dest_token, container_name, object_name,
+                conn_pool=None):
+    swsync.utils.get_limiter('destination').request()
+    with swsync.utils.get_metrics().timer('request', cluster='destination',
+                                          method='HEAD'):
+        if conn_pool is None:
+            return swiftclient.head_object(dest_storage_url, dest_token,
+                                           container_name, object_name)
+        return _request(conn_pool, dest_storage_url, 'HEAD',
+                        _object_path(dest_storage_url, container_name,
+                                     object_name),
+                        {'x-auth-token': dest_token})[0]
+
+
+def post_object(dest_storage_url, dest_token, container_name, object_name,
+                headers, conn_pool=None):
+    swsync.utils.get_limiter('destination').request()
+    with swsync.utils.get_metrics().timer('request', cluster='destination',
+                                          method='POST'):
+        if conn_pool is None:
+            return swiftclient.post_object(dest_storage_url, dest_token,
+                                           container_name, object_name,
+                                           headers)
+        _request(conn_pool, dest_storage_url, 'POST',
+                 _object_path(dest_storage_url, container_name,
+                              object_name),
+                 dict(headers, **{'x-auth-token': dest_token}))
+
+
+def put_object(dest_storage_url, dest_token, container_name, object_name,
+               headers, contents, conn_pool=None, query_string=None):
+    headers['x-auth-token'] = dest_token
+    limiter = swsync.utils.get_limiter('destination')
+    limiter.request()
+    contents = limiter.throttle(contents)
+    kwargs = {}
+    if query_string:
+        kwargs['query_string'] = query_string
+    with swsync.utils.get_metrics().timer('request', cluster='destination',
+                                          method='PUT'):
+        if conn_pool is None:
+            sync_to = dest_storage_url + "/" + quote(container_name)
+            return swiftclient.put_object(sync_to, name=object_name,
+                                          headers=headers,
+                                          contents=contents, **kwargs)
+        path = _object_path(dest_storage_url, container_name, object_name)
+        if query_string:
+            path += '?' + query_string
+        resp_headers, _ = _request(conn_pool, dest_storage_url, 'PUT', path,
+                                   headers, body=contents)
+        return resp_headers.get('etag')
+
+
+def _send_chunks(conn, body, bucket):
+    """Send the chunks of body but the last one.
+
+    Return the md5 of body and its size, the upload is aborted by not
+    sending the last chunk.
+    """
+    checksum = hashlib.md5()
+    sent = [0]
+
+    # The CRLF ending a chunk is sent with the size of the next one.
+    def send(chunk, size):
+        if bucket.enabled:
+            bucket.consume(size)
+        checksum.update(chunk)
+        conn.send((sent[0] and '\r\n%x\r\n' or '%x\r\n') % size)
+        conn.send(chunk)
+        sent[0] += size
+
+    if getattr(body, 'can_readinto', False):
+        buffers = swsync.utils.get_buffers()
+        buf = buffers.get()
+        try:
+            view = memoryview(buf)
+            size = body.readinto(view)
+            while size:
+                send(view[:size], size)
+                size = body.readinto(view)
+        finally:
+            buffers.put(buf)
+    else:
+        for chunk in body:
+            if chunk:
+                send(chunk, len(chunk))
+    return checksum.hexdigest(), sent[0]
+
+
+def _record_integrity(storage_url, container_name, object_name, size,
+                      md5, origin_etag, dest_etag):
+    if origin_etag not in (None, md5) or dest_etag not in (None, md5):
+        status = 'mismatch'
+    elif origin_etag is None and dest_etag is None:
+        status = 'unverified'
+    else:
+        status = 'verified'
+    swsync.utils.get_metrics().incr('objects_%s' % status)
+    report = swsync.utils.get_integrity_report()
+    if report is not None:
+        report.object(storage_url.rsplit('AUTH_', 1)[-1], container_name,
+                      object_name, size, md5, origin_etag, dest_etag,
+                      status)
+    return status != 'mismatch'
+
+
+def _etag(headers_etag):
+    if not headers_etag:
+        return None
+    return headers_etag.strip('"').lower()
+
+
+def put_object_stream(dest_storage_url, dest_token, container_name,
+                      object_name, headers, body, conn_pool=None,
+                      response_timeout=15, conn_timeout=5):
+    """PUT an object streaming body with chunked transfer encoding.
+
+    Chunks are written to the socket as they come, read into a buffer
+    of the pool when body supports readinto (see ObjectBody) instead of
+    allocating a string for each. Their md5 is checked against the etag
+    of headers, the upload is aborted on a mismatch, and against the
+    etag returned by the destination. IntegrityError is raised if one
+    of them differs. Return the etag of the new object.
+    """
+    origin_etag = _etag(headers.get('etag'))
+    headers = dict((k, v) for k, v in headers.iteritems()
+                   if k.lower() not in ('content-length', 'connection',
+                                        'transfer-encoding', 'keep-alive'))
+    headers.update({'x-auth-token': dest_token,
+                    'transfer-encoding': 'chunked'})
+    x = urllib2.urlparse.urlparse(dest_storage_url)
+    path = quote(x.path + '/' + container_name + '/' + object_name)
+    limiter = swsync.utils.get_limiter('destination')
+    limiter.request()
+    with swsync.utils.get_metrics().timer('request', cluster='destination',
+                                          method='PUT'):
+        with eventlet.Timeout(conn_timeout):
+            if conn_pool is None:
+                conn = swift.common.bufferedhttp.http_connect_raw(
+                    x.hostname, x.port, 'PUT', path, headers=headers,
+                    ssl=False)
+            else:
+                conn = _pooled_request(conn_pool, dest_storage_url,
+                                       'PUT', path, headers)
+        resp = None
+        try:
+            md5, size = _send_chunks(conn, body, limiter.bytes)
+            if origin_etag is not None and md5 != origin_etag:
+                # Dropping the connection before the last chunk
+                # aborts the upload.
+                _record_integrity(dest_storage_url, container_name,
+                                  object_name, size, md5, origin_etag,
+                                  None)
+                raise IntegrityError('md5 %s of %s differs from the '
+                                     'origin etag %s' % (md5, object_name,
+                                                         origin_etag))
+            conn.send(size and '\r\n0\r\n\r\n' or '0\r\n\r\n')
+            with eventlet.Timeout(response_timeout):
+                resp = conn.getresponse()
+                resp.read()
+        finally:
+            if conn_pool is not None:
+                conn_pool.put(dest_storage_url, conn,
+                              broken=resp is None or resp.will_close)
+            elif resp is None:
+                conn.close()
+
+    if not swift.common.http.is_success(resp.status):
+        raise swiftclient.ClientException(
+            'status %s %s' % (resp.status, resp.reason),
+            http_status=resp.status, http_reason=resp.reason)
+    dest_etag = _etag(resp.getheader('etag'))
+    if not _record_integrity(dest_storage_url, container_name, object_name,
+                             size, md5, origin_etag, dest_etag):
+        raise IntegrityError('md5 %s of %s differs from the destination '
+                             'etag %s' % (md5, object_name, dest_etag))
+    return dest_etag
+
+
+def manifest_headers(orig_headers):
+    """Headers to PUT a manifest from the origin manifest GET headers.
+
+    Drop the headers describing the manifest body since the one sent
+    to the destination is not the same.
+    """
+    headers = dict((k, v) for k, v in orig_headers.iteritems()
+                   if k not in ('content-length', 'etag',
+                                'x-static-large-object',
+                                'transfer-encoding'))
+    if 'content-type' in headers:
+        headers['content-type'] = ';'.join(
+            x for x in headers['content-type'].split(';')
+            if not x.strip().startswith('swift_bytes='))
+    return headers
+
+
+# Headers set by an object POST, user metadata are replaced as a whole.
+POST_HEADERS = ('content-type', 'content-disposition', 'content-encoding',
+                'x-delete-at', 'x-object-manifest')
+
+
+def metadata_headers(headers):
+    return dict((k, v) for k, v in headers.iteritems()
+                if k.startswith('x-object-meta-') or k in POST_HEADERS)
+
+
+def sync_object_metadata(orig_storage_url, orig_token, dest_storage_url,
+                         dest_token, container_name, object_name,
+                         orig_conn_pool=None, dest_conn_pool=None):
+    """Sync the metadata of an object whose content is already synced.
+
+    Compare the metadata of both sides and POST the origin ones to the
+    destination only when they differ.
+    """
+    try:
+        orig_headers, _ = get_object(orig_storage_url, orig_token,
+                                     container_name, object_name,
+                                     resp_chunk_size=None,
+                                     conn_pool=orig_conn_pool,
+                                     method='HEAD')
+        dest_headers = head_object(dest_storage_url, dest_token,
+                                   container_name, object_name,
+                                   conn_pool=dest_conn_pool)
+        orig_metadata = metadata_headers(orig_headers)
+        if orig_metadata == metadata_headers(dest_headers):
+            swsync.utils.get_metrics().incr('objects_skipped')
+            return True
+        post_object(dest_storage_url, dest_token, container_name,
+                    object_name, orig_metadata, conn_pool=dest_conn_pool)
+        swsync.utils.get_metrics().incr('objects_posted')
+        logging.info("HEADER: sync object headers: %s" % (object_name))
+    except(swiftclient.ClientException), e:
+        if swsync.retry.classify(e) is not None:
+            # Let the work queue slow down and retry it.
+            raise
+        logging.info("error sync object metadata: %s, %s" % (
+                     object_name, e.http_reason))
+        return False
+
+
+def verify_object_metadata(orig_storage_url, orig_token, dest_storage_url,
+                           dest_token, container_name, object_name,
+                           orig_conn_pool=None, dest_conn_pool=None):
+    """Compare the metadata of an object on both sides.
+
+    Return None when they are the same, 'post' when they differ, 'copy'
+    when the object is missing on destination or False on error.
+    """
+    try:
+        orig_headers, _ = get_object(orig_storage_url, orig_token,
+                                     container_name, object_name,
+                                     resp_chunk_size=None,
+                                     conn_pool=orig_conn_pool,
+                                     method='HEAD')
+        try:
+            dest_headers = head_object(dest_storage_url, dest_token,
+                                       container_name, object_name,
+                                       conn_pool=dest_conn_pool)
+        except(swiftclient.ClientException), e:
+            if e.http_status == 404:
+                return 'copy'
+            raise
+    except(swiftclient.ClientException), e:
+        if swsync.retry.classify(e) is not None:
+            # Let the work queue slow down and retry it.
+            raise
+        logging.info("error verify object: %s, %s" % (
+                     object_name, e.http_reason))
+        return False
+    swsync.utils.get_metrics().incr('objects_verified_metadata')
+    if metadata_headers(orig_headers) != metadata_headers(dest_headers):
+        return 'post'
+
+
+def sync_segments(orig_storage_url, orig_token, dest_storage_url,
+                  dest_token, segments, orig_conn_pool=None,
+                  dest_conn_pool=None, segment_concurrency=10):
+    """Sync in parallel the segments of a large object.
+
+    segments is a list of (container, name, etag), segments already on
+    the destination with the same etag are skipped. Return False if a
+    segment failed.
+    """
+    created = set()
+
+    def _sync_segment(segment):
+        container_name, object_name, etag = segment
+        try:
+            headers = head_object(dest_storage_url, dest_token,
+                                  container_name, object_name,
+                                  conn_pool=dest_conn_pool)
+            if headers.get('etag', '').strip('"') == etag:
+                swsync.utils.get_metrics().incr('objects_skipped')
+                return True
+        except(swiftclient.ClientException), e:
+            if e.http_status != 404:
+                logging.info("error sync segment: %s, %s" % (
+                             object_name, e.http_reason))
+                return False
+            if container_name not in created:
+                # The segments container may not have been synced yet.
+                created.add(container_name)
+                try:
+                    swsync.utils.get_limiter('destination').request()
+                    swiftclient.put_container(dest_storage_url, dest_token,
+                                              container_name)
+                except(swiftclient.ClientException), e:
+                    logging.info("ERROR: creating container: %s, %s" % (
+                                 container_name, e.http_reason))
+                    return False
+        return sync_object(orig_storage_url, orig_token,
+                           dest_storage_url, dest_token,
+                           container_name, (None, object_name),
+                           orig_conn_pool=orig_conn_pool,
+                           dest_conn_pool=dest_conn_pool,
+                           segment_concurrency=segment_concurrency)
+
+    pool = eventlet.GreenPool(size=segment_concurrency)
+    results = list(pool.imap(_sync_segment, segments))
+    return False not in results
+
+
+def sync_slo(orig_storage_url, orig_token, dest_storage_url, dest_token,
+             container_name, object_name, orig_headers, orig_body,
+             orig_conn_pool=None, dest_conn_pool=None,
+             segment_concurrency=10):
+    """Sync a static large object, its segments first then manifest."""
+    manifest = json.loads(''.join(orig_body))
+    segments = []
+    for segment in manifest:
+        seg_container, seg_name = segment['name'].lstrip('/').split('/', 1)
+        segments.append((seg_container, seg_name, segment['hash']))
+    if not sync_segments(orig_storage_url, orig_token, dest_storage_url,
+                         dest_token, segments,
+                         orig_conn_pool=orig_conn_pool,
+                         dest_conn_pool=dest_conn_pool,
+                         segment_concurrency=segment_concurrency):
+        logging.info("error sync object: %s, segments failed" % (
+                     object_name))
+        return False
+
+    put_manifest = []
+    for segment in manifest:
+        entry = {'path': segment['name'],
+                 'etag': segment['hash'],
+                 'size_bytes': segment['bytes']}
+        if 'range' in segment:
+            entry['range'] = segment['range']
+        put_manifest.append(entry)
+    put_object(dest_storage_url, dest_token, container_name, object_name,
+               manifest_headers(orig_headers), json.dumps(put_manifest),
+               conn_pool=dest_conn_pool,
+               query_string='multipart-manifest=put')
+
+
+def sync_dlo(orig_storage_url, orig_token, dest_storage_url, dest_token,
+             container_name, object_name, orig_headers,
+             orig_conn_pool=None, dest_conn_pool=None,
+             segment_concurrency=10):
+    """Sync a dynamic large object, its segments first then manifest."""
+    seg_container, prefix = urllib.unquote(
+        orig_headers['x-object-manifest']).split('/', 1)
+    swsync.utils.get_limiter('origin').request()
+    _, listing = swiftclient.get_container(orig_storage_url, orig_token,
+                                           seg_container, prefix=prefix,
+                                           full_listing=True)
+    segments = [(seg_container, x['name'], x['hash']) for x in listing]
+    if not sync_segments(orig_storage_url, orig_token, dest_storage_url,
+                         dest_token, segments,
+                         orig_conn_pool=orig_conn_pool,
+                         dest_conn_pool=dest_conn_pool,
+                         segment_concurrency=segment_concurrency):
+        logging.info("error sync object: %s, segments failed" % (
+                     object_name))
+        return False
+
+    put_object(dest_storage_url, dest_token, container_name, object_name,
+               manifest_headers(orig_headers), '',
+               conn_pool=dest_conn_pool)
 
 
 def sync_object(orig_storage_url, orig_token, dest_storage_url,
-                dest_token, container_name, object_name_etag):
+                dest_token, container_name, object_name_etag,
+                orig_conn_pool=None, dest_conn_pool=None,
+                segment_concurrency=10, object_bytes=None,
+                range_threshold=None, range_size=67108864,
+                range_concurrency=4):
     object_name = object_name_etag[1]
 
-    orig_headers, orig_body = get_object(orig_storage_url,
-                                         orig_token,
-                                         container_name,
-                                         object_name)
-    container_name = quote(container_name)
-
+    # Get the manifest of large objects instead of their concatenated
+    # segments, it is ignored for the other objects.
+    if (range_threshold and object_bytes is not None and
+            object_bytes > range_threshold):
+        orig_headers, orig_body = get_object_ranges(
+            orig_storage_url, orig_token, container_name, object_name,
+            range_size, range_concurrency, conn_pool=orig_conn_pool,
+            query_string='multipart-manifest=get')
+    else:
+        orig_headers, orig_body = get_object(
+            orig_storage_url, orig_token, container_name, object_name,
+            conn_pool=orig_conn_pool, query_string='multipart-manifest=get')
     post_headers = orig_headers
-    post_headers['x-auth-token'] = dest_token
-    sync_to = dest_storage_url + "/" + container_name
-    iterlike = swift.container.sync._Iter2FileLikeObject
     try:
-        swiftclient.put_object(sync_to, name=object_name,
-                               headers=post_headers,
-                               contents=iterlike(orig_body))
+        if orig_headers.get('x-static-large-object', '').lower() == 'true':
+            return sync_slo(orig_storage_url, orig_token,
+                            dest_storage_url, dest_token, container_name,
+                            object_name, orig_headers, orig_body,
+                            orig_conn_pool=orig_conn_pool,
+                            dest_conn_pool=dest_conn_pool,
+                            segment_concurrency=segment_concurrency)
+        elif 'x-object-manifest' in orig_headers:
+            # Give back the origin connection before the segments GETs
+            # need one.
+            ''.join(orig_body)
+            return sync_dlo(orig_storage_url, orig_token,
+                            dest_storage_url, dest_token, container_name,
+                            object_name, orig_headers,
+                            orig_conn_pool=orig_conn_pool,
+                            dest_conn_pool=dest_conn_pool,
+                            segment_concurrency=segment_concurrency)
+        put_object_stream(dest_storage_url, dest_token, container_name,
+                          object_name, post_headers, orig_body,
+                          conn_pool=dest_conn_pool)
+        metrics = swsync.utils.get_metrics()
+        metrics.incr('objects_copied')
+        metrics.incr('bytes_copied',
+                     int(orig_headers.get('content-length') or 0))
     except(swiftclient.ClientException), e:
+        if swsync.retry.classify(e) is not None:
+            # Let the work queue slow down and retry it.
+            raise
         logging.info("error sync object: %s, %s" % (
                      object_name, e.http_reason))
+        return False
+    finally:
+        # Give back the origin connection if the upload stopped early.
+        if hasattr(orig_body, 'close'):
+            orig_body.close()
+
+
+def _extracted_metadata(object_name, headers):
+    """Metadata to POST to an extracted object, None if it has them.
+
+    The extract-archive middleware only gives the objects a content
+    type guessed from their name.
+    """
+    metadata = metadata_headers(headers)
+    guessed = (mimetypes.guess_type(object_name)[0] or
+               'application/octet-stream')
+    if (metadata.get('content-type', guessed) != guessed or
+            [k for k in metadata if k != 'content-type']):
+        return metadata
+
+
+def archive_objects(orig_storage_url, orig_token, dest_storage_url,
+                    dest_token, container_name, object_names,
+                    orig_conn_pool=None, dest_conn_pool=None,
+                    response_timeout=300):
+    """Copy small objects of a container with a single archive upload.
+
+    object_names are (last_modified, name) like for sync_object. Their
+    bodies are fetched and packed in a tar archive extracted on
+    destination by the extract-archive middleware, the metadata the
+    extraction can't carry are then POSTed. Return the object_names
+    which couldn't be copied that way (manifests, names not fitting in
+    an archive, errors...) to be copied one by one.
+    """
+    left = []
+    entries = {}
+    archive = cStringIO.StringIO()
+    tar = tarfile.open(fileobj=archive, mode='w')
+    for object_name_etag in object_names:
+        object_name = object_name_etag[1]
+        if object_name.startswith(('/', './')):
+            # The middleware would strip them from the name.
+            left.append(object_name_etag)
+            continue
+        try:
+            orig_headers, orig_body = get_object(
+                orig_storage_url, orig_token, container_name, object_name,
+                resp_chunk_size=None, conn_pool=orig_conn_pool,
+                query_string='multipart-manifest=get')
+        except(swiftclient.ClientException), e:
+            logging.info("error get object: %s, %s" % (
+                         object_name, e.http_reason))
+            left.append(object_name_etag)
+            continue
+        if (orig_headers.get('x-static-large-object', '').lower() == 'true'
+                or 'x-object-manifest' in orig_headers):
+            left.append(object_name_etag)
+            continue
+        md5 = hashlib.md5(orig_body).hexdigest()
+        origin_etag = _etag(orig_headers.get('etag'))
+        if origin_etag not in (None, md5):
+            _record_integrity(dest_storage_url, container_name, object_name,
+                              len(orig_body), md5, origin_etag, None)
+            logging.info("error sync object: %s, md5 %s differs from the "
+                         "origin etag %s" % (object_name, md5, origin_etag))
+            left.append(object_name_etag)
+            continue
+        if isinstance(object_name, unicode):
+            path = object_name.encode('utf-8')
+        else:
+            path = object_name
+        info = tarfile.TarInfo(path)
+        info.size = len(orig_body)
+        info.mtime = int(float(orig_headers.get('x-timestamp') or
+                               time.time()))
+        tar.addfile(info, cStringIO.StringIO(orig_body))
+        entries[path] = (object_name_etag, orig_headers, md5)
+    tar.close()
+    if not entries:
+        return left
+
+    result = _bulk_request(dest_storage_url, dest_token, 'PUT',
+                           '/%s?extract-archive=tar' % quote(container_name),
+                           {}, archive.getvalue(), 'EXTRACT_ARCHIVE',
+                           conn_pool=dest_conn_pool,
+                           response_timeout=response_timeout)
+    # The failed objects are given as container/object, or as the
+    # whole /v1/account/container/object by older releases.
+    account = urllib2.urlparse.urlparse(dest_storage_url).path.strip('/')
+    prefix = '%s/' % container_name
+    if isinstance(prefix, unicode):
+        prefix = prefix.encode('utf-8')
+    for path, status in result.get('Errors', []):
+        # Unquote the utf-8 bytes the entries are keyed with, not the
+        # unicode decoded from the JSON.
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        path = urllib.unquote(path).lstrip('/')
+        if path.startswith(account + '/'):
+            path = path[len(account) + 1:]
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+        if path in entries:
+            logging.info("error sync object: %s, %s" % (
+                path.decode('utf-8'), status))
+            left.append(entries.pop(path)[0])
+
+    metrics = swsync.utils.get_metrics()
+    for path, (object_name_etag, orig_headers, md5) in entries.iteritems():
+        object_name = object_name_etag[1]
+        size = int(orig_headers.get('content-length') or 0)
+        _record_integrity(dest_storage_url, container_name, object_name,
+                          size, md5, _etag(orig_headers.get('etag')), None)
+        metrics.incr('objects_copied')
+        metrics.incr('bytes_copied', size)
+        metadata = _extracted_metadata(object_name, orig_headers)
+        if metadata is None:
+            continue
+        try:
+            post_object(dest_storage_url, dest_token, container_name,
+                        object_name, metadata, conn_pool=dest_conn_pool)
+        except(swiftclient.ClientException), e:
+            logging.info("error sync object metadata: %s, %s" % (
+                         object_name, e.http_reason))
+            left.append(object_name_etag)
+    return left
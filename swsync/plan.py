@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import json
+
+# Summary counter and swift requests of each action.
+ACTIONS = {
+    'copy': ('objects_copy', 2),
+    'post': ('objects_post', 3),
+    'delete': ('objects_delete', 1),
+    'create_container': ('containers_create', 1),
+    'delete_container': ('containers_delete', 1),
+}
+
+
+def new_summary():
+    return dict.fromkeys(('objects_copy', 'objects_post', 'objects_delete',
+                          'bytes_copy', 'containers_create',
+                          'containers_delete', 'requests', 'errors'), 0)
+
+
+def estimate(summary, throughput):
+    """Estimate the seconds needed to apply a plan.
+
+    throughput is the (objects/s, bytes/s) measured by previous runs,
+    return None when unknown.
+    """
+    if not throughput:
+        return None
+    objects_rate, bytes_rate = throughput
+    seconds = 0.0
+    if objects_rate:
+        seconds = (summary['objects_copy'] + summary['objects_post'] +
+                   summary['objects_delete']) / objects_rate
+    if bytes_rate:
+        seconds = max(seconds, summary['bytes_copy'] / bytes_rate)
+    return seconds
+
+
+class PlanWriter(object):
+    """Write a sync plan as JSON lines.
+
+    Action lines have account, container, action and, for objects
+    actions, name, bytes and last_modified. Each account is followed by
+    its summary line ({"account": ..., "summary": {...}}) and the plan
+    ends with a total line ({"total": {...}, "estimated_seconds": ...}).
+    Listings errors are written as {"account", "container", "error"}
+    lines, the plan is then incomplete.
+    """
+    def __init__(self, fp):
+        self.fp = fp
+        self.total = new_summary()
+        self.accounts = {}
+
+    def _write(self, entry):
+        self.fp.write(json.dumps(entry, sort_keys=True) + '\n')
+
+    def _count(self, account, key, value=1):
+        summary = self.accounts.setdefault(account, new_summary())
+        summary[key] += value
+        self.total[key] += value
+
+    def add(self, account, container, action, obj=None):
+        entry = {'account': account, 'container': container,
+                 'action': action}
+        if obj is not None:
+            entry.update(name=obj['name'], bytes=obj.get('bytes', 0),
+                         last_modified=obj.get('last_modified'))
+        self._write(entry)
+        key, requests = ACTIONS[action]
+        self._count(account, key)
+        self._count(account, 'requests', requests)
+        if action == 'copy':
+            self._count(account, 'bytes_copy', entry['bytes'] or 0)
+
+    def error(self, account, container, error):
+        self._write({'account': account, 'container': container,
+                     'error': str(error)})
+        self._count(account, 'errors')
+
+    def account_done(self, account):
+        self._write({'account': account,
+                     'summary': self.accounts.pop(account, new_summary())})
+
+    def close(self, throughput=None):
+        """Write the total line and return the estimated seconds."""
+        seconds = estimate(self.total, throughput)
+        self._write({'total': self.total, 'estimated_seconds': seconds})
+        return seconds
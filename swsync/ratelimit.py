@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import time
+
+import eventlet
+
+
+def parse_window(window):
+    """Parse a HHMM-HHMM time window into minutes of the day."""
+    start, end = window.split('-')
+    return (int(start[:2]) * 60 + int(start[2:]),
+            int(end[:2]) * 60 + int(end[2:]))
+
+
+class TokenBucket(object):
+    """Token bucket shared by all the green threads.
+
+    rate is the amount of tokens per second, 0 for no limit. windows
+    is a list of ((start, end), rate) in minutes of the local day
+    overriding rate during those windows, a window can span midnight.
+    Up to burst seconds of tokens are accumulated while idle.
+    """
+    def __init__(self, rate, windows=None, burst=1.0):
+        self.default_rate = rate
+        self.windows = windows or []
+        self.burst = burst
+        self.tokens = 0.0
+        self.updated = time.time()
+
+    @property
+    def enabled(self):
+        return bool(self.default_rate or self.windows)
+
+    def rate(self, now):
+        localtime = time.localtime(now)
+        minute = localtime.tm_hour * 60 + localtime.tm_min
+        for (start, end), rate in self.windows:
+            if start <= end and start <= minute < end:
+                return rate
+            if start > end and (minute >= start or minute < end):
+                return rate
+        return self.default_rate
+
+    def consume(self, amount):
+        """Take amount tokens, sleep until they are available."""
+        now = time.time()
+        rate = self.rate(now)
+        if not rate:
+            self.updated = now
+            return
+        self.tokens = min(rate * self.burst,
+                          self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        # Go in debt, the next consumers will wait for it to be paid.
+        self.tokens -= amount
+        if self.tokens < 0:
+            eventlet.sleep(-self.tokens / rate)
+
+
+class ThrottledIter(object):
+    """Iterate over chunks of data at the pace of a bytes bucket."""
+    def __init__(self, iterable, bucket):
+        self.iterable = iterable
+        self.iterator = iter(iterable)
+        self.bucket = bucket
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        chunk = next(self.iterator)
+        self.bucket.consume(len(chunk))
+        return chunk
+
+    def close(self):
+        if hasattr(self.iterable, 'close'):
+            self.iterable.close()
+
+
+class ThrottledReader(object):
+    """File-like object read at the pace of a bytes bucket."""
+    def __init__(self, fileobj, bucket):
+        self.fileobj = fileobj
+        self.bucket = bucket
+
+    def read(self, size=-1):
+        chunk = self.fileobj.read(size)
+        self.bucket.consume(len(chunk))
+        return chunk
+
+
+class Limiter(object):
+    """Requests and bytes rate limits of a cluster."""
+    def __init__(self, requests, bytes):
+        self.requests = requests
+        self.bytes = bytes
+
+    def request(self):
+        """Wait for the right to send a request."""
+        self.requests.consume(1)
+
+    def throttle(self, contents):
+        """Wrap a body, string, iterator or file-like, to limit it."""
+        if not self.bytes.enabled:
+            return contents
+        if isinstance(contents, basestring):
+            self.bytes.consume(len(contents))
+            return contents
+        if hasattr(contents, 'read'):
+            return ThrottledReader(contents, self.bytes)
+        return ThrottledIter(contents, self.bytes)
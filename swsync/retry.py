@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import httplib
+import json
+import logging
+import os
+import random
+import socket
+
+import eventlet
+import eventlet.green.httplib
+
+import swsync.concurrency
+import swsync.utils
+
+# Default (attempts, base_delay) of each class of transient errors.
+DEFAULT_POLICIES = {
+    'overload': (5, 2.0),
+    'timeout': (3, 1.0),
+    'network': (3, 1.0),
+    'server': (2, 1.0),
+}
+
+
+# swift.common.bufferedhttp connections raise the exceptions of the
+# green httplib, which aren't the ones of httplib.
+NETWORK_ERRORS = (socket.error, httplib.HTTPException,
+                  eventlet.green.httplib.HTTPException)
+
+
+def classify(error):
+    """Get the class of a transient error or None if it is permanent."""
+    if isinstance(error, (eventlet.Timeout, socket.timeout)):
+        return 'timeout'
+    if isinstance(error, NETWORK_ERRORS):
+        return 'network'
+    status = getattr(error, 'http_status', None)
+    if status in swsync.concurrency.OVERLOAD_STATUSES:
+        return 'overload'
+    if status is not None and status >= 500:
+        return 'server'
+    return None
+
+
+class Policy(object):
+    """How many times and how long to wait before retrying."""
+    def __init__(self, attempts, base_delay, max_delay):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        """Exponential backoff with full jitter of the nth attempt."""
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * 2 ** attempt))
+
+
+def call(policies, func, *args, **kwargs):
+    """Call func, retrying its transient errors within the run.
+
+    policies is a dict of Policy by error class as returned by
+    load_policies, the last error is raised once its attempts are
+    exhausted or right away if it is permanent.
+    """
+    attempt = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except(Exception, eventlet.Timeout), e:
+            policy = policies.get(classify(e))
+            if policy is None or attempt + 1 >= policy.attempts:
+                raise
+            delay = policy.delay(attempt)
+            logging.info("RETRY: %s in %.1fs (attempt %d/%d): %s",
+                         getattr(func, '__name__', ''), delay,
+                         attempt + 2, policy.attempts, e)
+            eventlet.sleep(delay)
+            attempt += 1
+
+
+def load_policies():
+    """Get the retry policies of the error classes from [retry]."""
+    max_delay = float(swsync.utils.get_config('retry', 'max_delay',
+                                              default=60))
+    policies = {}
+    for name, (attempts, base_delay) in DEFAULT_POLICIES.iteritems():
+        policies[name] = Policy(
+            int(swsync.utils.get_config('retry', '%s_attempts' % name,
+                                        default=attempts)),
+            float(swsync.utils.get_config('retry', '%s_base_delay' % name,
+                                          default=base_delay)),
+            max_delay)
+    return policies
+
+
+class FailedLog(object):
+    """File of the operations still failing after their retries.
+
+    One JSON entry per line, with an account, a container or an object
+    (action, container and name) to sync again.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fp = None
+
+    def write(self, entry):
+        # Open lazily so each forked process has its own file object,
+        # lines are appended in a single write.
+        if self._fp is None:
+            self._fp = open(self.path, 'a')
+        self._fp.write(json.dumps(entry) + '\n')
+        self._fp.flush()
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+
+def take_failed(path):
+    """Read the entries of a failed operations file and remove it.
+
+    The file is renamed while read so the operations failing again can
+    be written to a new one.
+    """
+    if not os.path.exists(path):
+        return []
+    taken = path + '.retrying'
+    os.rename(path, taken)
+    with open(taken) as fp:
+        entries = [json.loads(line) for line in fp if line.strip()]
+    os.unlink(taken)
+    return entries
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import sqlite3
+import time
+
+
+class SyncState(object):
+    """Persistent state of the containers synchronizations.
+
+    Keep for each container the origin stats seen at the last
+    successful sync so the next run can skip containers that have not
+    changed since.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+
+    @property
+    def db(self):
+        # Connect lazily so a forked process doesn't share the
+        # connection of its parent.
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=30)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS containers (
+                    account TEXT NOT NULL,
+                    container TEXT NOT NULL,
+                    object_count INTEGER,
+                    bytes_used INTEGER,
+                    listing_checksum TEXT,
+                    last_modified TEXT,
+                    synced_at REAL,
+                    PRIMARY KEY (account, container))""")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    account TEXT NOT NULL,
+                    container TEXT NOT NULL,
+                    marker TEXT NOT NULL,
+                    checkpoint_at REAL,
+                    PRIMARY KEY (account, container))""")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id REAL NOT NULL,
+                    worker INTEGER NOT NULL,
+                    finished REAL,
+                    objects INTEGER,
+                    bytes INTEGER,
+                    PRIMARY KEY (run_id, worker))""")
+            columns = [x[1] for x in
+                       self._db.execute("PRAGMA table_info(containers)")]
+            if 'last_modified' not in columns:
+                self._db.execute("ALTER TABLE containers "
+                                 "ADD COLUMN last_modified TEXT")
+            self._db.commit()
+        return self._db
+
+    def get(self, account, container):
+        """Get the state recorded for a container or None."""
+        row = self.db.execute(
+            "SELECT * FROM containers WHERE account = ? AND container = ?",
+            (account, container)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(row.keys(), row))
+
+    def set(self, account, container, object_count, bytes_used,
+            listing_checksum=None, last_modified=None):
+        """Record a successful sync of a container."""
+        self.db.execute(
+            "INSERT OR REPLACE INTO containers (account, container, "
+            "object_count, bytes_used, listing_checksum, last_modified, "
+            "synced_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (account, container, object_count, bytes_used,
+             listing_checksum, last_modified, time.time()))
+        self.db.commit()
+
+    def delete(self, account, container):
+        """Forget a container."""
+        self.db.execute(
+            "DELETE FROM containers WHERE account = ? AND container = ?",
+            (account, container))
+        self.db.commit()
+
+    def get_marker(self, account, container):
+        """Get the checkpoint of an unfinished container sync or None."""
+        row = self.db.execute(
+            "SELECT marker FROM checkpoints "
+            "WHERE account = ? AND container = ?",
+            (account, container)).fetchone()
+        return row and row[0] or None
+
+    def set_marker(self, account, container, marker):
+        """Record that a container sync went up to marker included."""
+        self.db.execute(
+            "INSERT OR REPLACE INTO checkpoints (account, container, "
+            "marker, checkpoint_at) VALUES (?, ?, ?, ?)",
+            (account, container, marker, time.time()))
+        self.db.commit()
+
+    def clear_marker(self, account, container):
+        """Forget the checkpoint of a container fully synced."""
+        self.db.execute(
+            "DELETE FROM checkpoints WHERE account = ? AND container = ?",
+            (account, container))
+        self.db.commit()
+
+    def unchanged(self, account, container, last_modified=None):
+        """Check a container from an account listing against its state.
+
+        container is an entry of the account listing (name, count and
+        bytes). When both last_modified (the stamp of the last-modified
+        middleware) and the recorded one are known they are compared,
+        otherwise it falls back to compare the container stats.
+        """
+        state = self.get(account, container['name'])
+        if state is None:
+            return False
+        if last_modified is not None and state['last_modified'] is not None:
+            return state['last_modified'] == last_modified
+        return (state['object_count'] == container['count'] and
+                state['bytes_used'] == container['bytes'])
+
+    def record_run(self, run_id, worker, objects, bytes):
+        """Record what a process of a run started at run_id synced."""
+        self.db.execute(
+            "INSERT OR REPLACE INTO runs (run_id, worker, finished, "
+            "objects, bytes) VALUES (?, ?, ?, ?, ?)",
+            (run_id, worker, time.time(), objects, bytes))
+        self.db.commit()
+
+    def throughput(self, runs=5):
+        """Get the (objects/s, bytes/s) of the last runs or None."""
+        rows = self.db.execute(
+            "SELECT MAX(finished) - run_id, SUM(objects), SUM(bytes) "
+            "FROM runs GROUP BY run_id HAVING SUM(objects) > 0 "
+            "ORDER BY run_id DESC LIMIT ?", (runs,)).fetchall()
+        duration = sum(x[0] for x in rows)
+        if not duration:
+            return None
+        return (sum(x[1] for x in rows) / duration,
+                sum(x[2] for x in rows) / duration)
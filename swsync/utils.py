@@ -18,8 +18,20 @@ import ConfigParser
 import logging
 import os
 
+import eventlet.semaphore
+
+import swsync.buffers
+import swsync.integrity
+import swsync.metrics
+import swsync.ratelimit
+
 
 CONFIG = None
+BUDGET = None
+LIMITERS = {}
+METRICS = None
+BUFFERS = None
+INTEGRITY = None
 curdir = os.path.abspath(os.path.dirname(__file__))
 INIFILE = os.path.abspath(os.path.join(curdir, '..', 'etc', "config.ini"))
 SAMPLE_INIFILE = os.path.abspath(os.path.join(curdir, '..',
@@ -71,6 +83,8 @@ def get_config(section, option, default=None, _config=None):
         CONFIG = parse_ini()
 
     if not CONFIG.has_section(section):
+        if not default is None:
+            return default
         raise ConfigurationError("Invalid configuration, missing section: %s" %
                                  section)
     if CONFIG.has_option(section, option):
@@ -80,3 +94,103 @@ def get_config(section, option, default=None, _config=None):
     else:
         raise ConfigurationError("Invalid configuration, missing "
                                  "section/option: %s/%s" % (section, option))
+
+
+def get_adaptive_max():
+    """Get the max objects transfers of the adaptive concurrency.
+
+    None when sync_adaptive_concurrency is off.
+    """
+    if get_config('concurrency', 'sync_adaptive_concurrency',
+                  default='false').lower() not in ('true', 'yes', 'on', '1'):
+        return None
+    concurrency = int(get_config('concurrency',
+                                 'sync_swift_client_concurrency'))
+    return int(get_config('concurrency', 'sync_max_swift_client_concurrency',
+                          default=concurrency * 4))
+
+
+def get_budget():
+    """Get the semaphore bounding the swift requests in flight.
+
+    The budget is shared by every account and container being synced
+    at the same time so the total amount of open sockets stay capped
+    whatever the account concurrency is. With the adaptive concurrency
+    it is at least its max so the transfers can actually go up to it.
+    """
+    global BUDGET
+    if BUDGET is None:
+        size = int(get_config('concurrency', 'sync_max_connections',
+                              default=get_config(
+                                  'concurrency',
+                                  'sync_swift_client_concurrency')))
+        BUDGET = eventlet.semaphore.Semaphore(
+            max(size, get_adaptive_max() or 0))
+    return BUDGET
+
+
+def get_buffers():
+    """Get the pool of the transfer buffers of the process.
+
+    Buffers are buffer_size bytes, buffer_pool_size of them are kept
+    between transfers.
+    """
+    global BUFFERS
+    if BUFFERS is None:
+        BUFFERS = swsync.buffers.BufferPool(
+            int(get_config('sync', 'buffer_size', default=65536)),
+            int(get_config('sync', 'buffer_pool_size', default=64)))
+    return BUFFERS
+
+
+def get_integrity_report():
+    """Get the integrity report of the run, None if not configured.
+
+    The checksums of the objects copied are written to the file set by
+    integrity_report in [sync].
+    """
+    global INTEGRITY
+    if INTEGRITY is None:
+        path = get_config('sync', 'integrity_report', default='')
+        INTEGRITY = path and swsync.integrity.IntegrityReport(path) or False
+    return INTEGRITY or None
+
+
+def get_limiter(cluster):
+    """Get the rate limiter of the origin or destination cluster.
+
+    Limits are set in [ratelimit] by <cluster>_requests_per_second and
+    <cluster>_bytes_per_second, 0 for no limit. They can be overridden
+    for a time window of the day by <option>_HHMM-HHMM options.
+    """
+    if cluster not in LIMITERS:
+        buckets = []
+        for kind in ('requests', 'bytes'):
+            option = '%s_%s_per_second' % (cluster, kind)
+            rate = float(get_config('ratelimit', option, default=0))
+            windows = []
+            if CONFIG.has_section('ratelimit'):
+                for key, value in CONFIG.items('ratelimit'):
+                    if key.startswith(option + '_'):
+                        windows.append((swsync.ratelimit.parse_window(
+                            key[len(option) + 1:]), float(value)))
+            buckets.append(swsync.ratelimit.TokenBucket(rate, windows))
+        LIMITERS[cluster] = swsync.ratelimit.Limiter(*buckets)
+    return LIMITERS[cluster]
+
+
+def get_metrics():
+    """Get the metrics of the process (see swsync.metrics).
+
+    They are sent to StatsD when statsd_host is set in [metrics].
+    """
+    global METRICS
+    if METRICS is None:
+        statsd = None
+        host = get_config('metrics', 'statsd_host', default='')
+        if host:
+            statsd = (host, int(get_config('metrics', 'statsd_port',
+                                           default=8125)))
+        METRICS = swsync.metrics.Metrics(
+            get_config('metrics', 'prefix', default='swsync'), statsd)
+    return METRICS
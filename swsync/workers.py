@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import errno
+import hashlib
+import json
+import logging
+import os
+import select
+
+
+def shard_of(key, shards):
+    """Get the shard of key, stable across runs and hosts."""
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return int(hashlib.md5(key).hexdigest(), 16) % shards
+
+
+def _child(index, count, target, wfd):
+    def report(counters):
+        os.write(wfd, json.dumps(counters) + '\n')
+
+    status = 0
+    try:
+        status = target(index, count, report) or 0
+    except BaseException:
+        logging.exception("worker %d failed", index)
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def run(count, target):
+    """Run target in count forked processes.
+
+    target is called with (index, count, report) in each process,
+    report(counters) sends a dict of counters to the parent which logs
+    their sum across processes and its return value, if any, is the
+    exit status of the process. Return 0 when all processes exited
+    successfully, 1 otherwise.
+    """
+    children = {}
+    readers = {}
+    for index in xrange(count):
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(rfd)
+            for fd in readers:
+                os.close(fd)
+            _child(index, count, target, wfd)
+        os.close(wfd)
+        children[pid] = index
+        readers[rfd] = (index, '')
+
+    progress = {}
+    while readers:
+        try:
+            ready, _, _ = select.select(list(readers), [], [])
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        for fd in ready:
+            index, buf = readers[fd]
+            data = os.read(fd, 65536)
+            if not data:
+                os.close(fd)
+                del readers[fd]
+                continue
+            lines = (buf + data).split('\n')
+            readers[fd] = (index, lines.pop())
+            for line in lines:
+                progress[index] = json.loads(line)
+            if lines:
+                totals = {}
+                for counters in progress.itervalues():
+                    for key, value in counters.iteritems():
+                        totals[key] = totals.get(key, 0) + value
+                logging.info("PROGRESS: %s", ', '.join(
+                    '%s: %d' % x for x in sorted(totals.iteritems())))
+
+    status = 0
+    for pid, index in children.iteritems():
+        _, exit_status = os.waitpid(pid, 0)
+        if exit_status:
+            logging.info("ERROR: worker %d exited with status %d",
+                         index, exit_status >> 8)
+            status = 1
+    return status
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import logging
+
+import eventlet
+import eventlet.event
+import eventlet.queue
+
+import swsync.retry
+import swsync.utils
+
+
+class Batch(object):
+    """Jobs submitted together, to wait for their completion.
+
+    A job failed when it raised or returned False, its arguments are
+    then appended to errors and (func, args, kwargs) to failed_jobs.
+    """
+    def __init__(self, work_queue):
+        self.work_queue = work_queue
+        self.pending = 0
+        self.submitted = 0
+        self.errors = []
+        self.failed_jobs = []
+        self._done = None
+        # Sequence numbers of the jobs pending or failed.
+        self._unfinished = set()
+        self._first_failed = None
+
+    def submit(self, func, *args, **kwargs):
+        """Queue a job, block while the queue is full."""
+        seq = self.submitted
+        self.submitted += 1
+        self.pending += 1
+        self._unfinished.add(seq)
+        self.work_queue.put(self, seq, func, args, kwargs)
+
+    def low_water_mark(self):
+        """Count the jobs done successfully before the first unfinished.
+
+        Jobs complete out of order, the first low_water_mark() jobs
+        submitted are the ones known to be done.
+        """
+        if not self._unfinished:
+            return self.submitted
+        return min(self._unfinished)
+
+    def first_failed(self):
+        """Sequence number of the first job failed, None if none did.
+
+        low_water_mark() never goes past it.
+        """
+        return self._first_failed
+
+    def _job_done(self, seq, func, args, kwargs, failed):
+        if failed:
+            self.errors.append(args)
+            self.failed_jobs.append((func, args, kwargs))
+            if self._first_failed is None or seq < self._first_failed:
+                self._first_failed = seq
+        else:
+            self._unfinished.discard(seq)
+        self.pending -= 1
+        if not self.pending and self._done is not None:
+            self._done.send()
+
+    def wait(self):
+        """Wait for all the jobs submitted so far and return errors."""
+        if self.pending:
+            self._done = eventlet.event.Event()
+            self._done.wait()
+            self._done = None
+        return self.errors
+
+
+class WorkQueue(object):
+    """Bounded queue of jobs consumed by a fixed set of green workers.
+
+    A single queue is shared by all the containers and accounts synced
+    during a run so the workers stay busy while listings are produced,
+    producers are blocked when maxsize jobs are waiting.
+
+    With a controller (see swsync.concurrency.AIMDController) the jobs
+    run at once are limited by the controller, workers is then its
+    maximum.
+
+    Jobs raising a transient error are queued again after a backoff
+    according to policies, a dict of swsync.retry.Policy by error
+    class (see swsync.retry.classify).
+    """
+    def __init__(self, workers, maxsize, controller=None, policies=None):
+        self.workers = workers
+        self.queue = eventlet.queue.LightQueue(maxsize)
+        self.threads = []
+        self.controller = controller
+        self.policies = policies or {}
+        # Jobs being run by the workers.
+        self.active = 0
+
+    def batch(self):
+        return Batch(self)
+
+    def put(self, batch, seq, func, args, kwargs, attempt=0):
+        if not self.threads:
+            self.threads = [eventlet.spawn(self._worker)
+                            for _ in xrange(self.workers)]
+        self.queue.put((batch, seq, func, args, kwargs, attempt))
+
+    def _retry(self, job, error):
+        """Queue a job again later if error is worth it."""
+        func, args, attempt = job[2], job[3], job[5]
+        policy = self.policies.get(swsync.retry.classify(error))
+        if policy is None or attempt + 1 >= policy.attempts:
+            return False
+        delay = policy.delay(attempt)
+        logging.info("RETRY: %s%s in %.1fs (attempt %d/%d): %s",
+                     getattr(func, '__name__', ''), args[-2:], delay,
+                     attempt + 2, policy.attempts, error)
+        eventlet.spawn_after(delay, self.put, *(job[:5] + (attempt + 1,)))
+        return True
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            batch, seq, func, args, kwargs, _ = job
+            failed = True
+            error = None
+            retried = False
+            if self.controller is not None:
+                started = self.controller.acquire()
+            self.active += 1
+            try:
+                with swsync.utils.get_budget():
+                    failed = func(*args, **kwargs) is False
+                if failed:
+                    swsync.utils.get_metrics().incr('errors', status='failed')
+            except(Exception, eventlet.Timeout), e:
+                error = e
+                swsync.utils.get_metrics().incr(
+                    'errors', status=getattr(e, 'http_status', None) or
+                    e.__class__.__name__)
+                retried = self._retry(job, e)
+                if not retried:
+                    logging.info("ERROR: %s%s: %s",
+                                 getattr(func, '__name__', ''), args[-2:], e)
+            finally:
+                self.active -= 1
+                if self.controller is not None:
+                    self.controller.release(started, failed, error)
+                if not retried:
+                    batch._job_done(seq, func, args, kwargs, failed)
@@ -14,12 +14,26 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import json
 import logging
-
+import os
+import random
+import StringIO
+import tempfile
+import time
+
+import eventlet
+import eventlet.event
 import keystoneclient
 import swiftclient
 
 import swsync.accounts
+import swsync.leases
+import swsync.objects
+import swsync.plan
+import swsync.state
+import swsync.utils
+import swsync.workers
 import tests.units.base
 import tests.units.fakes as fakes
 
@@ -71,9 +85,10 @@ class TestAccountSyncMetadata(TestAccountBase):
         class Containers(object):
             def sync(*args, **kwargs):
                 sync_container_called.append(args)
+                return lambda: None
 
             def delete_container(*args, **kwargs):
-                pass
+                return []
 
         self.accounts_cls.container_cls = Containers()
         self.accounts_cls.sync_account("http://orig", "otoken",
@@ -241,6 +256,251 @@ class TestAccountSync(TestAccountBase):
         self.assertEquals(tenant_list_ids, ret_orig_storage_id)
         [self.assertTrue(y[1].startswith(fakes.STORAGE_DEST)) for y in ret]
 
+    def test_process_shard(self):
+        ret = []
+
+        def sync_account(orig_storage_url, *args):
+            ret.append(orig_storage_url[orig_storage_url.find('AUTH_') + 5:])
+        self.accounts_cls.sync_account = sync_account
+        for index in xrange(2):
+            self.accounts_cls.process(shard=(index, 2))
+            self.assertTrue(all(swsync.workers.shard_of(x, 2) == index
+                                for x in ret))
+            ret[:] = []
+
+    def test_process_leases(self):
+        ret = []
+
+        def sync_account(orig_storage_url, *args):
+            ret.append(orig_storage_url[orig_storage_url.find('AUTH_') + 5:])
+            return orig_storage_url.endswith(tenant_ids[1])
+        tenant_ids = sorted(x['id'] for x in fakes.TENANTS_LIST.values())
+        self.accounts_cls.sync_account = sync_account
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        self.accounts_cls.leases = swsync.leases.SQLiteLeases(
+            path, 'node1', 300)
+        node2 = swsync.leases.SQLiteLeases(path, 'node2', 300)
+        # Claimed by another node, still being synced, which keeps the
+        # pass open.
+        node2.begin_pass()
+        node2.claim(tenant_ids[0])
+        self.accounts_cls.process()
+        self.assertEquals(sorted(ret), tenant_ids[1:])
+
+        # Synced accounts are skipped in the same pass, failed ones can
+        # be claimed again.
+        ret[:] = []
+        self.accounts_cls.process()
+        self.assertEquals(sorted(ret), tenant_ids[2:])
+
+        # Everything is synced again in the next pass.
+        node2.end_pass()
+        ret[:] = []
+        self.accounts_cls.process()
+        self.assertEquals(sorted(ret), tenant_ids[1:])
+
+    def test_retry_failed(self):
+        synced_accounts = []
+        synced_containers = []
+        retried = []
+        deleted = []
+
+        class Containers(object):
+            def sync(*args, **kwargs):
+                synced_containers.append((kwargs['account_id'], args[7]))
+
+            def retry(*args):
+                retried.append((args[6], args[7]))
+
+            def delete_container(*args, **kwargs):
+                deleted.append((kwargs['account_id'], args[3], args[4]))
+        self.accounts_cls.container_cls = Containers()
+        self.accounts_cls.sync_account = (
+            lambda url, *args: synced_accounts.append(url))
+
+        entries = [{'account': 'a1'},
+                   {'account': 'a1', 'container': 'c1'},
+                   {'account': 'a2', 'container': 'c1'},
+                   {'account': 'a2', 'container': 'c1', 'action': 'copy',
+                    'name': 'o1'},
+                   {'account': 'a2', 'container': 'c2', 'action': 'copy',
+                    'name': 'o1'},
+                   {'account': 'a2', 'container': 'c3',
+                    'action': 'delete_container', 'name': None}]
+        self.accounts_cls.retry_failed(entries)
+        self.assertEqual(len(synced_accounts), 1)
+        self.assertTrue(synced_accounts[0].endswith('AUTH_a1'))
+        self.assertEqual(synced_containers, [('a2', 'c1')])
+        self.assertEqual(retried, [('a2', entries[4:5])])
+        self.assertEqual(deleted, [('a2', [], [{'name': 'c3'}])])
+
+    def test_plan_account(self):
+        def get_account(_, token, **kwargs):
+            if token == 'otoken':
+                return ({}, [{'name': 'cont1'}])
+            return ({}, [{'name': 'cont1'}, {'name': 'cont2'}])
+        self.stubs.Set(swiftclient, 'get_account', get_account)
+
+        class Containers(object):
+            def plan(*args):
+                yield ('copy', {'name': 'obj1', 'bytes': 3})
+
+            def plan_delete(*args):
+                yield ('delete_container', None)
+        self.accounts_cls.container_cls = Containers()
+
+        fp = StringIO.StringIO()
+        writer = swsync.plan.PlanWriter(fp)
+        self.accounts_cls.plan_account(writer, 'a1', 'orig_url', 'otoken',
+                                       'dest_url', 'dtoken')
+        lines = [json.loads(x) for x in fp.getvalue().splitlines()]
+        self.assertEqual([x.get('action') for x in lines],
+                         ['delete_container', 'copy', None])
+        self.assertEqual(lines[-1]['summary']['bytes_copy'], 3)
+
+    def test_apply(self):
+        called = []
+
+        class FailedLog(list):
+            write = list.append
+        self.accounts_cls.container_cls.failed_log = FailedLog()
+
+        def operation(action, result=True):
+            def _operation(*args, **kwargs):
+                called.append((action,) + args[-2:])
+                return result
+            return _operation
+        containers = self.accounts_cls.container_cls
+        containers.sync_object = operation('copy')
+        containers.sync_object_metadata = operation('post', False)
+        containers.delete_object = operation('delete')
+        containers.create_container = operation('create_container')
+        containers.delete_empty_container = operation('delete_container')
+        self.stubs.Set(swsync.objects, 'bulk_delete_limit', lambda url: 0)
+        self.stubs.Set(swiftclient, 'get_container', None)
+
+        plan = [{'account': 'a1', 'container': 'c1',
+                 'action': 'create_container'},
+                {'account': 'a1', 'container': 'c1', 'action': 'copy',
+                 'name': 'o1', 'bytes': 3, 'last_modified': '1'},
+                {'account': 'a1', 'container': 'c1', 'action': 'post',
+                 'name': 'o2', 'bytes': 3, 'last_modified': '1'},
+                {'account': 'a1', 'container': 'c2', 'action': 'delete',
+                 'name': 'o3', 'bytes': 3, 'last_modified': '1'},
+                {'account': 'a1', 'container': 'c2',
+                 'action': 'delete_container'},
+                {'account': 'a1', 'container': 'c3', 'error': 'TESTED'},
+                {'account': 'a1', 'summary': {}}]
+        fp = StringIO.StringIO(
+            ''.join(json.dumps(x) + '\n' for x in plan))
+        self.assertFalse(self.accounts_cls.apply(fp))
+        self.assertEqual(sorted(called), [
+            ('copy', 'c1', ('1', 'o1')),
+            ('create_container', 'token', 'c1'),
+            ('delete', 'c2', 'o3'),
+            ('delete_container', 'token', 'c2'),
+            ('post', 'c1', 'o2')])
+        # The container is deleted once its objects are.
+        self.assertTrue(called.index(('delete', 'c2', 'o3')) <
+                        called.index(('delete_container', 'token', 'c2')))
+        self.assertEqual(containers.failed_log, [
+            {'account': 'a1', 'container': 'c1', 'action': 'post',
+             'name': 'o2'}])
+
+    def test_apply_bulk_delete(self):
+        deleted = []
+        containers = self.accounts_cls.container_cls
+        self.stubs.Set(swsync.objects, 'bulk_delete_limit', lambda url: 2)
+        containers.bulk_delete = (
+            lambda url, token, container, names, **kwargs:
+            deleted.append((container, list(names))) or [])
+        containers.delete_object = (
+            lambda cnx, token, container, name, **kwargs:
+            deleted.append((container, name)))
+        containers.delete_empty_container = lambda *args: True
+
+        plan = [{'account': 'a1', 'container': 'c1', 'action': 'delete',
+                 'name': 'o%d' % x} for x in xrange(3)]
+        plan += [{'account': 'a1', 'container': 'c1',
+                  'action': 'delete_container'},
+                 {'account': 'a1', 'container': 'c2', 'action': 'delete',
+                  'name': 'o1'}]
+        fp = StringIO.StringIO(
+            ''.join(json.dumps(x) + '\n' for x in plan))
+        self.assertTrue(self.accounts_cls.apply(fp))
+        # A single object left is deleted on its own.
+        self.assertEqual(sorted(deleted), [('c1', ['o0', 'o1']),
+                                           ('c1', 'o2'),
+                                           ('c2', 'o1')])
+
+    def test_apply_shard(self):
+        applied = []
+        self.accounts_cls.container_cls.create_container = (
+            lambda *args: applied.append(args[-1]) or True)
+
+        plan = [{'account': 'a%d' % x, 'container': 'c%d' % x,
+                 'action': 'create_container'} for x in xrange(10)]
+        fp = StringIO.StringIO(
+            ''.join(json.dumps(x) + '\n' for x in plan))
+        self.assertTrue(self.accounts_cls.apply(fp, shard=(1, 2)))
+        self.assertEqual(applied, [
+            'c%d' % x for x in xrange(10)
+            if swsync.workers.shard_of('a%d' % x, 2) == 1])
+
+    def test_record_run_integrity(self):
+        summaries = []
+
+        class Report(object):
+            def summary(self, *args):
+                summaries.append(args)
+        self.stubs.Set(swsync.utils, 'INTEGRITY', Report())
+        self.stubs.Set(swsync.utils, 'METRICS', None)
+        swsync.utils.get_metrics().incr('objects_verified', 2)
+        swsync.utils.get_metrics().incr('objects_mismatch')
+
+        self.accounts_cls.record_run(1.0, 3)
+        self.assertEqual(summaries, [(1.0, 3, 2, 0, 1)])
+
+    def test_plan_account_verify(self):
+        self.stubs.Set(swiftclient, 'get_account',
+                       lambda *args, **kwargs: ({}, [{'name': 'cont1'}]))
+
+        class Containers(object):
+            def verify(*args):
+                self.assertEqual(args[1:], (
+                    'cnx', 'orig_url', 'otoken', 'cnx', 'dest_url',
+                    'dtoken', 'cont1'))
+                yield ('post', {'name': 'obj1'})
+                yield ('error', {'name': 'obj2'})
+        self.accounts_cls.container_cls = Containers()
+        self.stubs.Set(swiftclient, 'http_connection', lambda url: 'cnx')
+
+        fp = StringIO.StringIO()
+        writer = swsync.plan.PlanWriter(fp)
+        self.accounts_cls.plan_account(writer, 'a1', 'orig_url', 'otoken',
+                                       'dest_url', 'dtoken', verify=True)
+        lines = [json.loads(x) for x in fp.getvalue().splitlines()]
+        self.assertEqual(lines[0]['action'], 'post')
+        self.assertEqual(lines[1]['error'], 'HEAD failed: obj2')
+        self.assertEqual(lines[-1]['summary']['errors'], 1)
+
+    def test_process_concurrently(self):
+        running = []
+        max_running = []
+
+        def sync_account(*args):
+            running.append(args)
+            max_running.append(len(running))
+            eventlet.sleep(0)
+            running.pop()
+        self.accounts_cls.sync_account = sync_account
+        self.accounts_cls.concurrency = 2
+        self.accounts_cls.process()
+        self.assertEquals(len(max_running), len(fakes.TENANTS_LIST))
+        self.assertEquals(max(max_running), 2)
+
     def test_sync_account(self):
         ret = []
 
@@ -252,9 +512,10 @@ class TestAccountSync(TestAccountBase):
         class Containers(object):
             def sync(*args, **kwargs):
                 ret.append(args)
+                return lambda: None
 
             def delete_container(*args, **kwargs):
-                pass
+                return []
         self.accounts_cls.container_cls = Containers()
 
         tenant_name = fakes.TENANTS_LIST.keys()[0]
@@ -270,6 +531,157 @@ class TestAccountSync(TestAccountBase):
                                         for x in fakes.CONTAINERS_LIST)
         self.assertEquals(ret_container_list, default_container_list)
 
+    def test_sync_account_retry(self):
+        self.stubs.Set(random, 'uniform', lambda a, b: 0)
+        called = []
+
+        def get_account(*args, **kwargs):
+            called.append(args[1])
+            if len(called) == 1:
+                raise swiftclient.client.ClientException("TESTED",
+                                                         http_status=503)
+            return ({}, [])
+        self.stubs.Set(swiftclient, 'get_account', get_account)
+
+        class Containers(object):
+            def delete_container(*args, **kwargs):
+                return []
+        self.accounts_cls.container_cls = Containers()
+        self.assertTrue(self.accounts_cls.sync_account(
+            "%s/AUTH_a1" % fakes.STORAGE_ORIG, "otoken",
+            "%s/AUTH_a1" % fakes.STORAGE_DEST, "dtoken"))
+        self.assertEqual(called, ['otoken', 'otoken', 'dtoken'])
+
+    def test_sync_account_skip_unchanged(self):
+        ret = []
+        orig_containers = [{'name': 'cont1', 'count': 2, 'bytes': 10},
+                           {'name': 'cont2', 'count': 2, 'bytes': 10},
+                           {'name': 'cont3', 'count': 2, 'bytes': 10}]
+        dest_containers = [{'name': 'cont1', 'count': 2, 'bytes': 10},
+                           {'name': 'cont2', 'count': 1, 'bytes': 5}]
+
+        def get_account(_, token, **kwargs):
+            if token == 'otoken':
+                return ({}, orig_containers)
+            return ({}, dest_containers)
+        self.stubs.Set(swiftclient, 'get_account', get_account)
+
+        class Containers(object):
+            def sync(*args, **kwargs):
+                ret.append(args[7])
+                return lambda: 'checksum'
+
+            def delete_container(*args, **kwargs):
+                return []
+        self.accounts_cls.container_cls = Containers()
+        self.accounts_cls.state = swsync.state.SyncState(':memory:')
+        for container in orig_containers:
+            self.accounts_cls.state.set('account', container['name'],
+                                        container['count'],
+                                        container['bytes'])
+        self.accounts_cls.state.set('account', 'cont1', 1, 5)
+
+        self.accounts_cls.sync_account("http://orig/AUTH_account", "otoken",
+                                       "http://dest/AUTH_account", "dtoken")
+        # cont1 has changed, cont2 and cont3 are not synced on dest.
+        self.assertEqual(ret, ['cont1', 'cont2', 'cont3'])
+        self.assertEqual(
+            self.accounts_cls.state.get('account', 'cont1')['object_count'],
+            2)
+
+        ret[:] = []
+        dest_containers[:] = orig_containers
+        self.accounts_cls.sync_account("http://orig/AUTH_account", "otoken",
+                                       "http://dest/AUTH_account", "dtoken")
+        self.assertEqual(ret, [])
+
+    def test_sync_account_containers_pipelined(self):
+        containers = [{'name': 'cont1', 'count': 2, 'bytes': 10},
+                      {'name': 'cont2', 'count': 2, 'bytes': 10}]
+        self.stubs.Set(swiftclient, 'get_account',
+                       lambda *args, **kwargs: ({}, containers))
+        done = eventlet.event.Event()
+        listed = []
+        finished = []
+
+        class Containers(object):
+            def sync(*args, **kwargs):
+                listed.append(args[7])
+
+                def wait():
+                    done.wait()
+                    finished.append(args[7])
+                    return 'checksum'
+                return wait
+
+            def delete_container(*args, **kwargs):
+                return []
+        self.accounts_cls.container_cls = Containers()
+        self.accounts_cls.container_concurrency = 1
+
+        gt = eventlet.spawn(self.accounts_cls.sync_account,
+                            "http://orig/AUTH_account", "otoken",
+                            "http://dest/AUTH_account", "dtoken")
+        for _ in xrange(10):
+            eventlet.sleep(0)
+        # The next container is listed while the objects of the first
+        # one are still being synced.
+        self.assertEqual(listed, ['cont1', 'cont2'])
+        self.assertEqual(finished, [])
+        done.send()
+        self.assertTrue(gt.wait())
+        self.assertEqual(sorted(finished), ['cont1', 'cont2'])
+        self.assertEqual(self.accounts_cls.stats['containers'], 2)
+
+    def test_sync_account_delete_container_failed(self):
+        self.stubs.Set(swiftclient, 'get_account',
+                       lambda *args, **kwargs: ({}, []))
+
+        class Containers(object):
+            def delete_container(*args, **kwargs):
+                return ['cont1', 'cont2']
+        self.accounts_cls.container_cls = Containers()
+
+        self.accounts_cls.sync_account("http://orig/AUTH_account", "otoken",
+                                       "http://dest/AUTH_account", "dtoken")
+        self.assertEqual(self.accounts_cls.stats['containers_failed'], 2)
+
+    def test_sync_account_skip_last_modified(self):
+        ret = []
+        containers = [{'name': 'cont1', 'count': 2, 'bytes': 10},
+                      {'name': 'cont2', 'count': 2, 'bytes': 10}]
+
+        def get_account(*args, **kwargs):
+            return ({}, containers)
+        self.stubs.Set(swiftclient, 'get_account', get_account)
+
+        class Containers(object):
+            def sync(*args, **kwargs):
+                ret.append(args[7])
+                return lambda: 'checksum'
+
+            def delete_container(*args, **kwargs):
+                return []
+
+            def get_last_modified(self, cnx, token, name):
+                return {'cont1': '1001.0'}.get(name)
+        self.accounts_cls.container_cls = Containers()
+        self.accounts_cls.use_last_modified = True
+        self.accounts_cls.state = swsync.state.SyncState(':memory:')
+        for container in containers:
+            self.accounts_cls.state.set('account', container['name'],
+                                        container['count'],
+                                        container['bytes'],
+                                        last_modified='1000.0')
+
+        self.accounts_cls.sync_account("http://orig/AUTH_account", "otoken",
+                                       "http://dest/AUTH_account", "dtoken")
+        # cont1 has been written since, cont2 has no stamp and same stats.
+        self.assertEqual(ret, ['cont1'])
+        self.assertEqual(
+            self.accounts_cls.state.get('account', 'cont1')['last_modified'],
+            '1001.0')
+
     def test_sync_exception_get_account(self):
         called = []
 
@@ -292,9 +704,10 @@ class TestAccountSync(TestAccountBase):
         class Containers():
             def delete_container(*args, **kwargs):
                 called.append("TESTED")
+                return []
 
             def sync(*args, **kwargs):
-                pass
+                return lambda: None
 
         self.accounts_cls.container_cls = Containers()
 
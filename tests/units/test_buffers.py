@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import swsync.buffers
+import tests.units.base as test_base
+
+
+class TestBufferPool(test_base.TestCase):
+    def test_reuse(self):
+        pool = swsync.buffers.BufferPool(16, 1)
+        buf1, buf2 = pool.get(), pool.get()
+        self.assertEqual(len(buf1), 16)
+        self.assertIsNot(buf1, buf2)
+        pool.put(buf1)
+        pool.put(buf2)
+        # Only count buffers are kept.
+        self.assertIs(pool.get(), buf1)
+        self.assertIsNot(pool.get(), buf2)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import time
+
+import eventlet
+import swiftclient
+
+import swsync.concurrency
+import swsync.workqueue
+import tests.units.base as test_base
+
+
+class TestAIMDController(test_base.TestCase):
+    def setUp(self):
+        super(TestAIMDController, self).setUp()
+        self.now = 1000.0
+        self.stubs.Set(time, 'time', lambda: self.now)
+        self.controller = swsync.concurrency.AIMDController(2, 1, 4)
+
+    def _run(self, count, failed=False, error=None, latency=0):
+        started = [self.controller.acquire() for _ in xrange(count)]
+        self.now += latency
+        for x in started:
+            self.controller.release(x, failed, error)
+
+    def test_is_overload(self):
+        self.assertTrue(swsync.concurrency.is_overload(
+            swiftclient.ClientException('TESTED', http_status=503)))
+        self.assertTrue(swsync.concurrency.is_overload(
+            swiftclient.ClientException('TESTED', http_status=498)))
+        self.assertTrue(swsync.concurrency.is_overload(eventlet.Timeout()))
+        self.assertFalse(swsync.concurrency.is_overload(
+            swiftclient.ClientException('TESTED', http_status=404)))
+        self.assertFalse(swsync.concurrency.is_overload(None))
+
+    def test_increase(self):
+        self._run(2)
+        self.assertEqual(self.controller.limit, 3)
+        self._run(3)
+        self._run(4)
+        self._run(4)
+        self.assertEqual(self.controller.limit, 4)
+
+    def test_hold_on_errors(self):
+        self._run(2, failed=True)
+        self.assertEqual(self.controller.limit, 2)
+
+    def test_hold_on_latency(self):
+        self.controller.latency_target = 1
+        self._run(2, latency=2)
+        self.assertEqual(self.controller.limit, 2)
+        self._run(2, latency=0.5)
+        self.assertEqual(self.controller.limit, 3)
+
+    def test_decrease_once_per_round(self):
+        self.controller.limit = 4
+        error = swiftclient.ClientException('TESTED', http_status=503)
+        self._run(4, error=error, latency=1)
+        self.assertEqual(self.controller.limit, 2)
+        self._run(2, error=error, latency=1)
+        self.assertEqual(self.controller.limit, 1)
+        self._run(1, error=error, latency=1)
+        self.assertEqual(self.controller.limit, 1)
+
+    def test_work_queue_limit(self):
+        running = []
+        max_running = []
+
+        def job():
+            running.append(True)
+            max_running.append(len(running))
+            eventlet.sleep(0)
+            running.pop()
+        controller = swsync.concurrency.AIMDController(2, 1, 3)
+        work_queue = swsync.workqueue.WorkQueue(4, 10, controller)
+        batch = work_queue.batch()
+        for _ in xrange(8):
+            batch.submit(job)
+        batch.wait()
+        self.assertEqual(len(max_running), 8)
+        self.assertEqual(max(max_running), 3)
+        self.assertEqual(controller.limit, 3)
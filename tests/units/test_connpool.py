@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import eventlet
+
+import swsync.connpool
+import tests.units.base as test_base
+
+
+class FakeConnection(object):
+    def __init__(self, url):
+        self.url = url
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(test_base.TestCase):
+    def setUp(self):
+        super(TestConnectionPool, self).setUp()
+        self.connected = []
+
+        def connect(url):
+            conn = FakeConnection(url)
+            self.connected.append(conn)
+            return conn
+        self.pool = swsync.connpool.ConnectionPool(connect, max_per_host=2,
+                                                   idle_timeout=60)
+
+    def test_reuse(self):
+        conn = self.pool.get('http://host1/v1/AUTH_foo')
+        self.assertFalse(conn.reused)
+        self.pool.put('http://host1/v1/AUTH_foo', conn)
+        self.assertTrue(conn is self.pool.get('http://host1/v1/AUTH_bar'))
+        self.assertTrue(conn.reused)
+        self.assertEqual(len(self.connected), 1)
+
+    def test_per_host(self):
+        conn = self.pool.get('http://host1/v1/AUTH_foo')
+        self.pool.put('http://host1/v1/AUTH_foo', conn)
+        self.assertFalse(conn is self.pool.get('http://host2/v1/AUTH_foo'))
+        self.assertEqual(len(self.connected), 2)
+
+    def test_broken(self):
+        conn = self.pool.get('http://host1/')
+        self.pool.put('http://host1/', conn, broken=True)
+        self.assertTrue(conn.closed)
+        self.assertFalse(conn is self.pool.get('http://host1/'))
+
+    def test_item_broken_on_exception(self):
+        def raise_in_item():
+            with self.pool.item('http://host1/'):
+                raise eventlet.Timeout(None, False)
+        self.assertRaises(eventlet.Timeout, raise_in_item)
+        self.assertTrue(self.connected[0].closed)
+
+    def test_idle_timeout(self):
+        conn = self.pool.get('http://host1/')
+        self.pool.put('http://host1/', conn)
+        self.pool.idle_timeout = -1
+        self.assertFalse(conn is self.pool.get('http://host1/'))
+        self.assertTrue(conn.closed)
+
+    def test_max_per_host(self):
+        got = []
+
+        def get():
+            got.append(self.pool.get('http://host1/'))
+        self.pool.get('http://host1/')
+        conn = self.pool.get('http://host1/')
+        waiter = eventlet.spawn(get)
+        eventlet.sleep(0)
+        self.assertFalse(got)
+        self.pool.put('http://host1/', conn)
+        waiter.wait()
+        self.assertTrue(got[0] is conn)
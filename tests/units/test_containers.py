@@ -14,12 +14,17 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import collections
 import logging
+import random
+import socket
 import urlparse
 
 import swiftclient
 
 import swsync.containers
+import swsync.objects
+import swsync.state
 
 import tests.units.base as test_base
 import tests.units.fakes as fakes
@@ -29,6 +34,8 @@ class TestContainersBase(test_base.TestCase):
     def setUp(self):
         super(TestContainersBase, self).setUp()
         self.container_cls = swsync.containers.Containers()
+        # No bulk-delete on the destination unless told otherwise.
+        self.stubs.Set(swsync.objects, 'bulk_delete_limit', lambda url: 0)
 
         self.tenant_name = 'foo1'
         self.tenant_id = fakes.TENANTS_LIST[self.tenant_name]['id']
@@ -244,10 +251,10 @@ class TestContainers(TestContainersBase):
         sync_object_called = []
         delete_object_called = []
 
-        def delete_object(*args, **kwargs):
+        def request(conn_pool, url, method, *args, **kwargs):
+            self.assertEqual(method, 'DELETE')
             delete_object_called.append((args, kwargs))
-        self.stubs.Set(swsync.objects.swiftclient,
-                       'delete_object', delete_object)
+        self.stubs.Set(swsync.objects, '_request', request)
 
         def head_container(*args, **kwargs):
             return True
@@ -326,6 +333,30 @@ class TestContainers(TestContainersBase):
 
         self.assertEqual(sync_object_called[0][-1][1], 'NEWOBJ')
 
+    def test_sync_return_none_on_failure(self):
+        def head_container(*args, **kwargs):
+            pass
+
+        def get_container(_, token, name, **kwargs):
+            if token == 'otoken':
+                return ({}, [{'name': 'obj1', 'last_modified': '2'}])
+            return ({}, [{'name': 'obj1', 'last_modified': '1'}])
+
+        self.stubs.Set(swiftclient, 'head_container', head_container)
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+        self.container_cls.sync_object = lambda *args, **kwargs: True
+        checksum = self.container_cls.sync(
+            self.orig_storage_cnx, self.orig_storage_url, 'otoken',
+            self.dest_storage_cnx, self.dest_storage_url, 'dtoken',
+            'cont1')
+        self.assertTrue(checksum)
+
+        self.container_cls.sync_object = lambda *args, **kwargs: False
+        self.assertEqual(self.container_cls.sync(
+            self.orig_storage_cnx, self.orig_storage_url, 'otoken',
+            self.dest_storage_cnx, self.dest_storage_url, 'dtoken',
+            'cont1'), None)
+
     def test_sync_raise_exceptions_get_container_on_orig(self):
         called = []
 
@@ -344,6 +375,25 @@ class TestContainers(TestContainersBase):
             'cont1')
         self.assertEqual(len(called), 1)
 
+    def test_sync_retry_get_container(self):
+        self.stubs.Set(random, 'uniform', lambda a, b: 0)
+        called = []
+
+        def get_container(*args, **kwargs):
+            called.append(args[2])
+            if len(called) == 1:
+                raise swiftclient.client.ClientException("TESTED",
+                                                         http_status=503)
+            return ({}, [])
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+        self.stubs.Set(swiftclient, 'head_container',
+                       lambda *args, **kwargs: {})
+        self.assertTrue(self.container_cls.sync(
+            self.orig_storage_cnx, self.orig_storage_url, 'token',
+            self.dest_storage_cnx, self.dest_storage_url, 'token',
+            'cont1'))
+        self.assertEqual(called, ['cont1'] * 3)
+
     def test_sync_raise_exceptions_get_container_on_dest(self):
         called = []
         called_on_dest = []
@@ -410,3 +460,655 @@ class TestContainers(TestContainersBase):
             "cnx1", "token1", orig_containers, dest_containers)
 
         self.assertEqual(len(called), 1)
+
+    def test_delete_container_retry_get_container(self):
+        self.stubs.Set(random, 'uniform', lambda a, b: 0)
+        called = []
+
+        def get_container(*args, **kwargs):
+            called.append(args[2])
+            if len(called) == 1:
+                raise swiftclient.client.ClientException("TESTED",
+                                                         http_status=503)
+            return ({}, [])
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+        self.stubs.Set(swiftclient, 'delete_container',
+                       lambda *args, **kwargs: None)
+
+        self.assertEqual(self.container_cls.delete_container(
+            "cnx1", "token1", [], [{'name': 'foo'}]), [])
+        self.assertEqual(called, ['foo', 'foo'])
+
+    def test_delete_container_pipelined(self):
+        orig_containers = [{'name': 'foo'}]
+        dest_containers = [{'name': 'foo'}, {'name': 'bar'}, {'name': 'baz'}]
+        self.container_cls.listing_limit = 2
+        cnxs = []
+        called = []
+
+        def http_connection(url):
+            cnxs.append(url)
+            return 'cnx%d' % len(cnxs)
+
+        def get_container(_, token, name, marker=None, **kwargs):
+            objects = ['%s%d' % (name, x) for x in xrange(3)]
+            if marker is not None:
+                objects = [x for x in objects if x > marker]
+            return ({}, [{'name': x, 'last_modified': '1'}
+                         for x in objects[:kwargs['limit']]])
+
+        def delete_container(_, token, name, http_conn=None):
+            # The objects are deleted before their container.
+            self.assertEqual(len([x for x in called
+                                  if x[:3] == name]), 3)
+            called.append((name, http_conn))
+            if name == 'baz':
+                raise swiftclient.client.ClientException('TESTED')
+
+        self.stubs.Set(swiftclient, 'http_connection', http_connection)
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+        self.stubs.Set(swiftclient, 'delete_container', delete_container)
+        self.container_cls.delete_object = (
+            lambda *args, **kwargs: called.append(args[-1]))
+        self.container_cls.failed_log = FakeFailedLog()
+
+        self.assertEqual(self.container_cls.delete_container(
+            "cnx", "token1", orig_containers, dest_containers,
+            dest_storage_url='http://dest', account_id='a1'), ['baz'])
+        self.assertEqual(self.container_cls.failed_log, [
+            {'account': 'a1', 'container': 'baz',
+             'action': 'delete_container', 'name': None}])
+        # Each container is listed, page by page, on its own connection.
+        self.assertEqual(cnxs, ['http://dest', 'http://dest'])
+        self.assertEqual(sorted(x for x in called if isinstance(x, str)),
+                         ['bar0', 'bar1', 'bar2', 'baz0', 'baz1', 'baz2'])
+        self.assertEqual(sorted(x[0] for x in called
+                                if isinstance(x, tuple)), ['bar', 'baz'])
+
+
+class TestContainersLastModified(TestContainersBase):
+    def test_get_last_modified(self):
+        def head_container(*args, **kwargs):
+            return {'x-container-meta-last-modified': '1000.0'}
+        self.stubs.Set(swiftclient, 'head_container', head_container)
+        self.assertEqual(self.container_cls.get_last_modified(
+            self.orig_storage_cnx, 'token', 'cont1'), '1000.0')
+
+    def test_get_last_modified_missing(self):
+        def head_container(*args, **kwargs):
+            return {}
+        self.stubs.Set(swiftclient, 'head_container', head_container)
+        self.assertEqual(self.container_cls.get_last_modified(
+            self.orig_storage_cnx, 'token', 'cont1'), None)
+
+    def test_get_last_modified_raise(self):
+        def head_container(*args, **kwargs):
+            raise swiftclient.client.ClientException('TESTED')
+        self.stubs.Set(swiftclient, 'head_container', head_container)
+        self.assertEqual(self.container_cls.get_last_modified(
+            self.orig_storage_cnx, 'token', 'cont1'), None)
+
+
+class TestContainersListing(TestContainersBase):
+    def test_iter_listing_paginate(self):
+        called = []
+        pages = {'obj1': [{'name': 'obj2'}, {'name': 'obj3'}],
+                 'obj3': [{'name': 'obj4'}]}
+
+        def get_container(_, token, name, marker=None, limit=None,
+                          **kwargs):
+            called.append((marker, limit))
+            return ({}, pages[marker])
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+
+        objects = swsync.containers.iter_listing(
+            self.orig_storage_cnx, 'token', 'cont1',
+            [{'name': 'obj0'}, {'name': 'obj1'}], 2)
+        self.assertEqual([x['name'] for x in objects],
+                         ['obj0', 'obj1', 'obj2', 'obj3', 'obj4'])
+        self.assertEqual(called, [('obj1', 2), ('obj3', 2)])
+
+    def test_diff_listings(self):
+        orig = [{'name': 'a', 'last_modified': '1'},
+                {'name': 'b', 'last_modified': '2'},
+                {'name': 'c', 'last_modified': '1'},
+                {'name': 'e', 'last_modified': '1'}]
+        dest = [{'name': 'b', 'last_modified': '1'},
+                {'name': 'c', 'last_modified': '1'},
+                {'name': 'd', 'last_modified': '1'},
+                {'name': 'f', 'last_modified': '1'}]
+        ret = [(action, obj['name']) for action, obj in
+               swsync.containers.diff_listings(orig, dest)]
+        self.assertEqual(ret, [('copy', 'a'), ('copy', 'b'),
+                               ('delete', 'd'), ('copy', 'e'),
+                               ('delete', 'f')])
+
+    def test_diff_listings_hash(self):
+        orig = [{'name': 'a', 'last_modified': '2', 'hash': 'h1',
+                 'bytes': 1},
+                {'name': 'b', 'last_modified': '2', 'hash': 'h2',
+                 'bytes': 1},
+                {'name': 'c', 'last_modified': '1', 'hash': 'h3',
+                 'bytes': 2}]
+        dest = [{'name': 'a', 'last_modified': '1', 'hash': 'h1',
+                 'bytes': 1},
+                {'name': 'b', 'last_modified': '2', 'hash': 'h0',
+                 'bytes': 1},
+                {'name': 'c', 'last_modified': '1', 'hash': 'h3',
+                 'bytes': 1}]
+        ret = [(action, obj['name']) for action, obj in
+               swsync.containers.diff_listings(orig, dest, 'hash')]
+        self.assertEqual(ret, [('post', 'a'), ('copy', 'b'), ('copy', 'c')])
+
+    def test_diff_listings_hash_dest_newer(self):
+        # The destination has been rewritten by a previous copy.
+        orig = [{'name': 'a', 'last_modified': '2013-01-01T00:00:00',
+                 'hash': 'h1', 'bytes': 1}]
+        dest = [{'name': 'a', 'last_modified': '2013-06-01T00:00:00',
+                 'hash': 'h1', 'bytes': 1}]
+        for mode in swsync.containers.DIFF_MODES:
+            self.assertEqual(list(swsync.containers.diff_listings(
+                orig, dest, mode)), [])
+
+    def test_diff_listings_post(self):
+        orig = [{'name': 'a', 'last_modified': '2', 'hash': 'h1',
+                 'bytes': 1},
+                {'name': 'b', 'last_modified': '2', 'hash': 'h2',
+                 'bytes': 1},
+                {'name': 'c', 'last_modified': '2'}]
+        dest = [{'name': 'a', 'last_modified': '1', 'hash': 'h1',
+                 'bytes': 1},
+                {'name': 'b', 'last_modified': '1', 'hash': 'h0',
+                 'bytes': 1},
+                {'name': 'c', 'last_modified': '1'}]
+        ret = [(action, obj['name']) for action, obj in
+               swsync.containers.diff_listings(orig, dest)]
+        self.assertEqual(ret, [('post', 'a'), ('copy', 'b'), ('copy', 'c')])
+
+    def test_adaptive_concurrency_pools(self):
+        swsync.utils.CONFIG.set('concurrency', 'sync_adaptive_concurrency',
+                                'true')
+        swsync.utils.CONFIG.set('concurrency',
+                                'sync_max_swift_client_concurrency', '40')
+        container_cls = swsync.containers.Containers()
+        self.assertEqual(container_cls.work_queue.controller.maximum, 40)
+        self.assertEqual(container_cls.orig_conn_pool.max_per_host, 40)
+        self.assertEqual(container_cls.dest_conn_pool.max_per_host, 40)
+
+    def test_diff_mode_invalid(self):
+        swsync.utils.CONFIG.set('sync', 'diff_mode', 'foo')
+        self.assertRaises(swsync.utils.ConfigurationError,
+                          swsync.containers.Containers)
+
+    def test_sync_post_metadata(self):
+        called = []
+
+        def head_container(*args, **kwargs):
+            pass
+
+        def get_container(_, token, name, **kwargs):
+            return ({}, [{'name': 'obj1', 'last_modified': token,
+                          'hash': 'h1', 'bytes': 1}])
+
+        self.stubs.Set(swiftclient, 'head_container', head_container)
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+        self.container_cls.sync_object_metadata = (
+            lambda *args, **kwargs: called.append(args))
+        self.container_cls.sync_object = None
+        self.container_cls.sync(
+            self.orig_storage_cnx, self.orig_storage_url, 'otoken',
+            self.dest_storage_cnx, self.dest_storage_url, 'dtoken',
+            'cont1')
+        self.assertEqual(called[0][-1], 'obj1')
+
+    def test_sync_stop_when_listing_fail(self):
+        sync_object_called = []
+        delete_object_called = []
+
+        def get_container(_, token, name, marker=None, limit=None,
+                          **kwargs):
+            if marker:
+                raise swiftclient.client.ClientException('TESTED')
+            return ({}, [{'name': 'obj%d' % x, 'last_modified': '1'}
+                         for x in xrange(limit)])
+
+        def head_container(*args, **kwargs):
+            pass
+
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+        self.stubs.Set(swiftclient, 'head_container', head_container)
+        self.container_cls.listing_limit = 2
+        self.container_cls.sync_object = (
+            lambda *args: sync_object_called.append(args))
+        self.container_cls.delete_object = (
+            lambda *args: delete_object_called.append(args))
+
+        self.container_cls.sync(
+            self.orig_storage_cnx, self.orig_storage_url, 'token',
+            self.dest_storage_cnx, self.dest_storage_url, 'token',
+            'cont1')
+        self.assertFalse(sync_object_called)
+        self.assertFalse(delete_object_called)
+
+    def test_sync_checkpoint(self):
+        markers = []
+        failing = ['obj3']
+
+        def get_container(_, token, name, marker=None, limit=None,
+                          **kwargs):
+            if token == 'dtoken':
+                return ({}, [])
+            markers.append(marker)
+            return ({}, [{'name': 'obj%d' % x, 'last_modified': '1'}
+                         for x in xrange(6) if 'obj%d' % x > marker])
+
+        def head_container(*args, **kwargs):
+            pass
+
+        def sync_object(*args, **kwargs):
+            return args[-1][1] not in failing
+
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+        self.stubs.Set(swiftclient, 'head_container', head_container)
+        self.container_cls.state = swsync.state.SyncState(':memory:')
+        self.container_cls.checkpoint_interval = 2
+        self.container_cls.sync_object = sync_object
+
+        self.assertEqual(self.container_cls.sync(
+            self.orig_storage_cnx, self.orig_storage_url, 'otoken',
+            self.dest_storage_cnx, self.dest_storage_url, 'dtoken',
+            'cont1', account_id='account'), None)
+        self.assertEqual(self.container_cls.state.get_marker(
+            'account', 'cont1'), 'obj2')
+
+        failing[:] = []
+        self.assertTrue(self.container_cls.sync(
+            self.orig_storage_cnx, self.orig_storage_url, 'otoken',
+            self.dest_storage_cnx, self.dest_storage_url, 'dtoken',
+            'cont1', account_id='account'))
+        self.assertEqual(markers, [None, 'obj2'])
+        self.assertEqual(self.container_cls.state.get_marker(
+            'account', 'cont1'), None)
+
+    def test_checkpoint_failed(self):
+        class FakeBatch(object):
+            def low_water_mark(self):
+                return 2
+
+            def first_failed(self):
+                return 3
+
+        self.container_cls.state = swsync.state.SyncState(':memory:')
+        names = collections.deque(enumerate(['a', 'b', 'c', 'd', 'e']))
+        self.container_cls.checkpoint('account', 'cont1', FakeBatch(), names)
+        self.assertEqual(self.container_cls.state.get_marker(
+            'account', 'cont1'), 'b')
+        # The names past the failed job are never a marker, not kept.
+        self.assertEqual(list(names), [(2, 'c')])
+
+    def test_sync_checkpoint_interval(self):
+        checkpoints = []
+        self.stubs.Set(swiftclient, 'get_container', lambda _, token, name,
+                       **kwargs: ({}, token == 'otoken' and [
+                           {'name': 'obj%d' % x, 'last_modified': '1'}
+                           for x in xrange(5)] or []))
+        self.stubs.Set(swiftclient, 'head_container',
+                       lambda *args, **kwargs: None)
+        self.container_cls.state = swsync.state.SyncState(':memory:')
+        self.container_cls.checkpoint_interval = 2
+        self.container_cls.sync_object = lambda *args, **kwargs: None
+        self.container_cls.checkpoint = (
+            lambda account, container, batch, names: checkpoints.append(
+                batch.submitted))
+
+        self.assertTrue(self.container_cls.sync(
+            self.orig_storage_cnx, self.orig_storage_url, 'otoken',
+            self.dest_storage_cnx, self.dest_storage_url, 'dtoken',
+            'cont1', account_id='account'))
+        # Once each checkpoint_interval jobs submitted, not before any.
+        self.assertEqual(checkpoints, [2, 4])
+
+
+class FakeFailedLog(list):
+    write = list.append
+
+
+class TestContainersRetry(TestContainersBase):
+    def setUp(self):
+        super(TestContainersRetry, self).setUp()
+        self.container_cls.failed_log = FakeFailedLog()
+
+        def head_container(*args, **kwargs):
+            pass
+        self.stubs.Set(swiftclient, 'head_container', head_container)
+
+    def test_sync_record_failed_objects(self):
+        def get_container(_, token, name, **kwargs):
+            if token == 'dtoken':
+                return ({}, [{'name': 'obj3', 'last_modified': '1'}])
+            return ({}, [{'name': 'obj1', 'last_modified': '1'},
+                         {'name': 'obj2', 'last_modified': '1'}])
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+        self.container_cls.sync_object = (
+            lambda *args, **kwargs: args[-1][1] != 'obj2')
+        self.container_cls.delete_object = lambda *args, **kwargs: False
+
+        self.assertEqual(self.container_cls.sync(
+            self.orig_storage_cnx, self.orig_storage_url, 'otoken',
+            self.dest_storage_cnx, self.dest_storage_url, 'dtoken',
+            'cont1', account_id='account'), None)
+        self.assertEqual(sorted(self.container_cls.failed_log), [
+            {'account': 'account', 'container': 'cont1',
+             'action': 'copy', 'name': 'obj2'},
+            {'account': 'account', 'container': 'cont1',
+             'action': 'delete', 'name': 'obj3'}])
+
+    def test_sync_record_failed_container(self):
+        def get_container(*args, **kwargs):
+            raise swiftclient.client.ClientException('TESTED')
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+
+        self.container_cls.sync(
+            self.orig_storage_cnx, self.orig_storage_url, 'otoken',
+            self.dest_storage_cnx, self.dest_storage_url, 'dtoken',
+            'cont1', account_id='account')
+        self.assertEqual(self.container_cls.failed_log,
+                         [{'account': 'account', 'container': 'cont1'}])
+
+    def test_retry(self):
+        called = []
+
+        def operation(action):
+            def _operation(*args, **kwargs):
+                called.append((action, args[-2], args[-1]))
+                return action != 'post'
+            return _operation
+        self.container_cls.sync_object = operation('copy')
+        self.container_cls.sync_object_metadata = operation('post')
+        self.container_cls.delete_object = operation('delete')
+
+        entries = [{'account': 'account', 'container': 'cont1',
+                    'action': action, 'name': 'obj1'}
+                   for action in ('copy', 'post', 'delete')]
+        self.assertFalse(self.container_cls.retry(
+            self.orig_storage_url, 'otoken', self.dest_storage_cnx,
+            self.dest_storage_url, 'dtoken', 'account', entries))
+        self.assertEqual(sorted(called), [
+            ('copy', 'cont1', (None, 'obj1')),
+            ('delete', 'cont1', 'obj1'),
+            ('post', 'cont1', 'obj1')])
+        self.assertEqual(self.container_cls.failed_log, [entries[1]])
+
+
+class TestContainersPlan(TestContainersBase):
+    def test_plan(self):
+        def get_container(_, token, name, **kwargs):
+            if token == 'dtoken':
+                raise swiftclient.client.ClientException('TESTED',
+                                                         http_status=404)
+            return ({}, [{'name': 'obj1', 'last_modified': '1'}])
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+        self.container_cls.sync_object = None
+
+        actions = list(self.container_cls.plan(
+            self.orig_storage_cnx, 'otoken', self.dest_storage_cnx,
+            'dtoken', 'cont1'))
+        self.assertEqual(actions, [
+            ('create_container', None),
+            ('copy', {'name': 'obj1', 'last_modified': '1'})])
+
+    def test_plan_listing_error(self):
+        def get_container(_, token, name, **kwargs):
+            if token == 'dtoken':
+                raise swiftclient.client.ClientException('TESTED',
+                                                         http_status=503)
+            return ({}, [])
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+
+        self.assertRaises(swiftclient.client.ClientException, list,
+                          self.container_cls.plan(
+                              self.orig_storage_cnx, 'otoken',
+                              self.dest_storage_cnx, 'dtoken', 'cont1'))
+
+    def test_plan_delete(self):
+        def get_container(_, token, name, **kwargs):
+            return ({}, [{'name': 'obj1', 'last_modified': '1'}])
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+
+        actions = list(self.container_cls.plan_delete(
+            self.dest_storage_cnx, 'dtoken', 'cont1'))
+        self.assertEqual(actions, [
+            ('delete', {'name': 'obj1', 'last_modified': '1'}),
+            ('delete_container', None)])
+
+    def test_create_container(self):
+        put = []
+
+        def head_container(*args, **kwargs):
+            return {'x-container-meta-foo': 'bar',
+                    'x-container-object-count': '2'}
+        self.stubs.Set(swiftclient, 'head_container', head_container)
+        self.stubs.Set(swiftclient, 'put_container',
+                       lambda _, token, name, **kwargs:
+                       put.append((token, name, kwargs['headers'])))
+
+        self.assertTrue(self.container_cls.create_container(
+            self.orig_storage_cnx, 'otoken', self.dest_storage_cnx,
+            'dtoken', 'cont1'))
+        self.assertEqual(put, [('dtoken', 'cont1',
+                                {'x-container-meta-foo': 'bar'})])
+
+    def test_delete_empty_container_failed(self):
+        def delete_container(*args, **kwargs):
+            raise swiftclient.client.ClientException('TESTED',
+                                                     http_status=409)
+        self.stubs.Set(swiftclient, 'delete_container', delete_container)
+
+        self.assertFalse(self.container_cls.delete_empty_container(
+            self.dest_storage_cnx, 'dtoken', 'cont1'))
+
+    def test_verify(self):
+        def get_container(_, token, name, **kwargs):
+            objects = [{'name': 'a', 'hash': 'h1', 'bytes': 1},
+                       {'name': 'b', 'hash': 'h2', 'bytes': 1},
+                       {'name': 'c', 'hash': 'h3', 'bytes': 1},
+                       {'name': 'd', 'hash': 'h4', 'bytes': 1}]
+            if token == 'dtoken':
+                objects[1] = dict(objects[1], hash='h0')
+                objects[3] = {'name': 'e', 'hash': 'h5', 'bytes': 1}
+            for obj in objects:
+                obj['last_modified'] = token
+            return ({}, objects)
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+        verified = []
+
+        def verify_object_metadata(*args, **kwargs):
+            verified.append(args[-1])
+            return {'a': None, 'c': 'post'}[args[-1]]
+        self.container_cls.verify_object_metadata = verify_object_metadata
+        self.container_cls.verify_sample_rate = 1
+
+        actions = list(self.container_cls.verify(
+            self.orig_storage_cnx, self.orig_storage_url, 'otoken',
+            self.dest_storage_cnx, self.dest_storage_url, 'dtoken',
+            'cont1'))
+        self.assertEqual(sorted(verified), ['a', 'c'])
+        self.assertEqual(sorted((x, obj['name']) for x, obj in actions), [
+            ('copy', 'b'), ('copy', 'd'), ('delete', 'e'), ('post', 'c')])
+
+    def test_verify_error(self):
+        self.stubs.Set(random, 'uniform', lambda a, b: 0)
+
+        def get_container(_, token, name, **kwargs):
+            return ({}, [{'name': 'a', 'hash': 'h1', 'bytes': 1,
+                          'last_modified': '1'}])
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+        called = []
+
+        def verify_object_metadata(*args, **kwargs):
+            called.append(args[-1])
+            raise swiftclient.client.ClientException('TESTED',
+                                                     http_status=503)
+        self.container_cls.verify_object_metadata = verify_object_metadata
+        self.container_cls.verify_sample_rate = 1
+
+        actions = list(self.container_cls.verify(
+            self.orig_storage_cnx, self.orig_storage_url, 'otoken',
+            self.dest_storage_cnx, self.dest_storage_url, 'dtoken',
+            'cont1'))
+        self.assertEqual([(x, obj['name']) for x, obj in actions],
+                         [('error', 'a')])
+        self.assertEqual(len(called),
+                         self.container_cls.policies['overload'].attempts)
+
+    def test_verify_not_sampled(self):
+        def get_container(_, token, name, **kwargs):
+            return ({}, [{'name': 'a', 'hash': 'h1', 'bytes': 1,
+                          'last_modified': '1'}])
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+        self.container_cls.verify_object_metadata = None
+        self.container_cls.verify_sample_rate = 0
+
+        self.assertEqual(list(self.container_cls.verify(
+            self.orig_storage_cnx, self.orig_storage_url, 'otoken',
+            self.dest_storage_cnx, self.dest_storage_url, 'dtoken',
+            'cont1')), [])
+
+
+class TestContainersBulkDelete(TestContainersBase):
+    def setUp(self):
+        super(TestContainersBulkDelete, self).setUp()
+        self.container_cls.failed_log = FakeFailedLog()
+        self.stubs.Set(swsync.objects, 'bulk_delete_limit', lambda url: 2)
+        self.stubs.Set(swiftclient, 'head_container',
+                       lambda *args, **kwargs: {})
+
+    def test_sync_bulk_delete(self):
+        def get_container(_, token, name, **kwargs):
+            if token == 'dtoken':
+                return ({}, [{'name': 'obj%d' % x, 'last_modified': '1'}
+                             for x in xrange(5)])
+            return ({}, [{'name': 'obj2', 'last_modified': '2'}])
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+        called = []
+
+        def bulk_delete(url, token, container, names, **kwargs):
+            called.append(list(names))
+            return names[1:]
+        self.container_cls.bulk_delete = bulk_delete
+        self.container_cls.sync_object = (
+            lambda *args, **kwargs: called.append(args[-1][1]))
+        self.container_cls.delete_object = (
+            lambda *args, **kwargs: called.append(args[-1]))
+
+        self.assertFalse(self.container_cls.sync(
+            self.orig_storage_cnx, self.orig_storage_url, 'otoken',
+            self.dest_storage_cnx, self.dest_storage_url, 'dtoken',
+            'cont1', account_id='account'))
+        # The deletes are sent by bulk, up to the copy then by 2.
+        self.assertEqual(sorted(called), sorted(
+            [['obj0', 'obj1'], 'obj2', ['obj3', 'obj4']]))
+        self.assertEqual(sorted(x['name'] for x in
+                                self.container_cls.failed_log),
+                         ['obj1', 'obj4'])
+
+
+class TestContainersBulkDeleteFallback(TestContainersBase):
+    def test_bulk_delete_fallback(self):
+        def bulk_delete(*args, **kwargs):
+            raise socket.error('TESTED')
+        self.container_cls.bulk_delete = bulk_delete
+        deleted = []
+
+        def delete_object(cnx, token, container, name, **kwargs):
+            if name == 'obj2':
+                raise swiftclient.client.ClientException('TESTED',
+                                                         http_status=503)
+            deleted.append(name)
+        self.container_cls.delete_object = delete_object
+
+        names = ['obj1', 'obj2', 'obj3']
+        self.assertFalse(self.container_cls._bulk_delete(
+            self.dest_storage_url, 'token', 'cont1', names))
+        # The objects are deleted one by one when the bulk can't be sent.
+        self.assertEqual(deleted, ['obj1', 'obj3'])
+        self.assertEqual(names, ['obj2'])
+
+
+class TestContainersArchive(TestContainersBase):
+    def setUp(self):
+        super(TestContainersArchive, self).setUp()
+        self.container_cls.failed_log = FakeFailedLog()
+        self.container_cls.archive_threshold = 10
+        self.container_cls.archive_size = 2
+        self.stubs.Set(swsync.objects, 'bulk_upload_supported',
+                       lambda url: True)
+        self.stubs.Set(swiftclient, 'head_container',
+                       lambda *args, **kwargs: {})
+
+    def test_sync_archive(self):
+        def get_container(_, token, name, **kwargs):
+            if token == 'dtoken':
+                return ({}, [])
+            return ({}, [{'name': name, 'last_modified': '1',
+                          'bytes': size}
+                         for name, size in (('obj1', 5), ('obj2', 10),
+                                            ('obj3', 11), ('obj4', 0))])
+        self.stubs.Set(swiftclient, 'get_container', get_container)
+        archived = []
+        copied = []
+
+        def archive_objects(*args, **kwargs):
+            archived.append([x[1] for x in args[-1]])
+            return [x for x in args[-1] if x[1] == 'obj4']
+        self.container_cls.archive_objects = archive_objects
+
+        def sync_object(*args, **kwargs):
+            copied.append(args[5][1])
+            return args[5][1] != 'obj4' and None
+        self.container_cls.sync_object = sync_object
+
+        self.assertFalse(self.container_cls.sync(
+            self.orig_storage_cnx, self.orig_storage_url, 'otoken',
+            self.dest_storage_cnx, self.dest_storage_url, 'dtoken',
+            'cont1', account_id='account'))
+        # The small objects are archived by 2, up to a bigger one.
+        self.assertEqual(sorted(archived), [['obj1', 'obj2'], ['obj4']])
+        # The objects left out of the archive are copied one by one.
+        self.assertEqual(sorted(copied), ['obj3', 'obj4'])
+        self.assertEqual([(x['action'], x['name']) for x in
+                          self.container_cls.failed_log],
+                         [('copy', 'obj4')])
+
+    def test_sync_archive_unsupported(self):
+        self.stubs.Set(swsync.objects, 'bulk_upload_supported',
+                       lambda url: False)
+        self.stubs.Set(swiftclient, 'get_container', lambda _, token, name,
+                       **kwargs: ({}, token == 'otoken' and [
+                           {'name': 'obj1', 'last_modified': '1',
+                            'bytes': 5}] or []))
+        copied = []
+        self.container_cls.archive_objects = None
+        self.container_cls.sync_object = (
+            lambda *args, **kwargs: copied.append(args[5][1]))
+
+        self.assertTrue(self.container_cls.sync(
+            self.orig_storage_cnx, self.orig_storage_url, 'otoken',
+            self.dest_storage_cnx, self.dest_storage_url, 'dtoken',
+            'cont1'))
+        self.assertEqual(copied, ['obj1'])
+
+    def test_archive_upload_error(self):
+        def archive_objects(*args, **kwargs):
+            raise socket.error('TESTED')
+        self.container_cls.archive_objects = archive_objects
+        copied = []
+        self.container_cls.sync_object = (
+            lambda *args, **kwargs: copied.append(args[5][1]))
+
+        names = [('1', 'obj1'), ('1', 'obj2')]
+        self.assertEqual(self.container_cls._archive(
+            self.orig_storage_url, 'otoken', self.dest_storage_url,
+            'dtoken', 'cont1', names), None)
+        # The objects are copied one by one when the archive can't be.
+        self.assertEqual(copied, ['obj1', 'obj2'])
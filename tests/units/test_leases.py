@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import os
+import tempfile
+import time
+
+import swsync.leases
+import tests.units.base as test_base
+
+
+class TestSQLiteLeases(test_base.TestCase):
+    def setUp(self):
+        super(TestSQLiteLeases, self).setUp()
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, self.path)
+        self.now = 1000.0
+        self.stubs.Set(time, 'time', lambda: self.now)
+        self.node1 = swsync.leases.SQLiteLeases(self.path, 'node1', 60)
+        self.node2 = swsync.leases.SQLiteLeases(self.path, 'node2', 60)
+
+    def test_claim(self):
+        self.assertTrue(self.node1.claim('account'))
+        self.assertFalse(self.node2.claim('account'))
+        self.assertTrue(self.node2.claim('account2'))
+
+    def test_claim_expired(self):
+        self.node1.claim('account')
+        self.now += 61
+        self.assertTrue(self.node2.claim('account'))
+        self.assertFalse(self.node1.renew('account'))
+
+    def test_renew(self):
+        self.node1.claim('account')
+        self.now += 50
+        self.assertTrue(self.node1.renew('account'))
+        self.now += 50
+        self.assertFalse(self.node2.claim('account'))
+        self.assertFalse(self.node2.renew('account'))
+
+    def test_release(self):
+        self.node1.claim('account')
+        self.node2.release('account')
+        self.assertFalse(self.node2.claim('account'))
+        self.node1.release('account')
+        self.assertTrue(self.node2.claim('account'))
+
+    def test_pass(self):
+        pass_id = self.node1.begin_pass()
+        self.assertEqual(self.node2.begin_pass(), pass_id)
+        self.node1.claim('account')
+        self.node1.release('account', synced=True)
+        self.node1.claim('account2')
+        self.node1.release('account2')
+        self.now += 3600
+        self.assertFalse(self.node2.claim('account'))
+        self.assertTrue(self.node2.claim('account2'))
+        self.node1.end_pass()
+        self.node2.end_pass()
+
+        self.assertEqual(self.node2.begin_pass(), pass_id + 1)
+        self.assertTrue(self.node2.claim('account'))
+
+    def test_pass_expired(self):
+        # A crashed node doesn't keep its pass open.
+        pass_id = self.node1.begin_pass()
+        self.node1.claim('account')
+        self.now += 30
+        self.node1.renew('account')
+        self.now += 50
+        self.assertEqual(self.node2.begin_pass(), pass_id)
+        self.node2.end_pass()
+        self.now += 61
+        self.assertEqual(self.node2.begin_pass(), pass_id + 1)
+
+    def test_migrate(self):
+        db = swsync.leases.sqlite3.connect(self.path)
+        db.execute("CREATE TABLE leases (key TEXT PRIMARY KEY, "
+                   "owner TEXT NOT NULL, expires REAL NOT NULL)")
+        db.execute("INSERT INTO leases VALUES ('account', 'node2', 0)")
+        db.commit()
+        db.close()
+        self.node1.begin_pass()
+        self.assertTrue(self.node1.claim('account'))
+        self.node1.release('account', synced=True)
+        self.assertFalse(self.node1.claim('account'))
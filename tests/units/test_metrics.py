@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import swsync.metrics
+import swsync.utils
+import tests.units.base as test_base
+
+
+class FakeSocket(object):
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, address):
+        self.sent.append((data, address))
+
+
+class TestMetrics(test_base.TestCase):
+    def setUp(self):
+        super(TestMetrics, self).setUp()
+        self.metrics = swsync.metrics.Metrics()
+
+    def test_render_counters(self):
+        self.metrics.incr('objects_copied')
+        self.metrics.incr('objects_copied', 2)
+        self.metrics.incr('errors', status=503)
+        rendered = self.metrics.render().splitlines()
+        self.assertIn('# TYPE swsync_objects_copied_total counter', rendered)
+        self.assertIn('swsync_objects_copied_total 3', rendered)
+        self.assertIn('swsync_errors_total{status="503"} 1', rendered)
+
+    def test_render_histograms(self):
+        self.metrics.timing('request', 0.2, cluster='origin')
+        self.metrics.timing('request', 3, cluster='origin')
+        self.metrics.timing('request', 5000, cluster='origin')
+        rendered = self.metrics.render().splitlines()
+        self.assertIn('swsync_request_seconds_bucket'
+                      '{cluster="origin",le="0.1"} 0', rendered)
+        self.assertIn('swsync_request_seconds_bucket'
+                      '{cluster="origin",le="0.25"} 1', rendered)
+        self.assertIn('swsync_request_seconds_bucket'
+                      '{cluster="origin",le="5"} 2', rendered)
+        self.assertIn('swsync_request_seconds_bucket'
+                      '{cluster="origin",le="+Inf"} 3', rendered)
+        self.assertIn('swsync_request_seconds_count{cluster="origin"} 3',
+                      rendered)
+
+    def test_render_gauges(self):
+        self.metrics.gauge('queue_depth', lambda: 4)
+        self.assertIn('swsync_queue_depth 4',
+                      self.metrics.render().splitlines())
+
+    def test_statsd(self):
+        metrics = swsync.metrics.Metrics('swsync', ('localhost', 8125))
+        metrics._sock = FakeSocket()
+        metrics.incr('errors', status=503)
+        metrics.timing('request', 0.25, cluster='origin', method='GET')
+        metrics.gauge('queue_depth', lambda: 4)
+        metrics.send_gauges()
+        self.assertEqual([x[0] for x in metrics._sock.sent],
+                         ['swsync.errors.503:1|c',
+                          'swsync.request.origin.GET:250|ms',
+                          'swsync.queue_depth:4|g'])
+
+    def test_get_metrics(self):
+        self.stubs.Set(swsync.utils, 'METRICS', None)
+        metrics = swsync.utils.get_metrics()
+        self.assertEqual(metrics.statsd, None)
+        self.assertTrue(metrics is swsync.utils.get_metrics())
@@ -14,11 +14,25 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import hashlib
+import json
+import os
+import StringIO
+import tarfile
+import tempfile
+import urllib
+import urlparse
+
 import eventlet
-import swift
+import eventlet.green.httplib
+import eventlet.wsgi
+import swift.common.bufferedhttp
 import swiftclient
 
+import swsync.buffers
+import swsync.connpool
 import swsync.objects as swobjects
+import swsync.utils
 import tests.units.base as test_base
 import tests.units.fakes as fakes
 
@@ -26,16 +40,39 @@ import tests.units.fakes as fakes
 def fake_http_connect(status, body='', headers={}, resp_waitfor=None,
                       connect_waitfor=None):
     class FakeConn(object):
+        will_close = False
+
         def __init__(self, status):
             self.reason = 'PSG'
             self.status = status
             self.body = body
+            self.sent = []
             if connect_waitfor:
                 eventlet.sleep(int(connect_waitfor))
 
+        def putrequest(self, method, path):
+            self.request = (method, path)
+
+        def putheader(self, header, value):
+            pass
+
+        def endheaders(self):
+            pass
+
+        def close(self):
+            self.closed = True
+
         def getheaders(self):
             return headers
 
+        def getheader(self, name, default=None):
+            return dict(headers).get(name, default)
+
+        def send(self, data):
+            if isinstance(data, memoryview):
+                data = data.tobytes()
+            self.sent.append(data)
+
         def getresponse(self):
             if resp_waitfor:
                 eventlet.sleep(int(resp_waitfor))
@@ -51,6 +88,27 @@ def fake_http_connect(status, body='', headers={}, resp_waitfor=None,
     return connect
 
 
+def dechunk(data):
+    body = ''
+    while True:
+        size, data = data.split('\r\n', 1)
+        size = int(size, 16)
+        if not size:
+            return body
+        body, data = body + data[:size], data[size + 2:]
+
+
+class FakeReadintoResp(object):
+    def __init__(self, body):
+        self.body = body
+
+    def readinto(self, buf):
+        size = min(len(buf), len(self.body))
+        buf[:size] = self.body[:size]
+        self.body = self.body[size:]
+        return size
+
+
 class TestObject(test_base.TestCase):
     def setUp(self):
         super(TestObject, self).setUp()
@@ -77,43 +135,124 @@ class TestObject(test_base.TestCase):
                           swobjects.get_object,
                           self.orig_storage_url, "token", "cont1", "obj1")
 
-    def test_sync_object(self):
-        body = ("X" * 3) * 1024
-        new_connect = fake_http_connect(200, body)
-        self.stubs.Set(swift.common.bufferedhttp,
-                       'http_connect_raw', new_connect)
+    def _stub_connect(self, body, put_status=201, headers={},
+                      put_headers={}):
+        """Stub the GET of body, return the PUT connections made."""
+        get_connect = fake_http_connect(200, body, headers=headers)
+        put_connect = fake_http_connect(put_status,
+                                        headers=put_headers.items())
+        puts = []
 
-        def put_object(url, name=None, headers=None, contents=None):
-            self.assertEqual('obj1', name)
-            self.assertIn('x-auth-token', headers)
-            self.assertIsInstance(contents,
-                                  swift.container.sync._Iter2FileLikeObject)
-            contents_read = contents.read()
-            self.assertEqual(len(contents_read), len(body))
+        def connect(host, port, method, path, headers=None, **kwargs):
+            if method == 'GET':
+                return get_connect()
+            conn = put_connect()
+            conn.path, conn.headers = path, headers
+            puts.append(conn)
+            return conn
+        self.stubs.Set(swift.common.bufferedhttp, 'http_connect_raw',
+                       connect)
+        return puts
 
-        self.stubs.Set(swobjects.swiftclient, 'put_object', put_object)
+    def test_sync_object(self):
+        body = ("X" * 3) * 1024
+        etag = hashlib.md5(body).hexdigest()
+        puts = self._stub_connect(body, headers=[('content-length', '3072'),
+                                                 ('etag', etag)])
 
         swobjects.sync_object(self.orig_storage_url,
                               "token", self.dest_storage_url, "token",
                               "cont1", ("etag", "obj1"))
+        self.assertEqual(len(puts), 1)
+        self.assertTrue(puts[0].path.endswith('/cont1/obj1'))
+        self.assertEqual(puts[0].headers['transfer-encoding'], 'chunked')
+        self.assertEqual(puts[0].headers['etag'], etag)
+        self.assertNotIn('content-length', puts[0].headers)
+        self.assertIn('x-auth-token', puts[0].headers)
+        self.assertEqual(dechunk(''.join(puts[0].sent)), body)
+
+    def test_sync_object_raise_overload(self):
+        self._stub_connect("FOO", put_status=503)
+        self.assertRaises(swiftclient.ClientException,
+                          swobjects.sync_object, self.orig_storage_url,
+                          "token", self.dest_storage_url, "token",
+                          "cont1", ("etag", "obj1"))
 
     def test_sync_object_utf8(self):
         utf_obj = "யாமறிந்த"
-        body = "FOO"
-        new_connect = fake_http_connect(200, body)
-        self.stubs.Set(swift.common.bufferedhttp,
-                       'http_connect_raw', new_connect)
-
-        def put_object(url, name=None, headers=None, contents=None):
-            # Container is Quoted
-            self.assertFalse(isinstance(url.split("/")[-1], unicode))
-            self.assertEqual(utf_obj, name)
-
-        self.stubs.Set(swobjects.swiftclient, 'put_object', put_object)
+        puts = self._stub_connect("FOO")
 
         swobjects.sync_object(self.orig_storage_url,
                               "token", self.dest_storage_url, "token",
                               "contגלאָז", ("etag", utf_obj))
+        # Container and object are quoted
+        self.assertFalse(isinstance(puts[0].path, unicode))
+        self.assertEqual(puts[0].path, swobjects.quote(
+            '/AUTH_%s/contגלאָז/%s' % (self.tenant_id, utf_obj)))
+
+    def test_sync_object_origin_md5_mismatch(self):
+        puts = self._stub_connect("FOO", headers=[('etag', '"etag"')])
+        self.stubs.Set(swsync.utils, 'METRICS', None)
+
+        self.assertFalse(swobjects.sync_object(
+            self.orig_storage_url, "token", self.dest_storage_url, "token",
+            "cont1", ("etag", "obj1")))
+        # The upload is aborted before its last chunk.
+        self.assertEqual(dechunk(''.join(puts[0].sent) + '\r\n0\r\n'),
+                         'FOO')
+        self.assertFalse(''.join(puts[0].sent).endswith('0\r\n\r\n'))
+        self.assertTrue(puts[0].closed)
+        self.assertEqual(swsync.utils.get_metrics().value(
+            'objects_mismatch'), 1)
+
+    def test_put_object_stream_dest_md5_mismatch(self):
+        self._stub_connect('', put_headers={'etag': 'etag'})
+        self.assertRaises(swobjects.IntegrityError,
+                          swobjects.put_object_stream,
+                          self.dest_storage_url, "token", "cont1", "obj1",
+                          {}, iter(['FOO']))
+
+    def test_put_object_stream_integrity_report(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        swsync.utils.CONFIG.set('sync', 'integrity_report', path)
+        self.stubs.Set(swsync.utils, 'INTEGRITY', None)
+        etag = hashlib.md5('FOO').hexdigest()
+        self._stub_connect('', put_headers={'etag': etag})
+
+        swobjects.put_object_stream(self.dest_storage_url, "token",
+                                    "cont1", "obj1", {'etag': etag},
+                                    iter(['F', 'OO']))
+        swsync.utils.get_integrity_report().close()
+        with open(path) as fp:
+            entry = json.loads(fp.read())
+        self.assertEqual(entry['account'], self.tenant_id)
+        self.assertEqual((entry['name'], entry['bytes'], entry['md5']),
+                         ('obj1', 3, etag))
+        self.assertEqual(entry['status'], 'verified')
+
+    def test_put_object_stream_readinto(self):
+        puts = self._stub_connect('')
+        self.stubs.Set(swsync.utils, 'BUFFERS', None)
+        body = swobjects.ObjectBody(FakeReadintoResp('X' * 100), 10,
+                                    lambda resp=None: None)
+        pool = swsync.utils.get_buffers()
+        buf = bytearray(32)
+        pool.put(buf)
+
+        swobjects.put_object_stream(self.dest_storage_url, "token",
+                                    "cont1", "obj1", {}, body)
+        # The body is sent by 4 chunks read into the buffer of the pool.
+        self.assertEqual(dechunk(''.join(puts[0].sent)), 'X' * 100)
+        self.assertEqual(len(puts[0].sent), 4 * 2 + 1)
+        self.assertIs(pool.get(), buf)
+
+    def test_put_object_stream_empty(self):
+        puts = self._stub_connect('')
+        swobjects.put_object_stream(self.dest_storage_url, "token",
+                                    "cont1", "obj1", {}, iter(['']))
+        self.assertEqual(''.join(puts[0].sent), '0\r\n\r\n')
 
     def test_get_object_chunked(self):
         chunk_size = 32
@@ -172,3 +311,611 @@ class TestObject(test_base.TestCase):
                           swobjects.get_object,
                           self.orig_storage_url, "token", "cont1", "obj1",
                           response_timeout=1)
+
+    def test_get_object_pooled(self):
+        conn_pool = swsync.connpool.ConnectionPool(
+            fake_http_connect(200, body='foobar'))
+
+        headers, gen = swobjects.get_object(self.orig_storage_url,
+                                            "token", "cont1", "obj1",
+                                            resp_chunk_size=2,
+                                            conn_pool=conn_pool)
+        self.assertEqual(''.join(gen), 'foobar')
+        semaphore, idle = conn_pool.hosts.values()[0]
+        self.assertEqual(len(idle), 1)
+        self.assertEqual(idle[0][1].request[0], 'GET')
+        self.assertEqual(semaphore.balance, conn_pool.max_per_host)
+
+    def test_get_object_pooled_not_fully_read(self):
+        conn_pool = swsync.connpool.ConnectionPool(
+            fake_http_connect(200, body='foobar'))
+
+        headers, gen = swobjects.get_object(self.orig_storage_url,
+                                            "token", "cont1", "obj1",
+                                            resp_chunk_size=2,
+                                            conn_pool=conn_pool)
+        gen.next()
+        gen.close()
+        semaphore, idle = conn_pool.hosts.values()[0]
+        self.assertFalse(idle)
+        self.assertEqual(semaphore.balance, conn_pool.max_per_host)
+
+    def test_get_object_pooled_not_found(self):
+        conn_pool = swsync.connpool.ConnectionPool(fake_http_connect(404))
+        self.assertRaises(swiftclient.ClientException,
+                          swobjects.get_object,
+                          self.orig_storage_url, "token", "cont1", "obj1",
+                          conn_pool=conn_pool)
+        semaphore, idle = conn_pool.hosts.values()[0]
+        self.assertEqual(len(idle), 1)
+
+    def test_http_connect(self):
+        https = eventlet.green.httplib.HTTPSConnection
+        conn = swobjects.http_connect('http://swift.example.com/v1/AUTH_a')
+        self.assertFalse(isinstance(conn, https))
+        self.assertEqual((conn.host, conn.port), ('swift.example.com', 80))
+        conn = swobjects.http_connect('http://swift.example.com:8080/v1')
+        self.assertEqual(conn.port, 8080)
+
+        conn = swobjects.http_connect('https://swift.example.com/v1/AUTH_a')
+        self.assertTrue(isinstance(conn, https))
+        self.assertEqual((conn.host, conn.port), ('swift.example.com', 443))
+        conn = swobjects.http_connect('https://swift.example.com:8443/v1')
+        self.assertTrue(isinstance(conn, https))
+        self.assertEqual(conn.port, 8443)
+
+    def _fake_range_get_object(self, body, requests, running=None,
+                               read=None):
+        def get_object(url, token, container, name, headers=None,
+                       resp_chunk_size=None, **kwargs):
+            requests.append(headers)
+            if running is not None:
+                running.append(True)
+                eventlet.sleep(0)
+            start, end = [int(x) for x in
+                          headers['range'].split('=')[1].split('-')]
+            if running is not None:
+                running.pop()
+
+            def object_body():
+                for i in xrange(start, end + 1, resp_chunk_size):
+                    if read is not None:
+                        read.append(i)
+                    yield body[i:min(i + resp_chunk_size, end + 1)]
+            return ({'etag': 'etag',
+                     'content-length': str(end - start + 1),
+                     'content-range': 'bytes %d-%d/%d' % (
+                         start, end, len(body))},
+                    object_body())
+        return get_object
+
+    def test_get_object_ranges(self):
+        body = 'abcdefghijklmnopqrstuvwxyz'
+        requests = []
+        self.stubs.Set(swobjects, 'get_object',
+                       self._fake_range_get_object(body, requests))
+
+        headers, gen = swobjects.get_object_ranges(
+            self.orig_storage_url, 'token', 'cont1', 'obj1', 4, 2)
+        self.assertEqual(headers['content-length'], str(len(body)))
+        self.assertNotIn('content-range', headers)
+        chunks = list(gen)
+        self.assertEqual(''.join(chunks), body)
+        self.assertEqual(len(chunks), 7)
+        self.assertEqual(requests[1]['if-match'], 'etag')
+
+    def test_get_object_ranges_bounded(self):
+        body = 'X' * 100
+        requests = []
+        running = []
+        max_running = []
+        self.stubs.Set(swobjects, 'get_object',
+                       self._fake_range_get_object(body, requests, running))
+
+        headers, gen = swobjects.get_object_ranges(
+            self.orig_storage_url, 'token', 'cont1', 'obj1', 10, 3)
+        for chunk in gen:
+            # Only range_concurrency ranges are fetched ahead.
+            max_running.append(len(requests))
+            eventlet.sleep(0)
+        self.assertEqual(len(requests), 10)
+        self.assertTrue(max_running[0] <= 4)
+
+    def test_get_object_ranges_streamed(self):
+        body = 'X' * 1000
+        read = []
+        self.stubs.Set(swobjects, 'get_object',
+                       self._fake_range_get_object(body, [], read=read))
+
+        headers, gen = swobjects.get_object_ranges(
+            self.orig_storage_url, 'token', 'cont1', 'obj1', 100, 3,
+            chunk_size=2)
+        consumed = 0
+        for chunk in gen:
+            consumed += 1
+            eventlet.sleep(0)
+            # The ranges fetched ahead are read by chunks and only up
+            # to RANGE_READ_AHEAD of them are buffered.
+            self.assertTrue(len(read) - consumed <=
+                            3 * (swobjects.RANGE_READ_AHEAD + 1) + 1)
+        self.assertEqual(consumed, 500)
+        self.assertEqual(len(read), 500)
+
+    def test_get_object_ranges_short(self):
+        requests = []
+        get_object = self._fake_range_get_object('X' * 10, requests)
+
+        def short_get_object(*args, **kwargs):
+            headers, body = get_object(*args, **kwargs)
+            if len(requests) > 1:
+                body = (x for x in [''.join(body)[:-1]])
+            return headers, body
+        self.stubs.Set(swobjects, 'get_object', short_get_object)
+
+        headers, gen = swobjects.get_object_ranges(
+            self.orig_storage_url, 'token', 'cont1', 'obj1', 4, 2)
+        self.assertEqual(gen.next(), 'XXXX')
+        self.assertRaises(swiftclient.ClientException, list, gen)
+
+    def test_get_object_ranges_not_supported(self):
+        called = []
+
+        def get_object(url, token, container, name, headers=None, **kwargs):
+            called.append(headers)
+            return ({'etag': 'etag'}, (x for x in ['foobar']))
+        self.stubs.Set(swobjects, 'get_object', get_object)
+
+        headers, body = swobjects.get_object_ranges(
+            self.orig_storage_url, 'token', 'cont1', 'obj1', 4, 2)
+        self.assertEqual(''.join(body), 'foobar')
+        self.assertEqual(called[1], None)
+
+    def _base_sync_metadata(self, orig_headers, dest_headers):
+        post_called = []
+
+        def get_object(url, token, container, name, method=None, **kwargs):
+            self.assertEqual(method, 'HEAD')
+            return (orig_headers, '')
+        self.stubs.Set(swobjects, 'get_object', get_object)
+
+        def head_object(url, token, container, name, **kwargs):
+            return dest_headers
+        self.stubs.Set(swobjects.swiftclient, 'head_object', head_object)
+
+        def post_object(url, token, container, name, headers, **kwargs):
+            post_called.append(headers)
+        self.stubs.Set(swobjects.swiftclient, 'post_object', post_object)
+
+        ret = swobjects.sync_object_metadata(
+            self.orig_storage_url, "token", self.dest_storage_url, "token",
+            "cont1", "obj1")
+        return ret, post_called
+
+    def test_sync_object_metadata(self):
+        ret, post_called = self._base_sync_metadata(
+            {'x-object-meta-foo': 'bar', 'content-type': 'text/plain',
+             'etag': 'h1', 'x-timestamp': '2'},
+            {'x-object-meta-foo': 'baz', 'x-object-meta-old': 'old',
+             'content-type': 'text/plain', 'etag': 'h1',
+             'x-timestamp': '1'})
+        self.assertNotEqual(ret, False)
+        self.assertEqual(post_called, [{'x-object-meta-foo': 'bar',
+                                        'content-type': 'text/plain'}])
+
+    def test_sync_object_metadata_same(self):
+        ret, post_called = self._base_sync_metadata(
+            {'x-object-meta-foo': 'bar', 'x-timestamp': '2'},
+            {'x-object-meta-foo': 'bar', 'x-timestamp': '1'})
+        self.assertTrue(ret)
+        self.assertFalse(post_called)
+
+    def test_bulk_delete_limit(self):
+        conn = fake_http_connect(200, body=json.dumps(
+            {'bulk_delete': {'max_deletes_per_request': 1000}}))()
+        conn.request = lambda method, path: conn.putrequest(method, path)
+        self.stubs.Set(swobjects, 'http_connect', lambda url: conn)
+        self.assertEqual(swobjects.bulk_delete_limit(self.dest_storage_url),
+                         1000)
+        self.assertEqual(conn.request, ('GET', '/info'))
+        self.assertTrue(conn.closed)
+
+    def test_bulk_delete_limit_unsupported(self):
+        conn = fake_http_connect(200, body=json.dumps({'swift': {}}))()
+        conn.request = lambda method, path: None
+        self.stubs.Set(swobjects, 'http_connect', lambda url: conn)
+        self.assertEqual(swobjects.bulk_delete_limit(self.dest_storage_url),
+                         0)
+
+    def _stub_bulk_delete(self, result):
+        conns = []
+
+        def connect(host, port, method, path, headers=None, **kwargs):
+            conn = fake_http_connect(200, body=json.dumps(result))()
+            conn.path, conn.headers = path, headers
+            conns.append(conn)
+            return conn
+        self.stubs.Set(swift.common.bufferedhttp, 'http_connect_raw',
+                       connect)
+        return conns
+
+    def test_bulk_delete(self):
+        conns = self._stub_bulk_delete(
+            {'Response Status': '400 Bad Request', 'Number Deleted': 1,
+             'Errors': [['/cont1/obj%202', '409 Conflict']]})
+
+        self.assertEqual(swobjects.bulk_delete(
+            self.dest_storage_url, 'token', 'cont1', ['obj1', 'obj 2']),
+            ['obj 2'])
+        self.assertTrue(conns[0].path.endswith('?bulk-delete'))
+        self.assertEqual(sorted(''.join(conns[0].sent).split('\n')),
+                         ['/cont1/obj%202', '/cont1/obj1'])
+
+    def test_bulk_delete_unavailable(self):
+        self._stub_bulk_delete({'Response Status': '503 Unavailable',
+                                'Errors': []})
+        self.assertRaises(swiftclient.ClientException,
+                          swobjects.bulk_delete, self.dest_storage_url,
+                          'token', 'cont1', ['obj1', 'obj2'])
+
+    def test_bulk_upload_supported(self):
+        conn = fake_http_connect(200, body=json.dumps(
+            {'bulk_upload': {'max_containers_per_extraction': 10000}}))()
+        conn.request = lambda method, path: None
+        self.stubs.Set(swobjects, 'http_connect', lambda url: conn)
+        self.assertTrue(swobjects.bulk_upload_supported(
+            self.dest_storage_url))
+
+    def test_archive_objects(self):
+        bodies = {'obj1': 'foo', 'obj2.txt': 'barbaz', 'obj3': 'qux',
+                  'obj4': '', 'obj 6': 'quux', u'caf\xe9': 'corge'}
+        headers = {'obj1': {'content-type': 'application/octet-stream'},
+                   'obj2.txt': {'content-type': 'text/plain',
+                                'x-object-meta-foo': 'bar'},
+                   'obj3': {}, 'obj 6': {}, u'caf\xe9': {},
+                   'obj4': {'x-object-manifest': 'segments/obj4'}}
+
+        def get_object(url, token, container, name, **kwargs):
+            if name == 'gone':
+                raise swiftclient.ClientException('TESTED', http_status=404)
+            return (dict(headers[name], etag=hashlib.md5(
+                bodies[name]).hexdigest(), **{
+                    'content-length': len(bodies[name])}), bodies[name])
+        self.stubs.Set(swobjects, 'get_object', get_object)
+        posted = []
+        self.stubs.Set(swobjects, 'post_object',
+                       lambda url, token, container, name, headers,
+                       **kwargs: posted.append((name, headers)))
+        conns = self._stub_bulk_delete(
+            {'Response Status': '400 Bad Request', 'Number Files Created': 2,
+             # The paths of the failed objects, and the ones of the
+             # older releases.
+             'Errors': [['cont1/obj3', '503 Service Unavailable'],
+                        [urlparse.urlparse(self.dest_storage_url).path +
+                         '/cont1/obj%206', '503 Service Unavailable'],
+                        ['cont1/caf%C3%A9', '503 Service Unavailable']]})
+
+        names = [('1', x) for x in ('obj1', 'obj2.txt', 'obj3', 'obj4',
+                                    'gone', '/obj5', 'obj 6', u'caf\xe9')]
+        self.assertEqual(sorted(swobjects.archive_objects(
+            self.orig_storage_url, 'token', self.dest_storage_url, 'token',
+            'cont1', names)), [('1', '/obj5'), ('1', u'caf\xe9'),
+                               ('1', 'gone'), ('1', 'obj 6'), ('1', 'obj3'),
+                               ('1', 'obj4')])
+        self.assertTrue(conns[0].path.endswith('/cont1?extract-archive=tar'))
+        tar = tarfile.open(fileobj=StringIO.StringIO(''.join(conns[0].sent)))
+        self.assertEqual(dict((x.name, tar.extractfile(x).read())
+                              for x in tar.getmembers()),
+                         {'obj1': 'foo', 'obj2.txt': 'barbaz',
+                          'obj3': 'qux', 'obj 6': 'quux',
+                          'caf\xc3\xa9': 'corge'})
+        # Only the metadata the extraction doesn't set are POSTed.
+        self.assertEqual(posted, [('obj2.txt', {'content-type': 'text/plain',
+                                                'x-object-meta-foo': 'bar'})])
+
+    def _base_verify_metadata(self, dest_headers):
+        def get_object(url, token, container, name, method=None, **kwargs):
+            self.assertEqual(method, 'HEAD')
+            return ({'x-object-meta-foo': 'bar', 'etag': 'h1'}, '')
+        self.stubs.Set(swobjects, 'get_object', get_object)
+
+        def head_object(url, token, container, name, **kwargs):
+            if dest_headers is None:
+                raise swiftclient.ClientException('TESTED', http_status=404)
+            return dest_headers
+        self.stubs.Set(swobjects.swiftclient, 'head_object', head_object)
+        self.stubs.Set(swobjects.swiftclient, 'post_object', None)
+
+        return swobjects.verify_object_metadata(
+            self.orig_storage_url, "token", self.dest_storage_url, "token",
+            "cont1", "obj1")
+
+    def test_verify_object_metadata(self):
+        self.assertEqual(self._base_verify_metadata(
+            {'x-object-meta-foo': 'bar', 'etag': 'h2'}), None)
+        self.assertEqual(self._base_verify_metadata(
+            {'x-object-meta-foo': 'baz', 'etag': 'h1'}), 'post')
+        self.assertEqual(self._base_verify_metadata(None), 'copy')
+
+
+class TestLargeObject(test_base.TestCase):
+    def setUp(self):
+        super(TestLargeObject, self).setUp()
+        tenant_id = fakes.TENANTS_LIST['foo1']['id']
+        self.orig_storage_url = "%s/AUTH_%s" % (fakes.STORAGE_ORIG, tenant_id)
+        self.dest_storage_url = "%s/AUTH_%s" % (fakes.STORAGE_DEST, tenant_id)
+        self.put_called = []
+        self.put_container_called = []
+
+        def head_object(url, token, container, name, **kwargs):
+            if name == 'seg1':
+                return {'etag': '"hash1"'}
+            raise swiftclient.ClientException('Not Found', http_status=404)
+        self.stubs.Set(swobjects.swiftclient, 'head_object', head_object)
+
+        def put_object(url, name=None, headers=None, contents=None,
+                       **kwargs):
+            self.put_called.append((url.split('/')[-1], name, headers,
+                                    contents, kwargs))
+        self.stubs.Set(swobjects.swiftclient, 'put_object', put_object)
+
+        def put_object_stream(url, token, container, name, headers, body,
+                              **kwargs):
+            self.put_called.append((container, name, headers,
+                                    ''.join(body), kwargs))
+        self.stubs.Set(swobjects, 'put_object_stream', put_object_stream)
+
+        def put_container(url, token, container, **kwargs):
+            self.put_container_called.append(container)
+        self.stubs.Set(swobjects.swiftclient, 'put_container',
+                       put_container)
+
+    def test_sync_slo(self):
+        manifest = [{'name': '/segs/seg1', 'hash': 'hash1', 'bytes': 3},
+                    {'name': '/segs/seg2', 'hash': 'hash2', 'bytes': 3}]
+
+        def get_object(url, token, container, name, **kwargs):
+            self.assertEqual(kwargs['query_string'], 'multipart-manifest=get')
+            if container == 'cont1':
+                return ({'x-static-large-object': 'True',
+                         'content-type': 'text/plain;swift_bytes=6',
+                         'etag': 'manifest', 'content-length': '100'},
+                        iter([json.dumps(manifest)]))
+            return ({'etag': 'hash2'}, iter(['BBB']))
+        self.stubs.Set(swobjects, 'get_object', get_object)
+
+        swobjects.sync_object(self.orig_storage_url,
+                              "token", self.dest_storage_url, "token",
+                              "cont1", ("etag", "obj1"))
+        # seg1 is already there, seg2 is copied before the manifest.
+        self.assertEqual([x[:2] for x in self.put_called],
+                         [('segs', 'seg2'), ('cont1', 'obj1')])
+        self.assertEqual(self.put_container_called, ['segs'])
+        _, _, headers, contents, kwargs = self.put_called[1]
+        self.assertEqual(kwargs['query_string'], 'multipart-manifest=put')
+        self.assertEqual(headers['content-type'], 'text/plain')
+        self.assertNotIn('etag', headers)
+        self.assertNotIn('content-length', headers)
+        self.assertEqual(json.loads(contents)[1],
+                         {'path': '/segs/seg2', 'etag': 'hash2',
+                          'size_bytes': 3})
+
+    def test_sync_dlo(self):
+        def get_object(url, token, container, name, **kwargs):
+            if container == 'cont1':
+                return ({'x-object-manifest': 'segs/obj1/',
+                         'etag': '"concatenated"'}, iter(['AAABBB']))
+            return ({'etag': 'hash2'}, iter(['BBB']))
+        self.stubs.Set(swobjects, 'get_object', get_object)
+
+        def get_container(url, token, container, prefix=None, **kwargs):
+            self.assertEqual((container, prefix), ('segs', 'obj1/'))
+            return ({}, [{'name': 'seg1', 'hash': 'hash1'},
+                         {'name': 'seg2', 'hash': 'hash2'}])
+        self.stubs.Set(swobjects.swiftclient, 'get_container', get_container)
+
+        swobjects.sync_object(self.orig_storage_url,
+                              "token", self.dest_storage_url, "token",
+                              "cont1", ("etag", "obj1"))
+        self.assertEqual([x[:2] for x in self.put_called],
+                         [('segs', 'seg2'), ('cont1', 'obj1')])
+        _, _, headers, contents, _ = self.put_called[1]
+        self.assertEqual(headers['x-object-manifest'], 'segs/obj1/')
+        self.assertEqual(contents, '')
+        self.assertNotIn('etag', headers)
+
+    def test_sync_slo_segment_fail(self):
+        manifest = [{'name': '/segs/seg2', 'hash': 'hash2', 'bytes': 3}]
+
+        def get_object(url, token, container, name, **kwargs):
+            if container == 'cont1':
+                return ({'x-static-large-object': 'True'},
+                        iter([json.dumps(manifest)]))
+            raise swiftclient.ClientException('TESTED')
+        self.stubs.Set(swobjects, 'get_object', get_object)
+
+        self.assertFalse(swobjects.sync_object(
+            self.orig_storage_url, "token", self.dest_storage_url, "token",
+            "cont1", ("etag", "obj1")))
+        self.assertFalse(self.put_called)
+
+
+class FakeSwiftApp(object):
+    """Objects store answering the swsync requests over a real socket."""
+    def __init__(self):
+        self.objects = {}
+        self.headers = {}
+        self.requests = []
+
+    def __call__(self, environ, start_response):
+        method, path = environ['REQUEST_METHOD'], environ['PATH_INFO']
+        self.requests.append((method, path, environ.get('QUERY_STRING')))
+        body = environ['wsgi.input'].read()
+        headers = [('Content-Type', 'text/plain')]
+        if environ.get('QUERY_STRING') == 'bulk-delete':
+            for name in body.split('\n'):
+                self.objects.pop(path + urllib.unquote(name), None)
+            status, body = '200 OK', json.dumps(
+                {'Response Status': '200 OK', 'Errors': []})
+        elif method == 'PUT':
+            self.objects[path] = body
+            status, body = '201 Created', ''
+            headers.append(('Etag', hashlib.md5(self.objects[path])
+                            .hexdigest()))
+        elif path not in self.objects:
+            status, body = '404 Not Found', ''
+        elif method == 'GET':
+            status, body = '200 OK', self.objects[path]
+            headers.append(('Etag', hashlib.md5(body).hexdigest()))
+            headers.extend(self.headers.get(path, {}).items())
+        elif method == 'DELETE':
+            del self.objects[path]
+            status, body = '204 No Content', ''
+        else:
+            status, body = '204 No Content', ''
+        start_response(status, headers + [('Content-Length',
+                                           str(len(body)))])
+        return [body]
+
+
+class TestObjectServer(test_base.TestCase):
+    def setUp(self):
+        super(TestObjectServer, self).setUp()
+        self.app = FakeSwiftApp()
+        sock = eventlet.listen(('127.0.0.1', 0))
+        self.server = eventlet.spawn(eventlet.wsgi.server, sock, self.app,
+                                     log=open(os.devnull, 'w'))
+        self.storage_url = 'http://127.0.0.1:%d/v1/AUTH_test' % (
+            sock.getsockname()[1])
+        self.orig_conn_pool = swsync.connpool.ConnectionPool(
+            swobjects.http_connect)
+        self.dest_conn_pool = swsync.connpool.ConnectionPool(
+            swobjects.http_connect)
+
+    def tearDown(self):
+        self.orig_conn_pool.close()
+        self.dest_conn_pool.close()
+        self.server.kill()
+        super(TestObjectServer, self).tearDown()
+
+    def test_sync_object(self):
+        body = os.urandom(200000)
+        self.app.objects['/v1/AUTH_test/cont/obj 1'] = body
+        self.stubs.Set(swsync.utils, 'BUFFERS',
+                       swsync.buffers.BufferPool(4096, 1))
+        read = []
+        orig_readinto = swobjects._readinto
+
+        def readinto(resp, buf):
+            read.append(len(buf))
+            return orig_readinto(resp, buf)
+        self.stubs.Set(swobjects, '_readinto', readinto)
+
+        dest_storage_url = self.storage_url.replace('AUTH_test', 'AUTH_dest')
+        for _ in xrange(2):
+            self.assertNotEqual(swobjects.sync_object(
+                self.storage_url, 'token', dest_storage_url, 'token',
+                'cont', (None, 'obj 1'), orig_conn_pool=self.orig_conn_pool,
+                dest_conn_pool=self.dest_conn_pool), False)
+            self.assertEqual(self.app.objects['/v1/AUTH_dest/cont/obj 1'],
+                             body)
+        # Python 2 responses are read into the pool buffers too.
+        self.assertTrue(read)
+        # The connections are reused by the next copy.
+        for conn_pool in (self.orig_conn_pool, self.dest_conn_pool):
+            self.assertEqual(len(conn_pool.hosts.values()[0][1]), 1)
+        self.assertEqual([x[0] for x in self.app.requests],
+                         ['GET', 'PUT', 'GET', 'PUT'])
+
+    def test_server_closed_idle_connection(self):
+        accepted = []
+
+        def serve(sock):
+            # Answer a single request per connection then close it as a
+            # proxy reaching its client_timeout does.
+            while True:
+                client, _ = sock.accept()
+                accepted.append(client)
+                data = ''
+                while '\r\n\r\n' not in data:
+                    data += client.recv(4096)
+                client.sendall('HTTP/1.1 200 OK\r\nContent-Length: 3\r\n'
+                               '\r\nfoo')
+                client.close()
+        sock = eventlet.listen(('127.0.0.1', 0))
+        server = eventlet.spawn(serve, sock)
+        self.addCleanup(server.kill)
+        storage_url = 'http://127.0.0.1:%d/v1/AUTH_test' % (
+            sock.getsockname()[1])
+
+        for _ in xrange(2):
+            _, body = swobjects.get_object(
+                storage_url, 'token', 'cont', 'obj', resp_chunk_size=None,
+                conn_pool=self.orig_conn_pool)
+            self.assertEqual(body, 'foo')
+            _, body = swobjects._request(
+                self.dest_conn_pool, storage_url, 'POST', '/v1/AUTH_test/c',
+                {}, 'bar')
+            self.assertEqual(body, 'foo')
+        self.assertEqual(len(accepted), 4)
+
+    def test_sync_dlo(self):
+        # A single origin connection, the one of the manifest GET has
+        # to be given back before the segments are copied.
+        self.orig_conn_pool.max_per_host = 1
+        self.app.objects['/v1/AUTH_test/cont/obj'] = ''
+        self.app.headers['/v1/AUTH_test/cont/obj'] = {
+            'X-Object-Manifest': 'segs/obj/'}
+        self.app.objects['/v1/AUTH_test/segs/obj/1'] = 'foo'
+        self.stubs.Set(swobjects.swiftclient, 'get_container',
+                       lambda *args, **kwargs: ({}, [{'name': 'obj/1',
+                                                      'hash': 'x'}]))
+        self.stubs.Set(swobjects.swiftclient, 'put_container',
+                       lambda *args, **kwargs: None)
+        dest_storage_url = self.storage_url.replace('AUTH_test', 'AUTH_dest')
+        with eventlet.Timeout(5):
+            self.assertNotEqual(swobjects.sync_object(
+                self.storage_url, 'token', dest_storage_url, 'token',
+                'cont', (None, 'obj'), orig_conn_pool=self.orig_conn_pool,
+                dest_conn_pool=self.dest_conn_pool), False)
+        self.assertEqual(self.app.objects['/v1/AUTH_dest/segs/obj/1'], 'foo')
+        self.assertEqual(self.app.objects['/v1/AUTH_dest/cont/obj'], '')
+
+    def test_sync_object_empty(self):
+        self.app.objects['/v1/AUTH_test/cont/obj'] = ''
+        dest_storage_url = self.storage_url.replace('AUTH_test', 'AUTH_dest')
+        for _ in xrange(2):
+            self.assertNotEqual(swobjects.sync_object(
+                self.storage_url, 'token', dest_storage_url, 'token',
+                'cont', (None, 'obj'), orig_conn_pool=self.orig_conn_pool,
+                dest_conn_pool=self.dest_conn_pool), False)
+        self.assertEqual(self.app.objects['/v1/AUTH_dest/cont/obj'], '')
+        self.assertEqual(len(self.orig_conn_pool.hosts.values()[0][1]), 1)
+
+    def test_object_requests(self):
+        self.assertEqual(swobjects.put_object(
+            self.storage_url, 'token', 'cont', 'obj', {}, 'foo',
+            conn_pool=self.dest_conn_pool), hashlib.md5('foo').hexdigest())
+        swobjects.post_object(self.storage_url, 'token', 'cont', 'obj',
+                              {'x-object-meta-foo': 'bar'},
+                              conn_pool=self.dest_conn_pool)
+        self.assertEqual(swobjects.head_object(
+            self.storage_url, 'token', 'cont', 'obj',
+            conn_pool=self.dest_conn_pool)['content-length'], '0')
+        swobjects.delete_object(
+            (urlparse.urlparse(self.storage_url), None), 'token', 'cont',
+            'obj', conn_pool=self.dest_conn_pool)
+        self.assertFalse(self.app.objects)
+        self.assertRaises(swiftclient.ClientException, swobjects.head_object,
+                          self.storage_url, 'token', 'cont', 'obj',
+                          conn_pool=self.dest_conn_pool)
+        self.assertEqual([x[0] for x in self.app.requests],
+                         ['PUT', 'POST', 'HEAD', 'DELETE', 'HEAD'])
+        self.assertEqual(len(self.dest_conn_pool.hosts.values()[0][1]), 1)
+
+    def test_bulk_delete(self):
+        self.app.objects['/v1/AUTH_test/cont/obj 1'] = 'foo'
+        self.app.objects['/v1/AUTH_test/cont/obj2'] = 'bar'
+        self.assertEqual(swobjects.bulk_delete(
+            self.storage_url, 'token', 'cont', ['obj 1', 'obj2'],
+            conn_pool=self.dest_conn_pool), [])
+        self.assertFalse(self.app.objects)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import json
+import StringIO
+
+import swsync.plan
+import tests.units.base as test_base
+
+
+class TestPlan(test_base.TestCase):
+    def test_writer(self):
+        fp = StringIO.StringIO()
+        writer = swsync.plan.PlanWriter(fp)
+        writer.add('a1', 'c1', 'create_container')
+        writer.add('a1', 'c1', 'copy', {'name': 'o1', 'bytes': 10,
+                                        'last_modified': '1'})
+        writer.add('a1', 'c1', 'delete', {'name': 'o2', 'bytes': 5,
+                                          'last_modified': '1'})
+        writer.account_done('a1')
+        writer.error('a2', None, 'TESTED')
+        writer.account_done('a2')
+        self.assertEqual(writer.close((1.0, 5.0)), 2.0)
+
+        lines = [json.loads(x) for x in fp.getvalue().splitlines()]
+        self.assertEqual(lines[1], {'account': 'a1', 'container': 'c1',
+                                    'action': 'copy', 'name': 'o1',
+                                    'bytes': 10, 'last_modified': '1'})
+        summary = lines[3]['summary']
+        self.assertEqual(summary['objects_copy'], 1)
+        self.assertEqual(summary['objects_delete'], 1)
+        self.assertEqual(summary['bytes_copy'], 10)
+        self.assertEqual(summary['containers_create'], 1)
+        self.assertEqual(summary['requests'], 4)
+        self.assertEqual(lines[4], {'account': 'a2', 'container': None,
+                                    'error': 'TESTED'})
+        self.assertEqual(lines[5]['summary']['errors'], 1)
+        self.assertEqual(lines[6]['total']['objects_copy'], 1)
+        self.assertEqual(lines[6]['estimated_seconds'], 2.0)
+
+    def test_estimate(self):
+        summary = swsync.plan.new_summary()
+        summary.update(objects_copy=10, objects_delete=10, bytes_copy=1000)
+        self.assertEqual(swsync.plan.estimate(summary, None), None)
+        self.assertEqual(swsync.plan.estimate(summary, (2.0, 1000.0)), 10)
+        self.assertEqual(swsync.plan.estimate(summary, (20.0, 100.0)), 10)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import StringIO
+import time
+
+import eventlet
+
+import swsync.ratelimit
+import tests.units.base as test_base
+
+
+class TestRateLimit(test_base.TestCase):
+    def setUp(self):
+        super(TestRateLimit, self).setUp()
+        self.now = time.mktime((2013, 1, 1, 12, 0, 0, 0, 0, -1))
+        self.slept = []
+        self.stubs.Set(time, 'time', lambda: self.now)
+        self.stubs.Set(eventlet, 'sleep', self.sleep)
+
+    def sleep(self, seconds=0):
+        self.slept.append(seconds)
+        self.now += seconds
+
+    def test_parse_window(self):
+        self.assertEqual(swsync.ratelimit.parse_window('0830-1900'),
+                         (510, 1140))
+
+    def test_consume(self):
+        bucket = swsync.ratelimit.TokenBucket(10)
+        for _ in xrange(10):
+            bucket.consume(1)
+        self.assertEqual(sum(self.slept), 1)
+        self.now += 1
+        self.slept[:] = []
+        bucket.consume(5)
+        self.assertFalse(self.slept)
+        bucket.consume(10)
+        self.assertEqual(self.slept, [0.5])
+
+    def test_consume_no_limit(self):
+        bucket = swsync.ratelimit.TokenBucket(0)
+        bucket.consume(1000)
+        self.assertFalse(self.slept)
+        self.assertFalse(bucket.enabled)
+
+    def test_windows(self):
+        bucket = swsync.ratelimit.TokenBucket(
+            100, [((540, 1080), 10), ((1320, 360), 0)])
+        self.assertEqual(bucket.rate(self.now), 10)
+        self.assertEqual(bucket.rate(self.now + 7 * 3600), 100)
+        self.assertEqual(bucket.rate(self.now + 11 * 3600), 0)
+        self.assertEqual(bucket.rate(self.now + 15 * 3600), 0)
+        self.assertEqual(bucket.rate(self.now + 20 * 3600), 100)
+
+    def test_throttle(self):
+        limiter = swsync.ratelimit.Limiter(
+            swsync.ratelimit.TokenBucket(0),
+            swsync.ratelimit.TokenBucket(4))
+        self.assertEqual(list(limiter.throttle(iter(['ab', 'cd', 'ef']))),
+                         ['ab', 'cd', 'ef'])
+        self.assertEqual(sum(self.slept), 1.5)
+        reader = limiter.throttle(StringIO.StringIO('abcd'))
+        self.assertEqual(reader.read(4), 'abcd')
+        self.assertEqual(sum(self.slept), 2.5)
+
+    def test_throttle_disabled(self):
+        limiter = swsync.ratelimit.Limiter(
+            swsync.ratelimit.TokenBucket(0),
+            swsync.ratelimit.TokenBucket(0))
+        body = iter(['ab'])
+        self.assertTrue(limiter.throttle(body) is body)
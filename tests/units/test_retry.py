@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import httplib
+import os
+import random
+import shutil
+import socket
+import tempfile
+
+import eventlet
+import eventlet.green.httplib
+import swiftclient
+
+import swsync.retry
+import swsync.utils
+import tests.units.base as test_base
+
+
+class TestRetry(test_base.TestCase):
+    def test_classify(self):
+        classify = swsync.retry.classify
+        self.assertEqual(classify(eventlet.Timeout()), 'timeout')
+        self.assertEqual(classify(socket.timeout()), 'timeout')
+        self.assertEqual(classify(socket.error()), 'network')
+        self.assertEqual(classify(httplib.BadStatusLine('')), 'network')
+        self.assertEqual(classify(eventlet.green.httplib.BadStatusLine('')),
+                         'network')
+        self.assertEqual(classify(swiftclient.ClientException(
+            'TESTED', http_status=503)), 'overload')
+        self.assertEqual(classify(swiftclient.ClientException(
+            'TESTED', http_status=500)), 'server')
+        self.assertEqual(classify(swiftclient.ClientException(
+            'TESTED', http_status=404)), None)
+        self.assertEqual(classify(swiftclient.ClientException('TESTED')),
+                         None)
+
+    def test_policy_delay(self):
+        self.stubs.Set(random, 'uniform', lambda a, b: (a, b))
+        policy = swsync.retry.Policy(5, 1.0, 10)
+        self.assertEqual(policy.delay(0), (0, 1.0))
+        self.assertEqual(policy.delay(2), (0, 4.0))
+        self.assertEqual(policy.delay(6), (0, 10))
+
+    def test_load_policies(self):
+        swsync.utils.CONFIG.set('retry', 'overload_attempts', '8')
+        policies = swsync.retry.load_policies()
+        self.assertEqual(sorted(policies), sorted(
+            swsync.retry.DEFAULT_POLICIES))
+        self.assertEqual(policies['overload'].attempts, 8)
+        self.assertEqual(policies['server'].attempts, 2)
+
+    def test_call(self):
+        self.stubs.Set(random, 'uniform', lambda a, b: 0)
+        policies = {'overload': swsync.retry.Policy(3, 1.0, 10)}
+        called = []
+
+        def func(arg, error=None):
+            called.append(arg)
+            if error is not None and len(called) < 3:
+                raise error
+            return arg
+        self.assertEqual(swsync.retry.call(policies, func, 'a'), 'a')
+        self.assertEqual(called, ['a'])
+
+        called[:] = []
+        error = swiftclient.ClientException('TESTED', http_status=503)
+        self.assertEqual(swsync.retry.call(policies, func, 'a',
+                                           error=error), 'a')
+        self.assertEqual(len(called), 3)
+
+        called[:] = []
+        policies['overload'].attempts = 2
+        self.assertRaises(swiftclient.ClientException, swsync.retry.call,
+                          policies, func, 'a', error=error)
+        self.assertEqual(len(called), 2)
+
+        # Permanent errors are not retried.
+        called[:] = []
+        error = swiftclient.ClientException('TESTED', http_status=404)
+        self.assertRaises(swiftclient.ClientException, swsync.retry.call,
+                          policies, func, 'a', error=error)
+        self.assertEqual(len(called), 1)
+
+    def test_failed_log(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'failed')
+        self.assertEqual(swsync.retry.take_failed(path), [])
+
+        failed_log = swsync.retry.FailedLog(path)
+        failed_log.write({'account': 'a1'})
+        failed_log.write({'account': 'a2', 'container': 'c'})
+        failed_log.close()
+        self.assertEqual(swsync.retry.take_failed(path),
+                         [{'account': 'a1'},
+                          {'account': 'a2', 'container': 'c'}])
+        self.assertEqual(os.listdir(tmpdir), [])
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import time
+
+import swsync.state
+import tests.units.base as test_base
+
+
+class TestSyncState(test_base.TestCase):
+    def setUp(self):
+        super(TestSyncState, self).setUp()
+        self.state = swsync.state.SyncState(':memory:')
+
+    def test_get_unknown(self):
+        self.assertEqual(self.state.get('account', 'cont1'), None)
+
+    def test_set_get(self):
+        self.state.set('account', 'cont1', 10, 100, 'checksum')
+        state = self.state.get('account', 'cont1')
+        self.assertEqual(state['object_count'], 10)
+        self.assertEqual(state['bytes_used'], 100)
+        self.assertEqual(state['listing_checksum'], 'checksum')
+        self.assertTrue(state['synced_at'])
+
+    def test_delete(self):
+        self.state.set('account', 'cont1', 10, 100)
+        self.state.delete('account', 'cont1')
+        self.assertEqual(self.state.get('account', 'cont1'), None)
+
+    def test_unchanged(self):
+        self.state.set('account', 'cont1', 10, 100)
+        self.assertTrue(self.state.unchanged(
+            'account', {'name': 'cont1', 'count': 10, 'bytes': 100}))
+        self.assertFalse(self.state.unchanged(
+            'account', {'name': 'cont1', 'count': 11, 'bytes': 100}))
+        self.assertFalse(self.state.unchanged(
+            'account', {'name': 'cont2', 'count': 10, 'bytes': 100}))
+
+    def test_unchanged_last_modified(self):
+        self.state.set('account', 'cont1', 10, 100, last_modified='1000.0')
+        container = {'name': 'cont1', 'count': 10, 'bytes': 100}
+        self.assertTrue(self.state.unchanged('account', container, '1000.0'))
+        self.assertFalse(self.state.unchanged('account', container, '1001.0'))
+        # Fallback on stats when the stamp is missing.
+        self.assertTrue(self.state.unchanged('account', container))
+        self.state.set('account', 'cont1', 10, 100)
+        self.assertTrue(self.state.unchanged('account', container, '1001.0'))
+
+    def test_marker(self):
+        self.assertEqual(self.state.get_marker('account', 'cont1'), None)
+        self.state.set_marker('account', 'cont1', 'obj1')
+        self.state.set_marker('account', 'cont1', 'obj2')
+        self.assertEqual(self.state.get_marker('account', 'cont1'), 'obj2')
+        self.assertEqual(self.state.get_marker('account', 'cont2'), None)
+        self.state.clear_marker('account', 'cont1')
+        self.assertEqual(self.state.get_marker('account', 'cont1'), None)
+
+    def test_throughput(self):
+        self.assertEqual(self.state.throughput(), None)
+        self.stubs.Set(time, 'time', lambda: 1100.0)
+        self.state.record_run(1000.0, 0, 100, 1000)
+        self.state.record_run(1000.0, 1, 100, 3000)
+        self.stubs.Set(time, 'time', lambda: 2200.0)
+        self.state.record_run(2000.0, 0, 200, 2000)
+        # Runs without anything synced don't tell the throughput.
+        self.state.record_run(3000.0, 0, 0, 0)
+        self.assertEqual(self.state.throughput(), (400 / 300.0,
+                                                   6000 / 300.0))
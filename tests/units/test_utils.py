@@ -58,6 +58,13 @@ class TestAccount(test_base.TestCase):
                                                  _config=cfg),
                          'MEME')
 
+    def test_get_config_no_section_with_default(self):
+        s = StringIO.StringIO("[pasla]\nkey=bar")
+        cfg = swsync.utils.parse_ini(s)
+        self.assertEqual(swsync.utils.get_config('foo', 'key', default='MEME',
+                                                 _config=cfg),
+                         'MEME')
+
     def test_get_config_auto_parsed(self):
         s = StringIO.StringIO("[foo]\nkey=bar")
         cfg = swsync.utils.parse_ini(s)
@@ -70,3 +77,46 @@ class TestAccount(test_base.TestCase):
         self.assertRaises(swsync.utils.ConfigurationError,
                           swsync.utils.get_config,
                           'foo', 'key', _config=cfg)
+
+    def test_get_budget(self):
+        s = StringIO.StringIO("[concurrency]\nsync_swift_client_concurrency=3")
+        swsync.utils.get_config('concurrency', 'sync_swift_client_concurrency',
+                                _config=swsync.utils.parse_ini(s))
+        self.stubs.Set(swsync.utils, 'BUDGET', None)
+        budget = swsync.utils.get_budget()
+        self.assertEqual(budget.balance, 3)
+        self.assertTrue(budget is swsync.utils.get_budget())
+
+    def test_get_budget_max_connections(self):
+        s = StringIO.StringIO("[concurrency]\nsync_swift_client_concurrency=3"
+                              "\nsync_max_connections=12")
+        swsync.utils.get_config('concurrency', 'sync_max_connections',
+                                _config=swsync.utils.parse_ini(s))
+        self.stubs.Set(swsync.utils, 'BUDGET', None)
+        self.assertEqual(swsync.utils.get_budget().balance, 12)
+
+    def test_get_budget_adaptive(self):
+        s = StringIO.StringIO("[concurrency]\nsync_swift_client_concurrency=3"
+                              "\nsync_max_connections=12"
+                              "\nsync_adaptive_concurrency=true"
+                              "\nsync_max_swift_client_concurrency=40")
+        swsync.utils.get_config('concurrency', 'sync_max_connections',
+                                _config=swsync.utils.parse_ini(s))
+        self.stubs.Set(swsync.utils, 'BUDGET', None)
+        self.assertEqual(swsync.utils.get_adaptive_max(), 40)
+        self.assertEqual(swsync.utils.get_budget().balance, 40)
+
+    def test_get_limiter(self):
+        s = StringIO.StringIO("[ratelimit]\n"
+                              "destination_requests_per_second=10\n"
+                              "destination_bytes_per_second=100\n"
+                              "destination_bytes_per_second_0800-1900=20")
+        swsync.utils.get_config('ratelimit', 'destination_bytes_per_second',
+                                _config=swsync.utils.parse_ini(s))
+        self.stubs.Set(swsync.utils, 'LIMITERS', {})
+        limiter = swsync.utils.get_limiter('destination')
+        self.assertEqual(limiter.requests.default_rate, 10)
+        self.assertEqual(limiter.bytes.default_rate, 100)
+        self.assertEqual(limiter.bytes.windows, [((480, 1140), 20)])
+        self.assertTrue(limiter is swsync.utils.get_limiter('destination'))
+        self.assertFalse(swsync.utils.get_limiter('origin').bytes.enabled)
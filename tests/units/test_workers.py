@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import logging
+
+import swsync.workers
+import tests.units.base as test_base
+
+
+class TestWorkers(test_base.TestCase):
+    def test_shard_of(self):
+        self.assertEqual(swsync.workers.shard_of('tenant', 4),
+                         swsync.workers.shard_of(u'tenant', 4))
+        shards = set(swsync.workers.shard_of('tenant%d' % x, 4)
+                     for x in xrange(100))
+        self.assertEqual(shards, set(xrange(4)))
+
+    def test_run(self):
+        progress = []
+
+        def fake_info(msg, *args):
+            progress.append(msg % args)
+        self.stubs.Set(logging, 'info', fake_info)
+
+        def target(index, count, report):
+            report({'accounts': index + 1})
+            report({'accounts': index + 2})
+
+        self.assertEqual(swsync.workers.run(3, target), 0)
+        self.assertEqual(progress[-1], 'PROGRESS: accounts: 9')
+
+    def test_run_failed(self):
+        self.stubs.Set(logging, 'info', lambda *args: None)
+        self.stubs.Set(logging, 'exception', lambda *args: None)
+
+        def target(index, count, report):
+            if index == 1:
+                raise Exception('TESTED')
+
+        self.assertEqual(swsync.workers.run(2, target), 1)
+
+    def test_run_exit_status(self):
+        self.stubs.Set(logging, 'info', lambda *args: None)
+        self.assertEqual(swsync.workers.run(2, lambda *args: args[0]), 1)
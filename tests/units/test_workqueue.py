@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2013 eNovance SAS <licensing@enovance.com>
+#
+# Author: Chmouel Boudjnah <chmouel@enovance.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import eventlet
+import eventlet.event
+import swiftclient
+
+import swsync.retry
+import swsync.workqueue
+import tests.units.base as test_base
+
+
+class TestWorkQueue(test_base.TestCase):
+    def setUp(self):
+        super(TestWorkQueue, self).setUp()
+        self.work_queue = swsync.workqueue.WorkQueue(2, 2)
+
+    def test_batch_wait(self):
+        done = []
+
+        def job(x):
+            eventlet.sleep(0)
+            done.append(x)
+        batch = self.work_queue.batch()
+        for x in xrange(5):
+            batch.submit(job, x)
+        self.assertEqual(batch.wait(), [])
+        self.assertEqual(sorted(done), range(5))
+
+    def test_batch_errors(self):
+        def job(x):
+            if x == 1:
+                return False
+            if x == 2:
+                raise swiftclient.client.ClientException('TESTED')
+        batch = self.work_queue.batch()
+        for x in xrange(4):
+            batch.submit(job, x)
+        self.assertEqual(sorted(batch.wait()), [(1,), (2,)])
+
+    def test_retry(self):
+        calls = []
+
+        def job(x):
+            calls.append(x)
+            if x == 'flaky' and calls.count(x) < 3:
+                raise swiftclient.client.ClientException('TESTED',
+                                                         http_status=503)
+            if x == 'down':
+                raise swiftclient.client.ClientException('TESTED',
+                                                         http_status=500)
+            if x == 'missing':
+                raise swiftclient.client.ClientException('TESTED',
+                                                         http_status=404)
+        self.work_queue.policies = {
+            'overload': swsync.retry.Policy(3, 0, 0),
+            'server': swsync.retry.Policy(2, 0, 0)}
+        batch = self.work_queue.batch()
+        for x in ('flaky', 'down', 'missing'):
+            batch.submit(job, x)
+        self.assertEqual(sorted(batch.wait()), [('down',), ('missing',)])
+        self.assertEqual(calls.count('flaky'), 3)
+        self.assertEqual(calls.count('down'), 2)
+        self.assertEqual(calls.count('missing'), 1)
+
+    def test_low_water_mark(self):
+        events = [eventlet.event.Event() for _ in xrange(3)]
+
+        def job(x):
+            events[x].wait()
+            return x != 1
+        batch = self.work_queue.batch()
+        self.assertEqual(batch.low_water_mark(), 0)
+        self.assertEqual(batch.first_failed(), None)
+        for x in xrange(3):
+            batch.submit(job, x)
+        events[1].send()
+        eventlet.sleep(0)
+        self.assertEqual(batch.low_water_mark(), 0)
+        events[0].send()
+        events[2].send()
+        batch.wait()
+        # The failed job holds the mark.
+        self.assertEqual(batch.low_water_mark(), 1)
+        self.assertEqual(batch.first_failed(), 1)
+
+    def test_batches_share_workers(self):
+        running = []
+        max_running = []
+
+        def job():
+            running.append(True)
+            max_running.append(len(running))
+            eventlet.sleep(0.01)
+            running.pop()
+
+        def producer():
+            batch = self.work_queue.batch()
+            for x in xrange(3):
+                batch.submit(job)
+            batch.wait()
+        pool = eventlet.GreenPool()
+        for x in xrange(3):
+            pool.spawn(producer)
+        pool.waitall()
+        self.assertEqual(len(max_running), 9)
+        self.assertEqual(max(max_running), 2)
+
+    def test_backpressure(self):
+        submitted = []
+        event = eventlet.event.Event()
+
+        def producer():
+            batch = self.work_queue.batch()
+            for x in xrange(10):
+                batch.submit(event.wait)
+                submitted.append(x)
+        eventlet.spawn(producer)
+        eventlet.sleep(0.01)
+        # 2 jobs running and 2 waiting in the queue.
+        self.assertEqual(len(submitted), 4)
+        event.send()